@@ -22,23 +22,30 @@
 WeeWX driver for WeatherLink Live and AirLink
 """
 
-import user.weatherlink_live.db_schema
-from user.weatherlink_live.config_editor import WeatherlinkLiveConfEditor
-from user.weatherlink_live.configurator import WeatherlinkLiveConfigurator
-from user.weatherlink_live.driver import WeatherlinkLiveDriver
+from user.weatherlink_live import observations
 from user.weatherlink_live.static.version import DRIVER_NAME, DRIVER_VERSION
 
-schema = db_schema.db_schema
-db_schema.configure_units()
+observations.configure_units()
+
+
+def __getattr__(name):
+    # The database schema pulls in the schemas of WeeWX, which are only needed when creating a database
+    if name == "schema":
+        from user.weatherlink_live.db_schema import db_schema
+        return db_schema
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
 
 
 def loader(config_dict, engine):
+    from user.weatherlink_live.driver import WeatherlinkLiveDriver
     return WeatherlinkLiveDriver(config_dict, engine)
 
 
 def configurator_loader(_):
+    from user.weatherlink_live.configurator import WeatherlinkLiveConfigurator
     return WeatherlinkLiveConfigurator()
 
 
 def confeditor_loader():
+    from user.weatherlink_live.config_editor import WeatherlinkLiveConfEditor
     return WeatherlinkLiveConfEditor()
@@ -0,0 +1,212 @@
+# Copyright © 2020-2024 Michael Schantl and contributors
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Generation of archive records and downsampled loop records from loop records
+"""
+import logging
+from typing import Dict, List, Optional
+
+from user.weatherlink_live.mappers import AbstractMapping, WindMapping
+from user.weatherlink_live.static import Aggregation
+from user.weatherlink_live.wind import VectorMean
+from weeutil.weeutil import startOfInterval
+
+log = logging.getLogger(__name__)
+
+
+class FieldStats(object):
+    """Incremental statistics of a single observation"""
+
+    __slots__ = ('count', 'total', 'maximum', 'last')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.maximum = None
+        self.last = None
+
+    def add(self, value: float) -> None:
+        self.count += 1
+        self.total += value
+        if self.maximum is None or value > self.maximum:
+            self.maximum = value
+        self.last = value
+
+    def extract(self, aggregation: Aggregation) -> Optional[float]:
+        if self.count < 1:
+            return None
+
+        if aggregation == Aggregation.AVG:
+            return self.total / self.count
+        elif aggregation == Aggregation.SUM:
+            return self.total
+        elif aggregation == Aggregation.MAX:
+            return self.maximum
+        return self.last
+
+
+class WindStats(object):
+    """Vector average and gust of a single wind mapping"""
+
+    def __init__(self, targets: Dict[str, str]):
+        self.targets = targets
+
+        self.mean = VectorMean()
+        self.gust_speed = None
+        self.gust_dir = None
+
+    def add(self, record: dict) -> None:
+        speed = record.get(self.targets['wind_speed'])
+        if speed is None:
+            return
+
+        direction = record.get(self.targets['wind_dir'])
+        self.mean.add(speed, direction)
+
+        if self.gust_speed is None or speed >= self.gust_speed:
+            self.gust_speed = speed
+            self.gust_dir = direction
+
+    def extract(self, archive_record: dict) -> None:
+        if self.mean.count < 1:
+            return
+
+        archive_record[self.targets['wind_speed']] = self.mean.speed
+        archive_record[self.targets['wind_dir']] = self.mean.direction
+        archive_record[self.targets['gust_speed']] = self.gust_speed
+        archive_record[self.targets['gust_dir']] = self.gust_dir
+
+
+class ArchivePeriod(object):
+    """Statistics of all loop records within one archive period"""
+
+    def __init__(self, end_ts: int, aggregations: Dict[str, Aggregation], wind_targets: List[Dict[str, str]]):
+        self.end_ts = end_ts
+        self.aggregations = aggregations
+
+        self.field_stats = dict([(target, FieldStats()) for target in aggregations.keys()])
+        self.wind_stats = [WindStats(targets) for targets in wind_targets]
+
+    def add(self, record: dict) -> None:
+        for target, stats in self.field_stats.items():
+            value = record.get(target)
+            if value is not None:
+                stats.add(value)
+
+        for stats in self.wind_stats:
+            stats.add(record)
+
+    def to_record(self, interval: int, us_units: int) -> dict:
+        archive_record = {
+            'dateTime': self.end_ts,
+            'usUnits': us_units,
+            'interval': interval // 60,
+        }
+
+        for target, stats in self.field_stats.items():
+            value = stats.extract(self.aggregations[target])
+            if value is not None:
+                archive_record[target] = value
+
+        for stats in self.wind_stats:
+            stats.extract(archive_record)
+
+        return archive_record
+
+
+class PeriodAccumulator(object):
+    """
+    Incrementally aggregate loop records over periods of a fixed length
+
+    Each loop record is added to the statistics of its period once. When a record of a later period arrives, the
+    previous period is completed and its aggregated record returned.
+    """
+
+    def __init__(self, mappers: List[AbstractMapping], interval: int, us_units: int):
+        self.interval = interval
+        self.us_units = us_units
+
+        self.aggregations = dict()
+        for mapper in mappers:
+            self.aggregations.update(mapper.aggregations)
+        self.wind_targets = [mapper.targets for mapper in mappers if isinstance(mapper, WindMapping)]
+
+        self.period = None
+
+    def _period_end(self, timestamp: float) -> int:
+        return int(startOfInterval(timestamp, self.interval) + self.interval)
+
+    def add_record(self, record: dict) -> Optional[dict]:
+        """
+        Add a loop record
+
+        :param record: loop record
+        :return: the aggregated record of the previous period, if the record started a new one
+        """
+
+        end_ts = self._period_end(record['dateTime'])
+
+        if self.period is not None and end_ts < self.period.end_ts:
+            log.debug("Loop record at %d belongs to an already completed period. Ignoring", record['dateTime'])
+            return None
+
+        completed_record = None
+        if self.period is None or end_ts > self.period.end_ts:
+            completed_record = self.flush()
+            self.period = ArchivePeriod(end_ts, self.aggregations, self.wind_targets)
+
+        self.period.add(record)
+        return completed_record
+
+    def flush(self) -> Optional[dict]:
+        """Complete the current period and return its aggregated record"""
+
+        if self.period is None:
+            return None
+
+        record = self.period.to_record(self.interval, self.us_units)
+        self.period = None
+        return record
+
+
+class ArchiveAccumulator(PeriodAccumulator):
+    """Incrementally aggregate loop records into archive records"""
+
+    def __init__(self, mappers: List[AbstractMapping], interval: int, us_units: int):
+        if interval < 60 or interval % 60 != 0:
+            raise ValueError("Archive interval has to be a multiple of 60 seconds (got: %d)" % interval)
+
+        super().__init__(mappers, interval, us_units)
+
+
+class LoopDownsampler(PeriodAccumulator):
+    """
+    Aggregate the loop records of a few seconds into a single loop record
+
+    Observations are aggregated the same way as for archive records: averages for most of them, sums for rain amounts,
+    vector averages for wind and the maximum wind speed as gust.
+    """
+
+    def flush(self) -> Optional[dict]:
+        record = super().flush()
+        if record is not None:
+            del record['interval']
+        return record
@@ -0,0 +1,449 @@
+# Copyright © 2020-2024 Michael Schantl and contributors
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+In-memory cache of recent archive records, queried through the WeeWX type system
+"""
+import logging
+import math
+import threading
+from array import array
+from typing import Dict, List, Optional
+
+import weewx
+import weewx.accum
+import weewx.manager
+import weewx.units
+import weewx.xtypes
+from user.weatherlink_live.configuration import create_configuration
+from user.weatherlink_live.db_schema import mapped_observations
+from user.weatherlink_live.static.version import DRIVER_NAME
+from weewx.engine import StdService
+from weewx.units import ValueTuple
+from weewx.xtypes import XType
+
+log = logging.getLogger(__name__)
+
+# Aggregations of archive records answered by the cache, calculated like `weewx.xtypes.ArchiveTable` does
+AGGREGATE_TYPES = ('avg', 'sum', 'min', 'max', 'last', 'count')
+
+# Extractors of the WeeWX accumulator which the cache reproduces from loop packets
+EXTRACTORS = ('avg', 'sum', 'min', 'max', 'last')
+
+
+def _extractor(obs_type: str) -> Optional[str]:
+    """Extractor of the WeeWX accumulator creating the archive record value of an observation"""
+
+    extractor = weewx.accum.accum_dict.get(obs_type, weewx.accum.OBS_DEFAULTS).get('extractor', 'avg')
+    if obs_type == 'windSpeed' and extractor == 'noop':
+        # Extracted as the mean speed of the wind vector
+        extractor = 'avg'
+    return extractor if extractor in EXTRACTORS else None
+
+
+class _IntervalStats(object):
+    """Loop values of an observation within an archive interval, accumulated like the WeeWX accumulator does"""
+
+    __slots__ = ('sum', 'count', 'min', 'max', 'last', 'last_time')
+
+    def __init__(self):
+        self.sum = 0.0
+        self.count = 0
+        self.min = None
+        self.max = None
+        self.last = None
+        self.last_time = None
+
+    def add(self, timestamp: float, value: float) -> None:
+        self.sum += value
+        self.count += 1
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+        if self.last_time is None or timestamp >= self.last_time:
+            self.last = value
+            self.last_time = timestamp
+
+    def extract(self, extractor: str) -> Optional[float]:
+        if not self.count:
+            return None
+        if extractor == 'avg':
+            return self.sum / self.count
+        if extractor == 'sum':
+            return self.sum
+        if extractor == 'min':
+            return self.min
+        if extractor == 'max':
+            return self.max
+        return self.last
+
+
+class RingBuffer(object):
+    """
+    Aggregates of the archive record values of an observation within consecutive bins of equal length
+
+    Like archive records, a bin covers the time span (stop - resolution, stop]. The buffer holds `size` bins. Bins are
+    stored in arrays of doubles, indexed by their stop time modulo the size, so outdated bins are overwritten in place.
+    """
+
+    def __init__(self, resolution: int, size: int, archive_interval: int):
+        self.resolution = resolution
+        self.size = size
+        self.archive_interval = archive_interval
+
+        self._stop = array('d', [0.0]) * size
+        self._sum = array('d', [0.0]) * size
+        self._count = array('d', [0.0]) * size
+        self._min = array('d', [0.0]) * size
+        self._max = array('d', [0.0]) * size
+        self._last = array('d', [0.0]) * size
+
+        # Start of the first archive interval held by the buffer; all records since then are held
+        self.valid_start = None
+        self.latest_stop = None
+
+    def add(self, record_time: int, value: Optional[float]) -> None:
+        """Add the value of an archive record. `None` if the record doesn't contain the observation."""
+
+        stop = math.ceil(record_time / self.resolution) * self.resolution
+        index = (stop // self.resolution) % self.size
+
+        if self._stop[index] != stop:
+            self._stop[index] = stop
+            self._sum[index] = 0.0
+            self._count[index] = 0.0
+
+        if value is not None:
+            count = self._count[index]
+            self._sum[index] += value
+            self._count[index] = count + 1
+            if count == 0 or value < self._min[index]:
+                self._min[index] = value
+            if count == 0 or value > self._max[index]:
+                self._max[index] = value
+            # Records are added in order
+            self._last[index] = value
+
+        if self.valid_start is None:
+            self.valid_start = record_time - self.archive_interval
+        self.latest_stop = stop
+
+    def records(self, start: float, stop: float):
+        """Stop times and values of all archive records within (start, stop]; only for the archive interval"""
+
+        bin_stop = (start // self.resolution + 1) * self.resolution
+        while bin_stop <= stop:
+            index = int(bin_stop // self.resolution) % self.size
+            if self._stop[index] == bin_stop:
+                yield int(bin_stop), self._sum[index] if self._count[index] else None
+            bin_stop += self.resolution
+
+    def covers(self, start: float, stop: float, aligned: bool = True) -> bool:
+        """Whether the buffer holds all archive records of the time span"""
+
+        if self.valid_start is None:
+            return False
+        if aligned and (start % self.resolution != 0 or stop % self.resolution != 0):
+            return False
+        # Records before the start of the cache are only in the database
+        return start >= self.valid_start and start >= self.latest_stop - self.size * self.resolution
+
+    def aggregate(self, start: float, stop: float, aggregate_type: str):
+        """Aggregate of all archive records within (start, stop]"""
+
+        total = count = 0.0
+        minimum = maximum = last = None
+        bin_stop = start + self.resolution
+        while bin_stop <= stop:
+            index = int(bin_stop // self.resolution) % self.size
+            if self._stop[index] == bin_stop and self._count[index]:
+                total += self._sum[index]
+                count += self._count[index]
+                if minimum is None or self._min[index] < minimum:
+                    minimum = self._min[index]
+                if maximum is None or self._max[index] > maximum:
+                    maximum = self._max[index]
+                last = self._last[index]
+            bin_stop += self.resolution
+
+        if aggregate_type == 'count':
+            return int(count)
+        if count == 0:
+            return None
+        if aggregate_type == 'avg':
+            return total / count
+        if aggregate_type == 'sum':
+            return total
+        if aggregate_type == 'min':
+            return minimum
+        if aggregate_type == 'max':
+            return maximum
+        return last
+
+
+class LoopCache(XType):
+    """
+    Cache of recent archive records answering series and aggregate queries of reports
+
+    Loop packets are accumulated per archive interval, like the WeeWX accumulator does for software record generation.
+    When the archive record of an interval is created, the accumulated values are added to a ring buffer per resolution
+    of each observation. Values which differ from the archive record are not reproducible from loop packets (e.g.
+    because the record was recalculated); such observations are no longer cached.
+
+    Queries are answered like `weewx.xtypes.ArchiveTable` would answer them from the archive records of the database.
+    Aggregates that WeeWX takes from the daily summaries, records of a different database and time spans not held by
+    a buffer are passed on to the database by raising `weewx.UnknownType` or `weewx.UnknownAggregation`.
+    """
+
+    def __init__(self, extractors: Dict[str, str], resolutions: List[int], duration: int, archive_interval: int,
+                 database_name: str, table_name: str):
+        self.extractors = extractors
+        self.archive_interval = archive_interval
+        self.database_name = database_name
+        self.table_name = table_name
+
+        # Coarsest resolution first. Archive records are held in the buffer of the archive interval.
+        self._resolutions = sorted(set(resolutions) | {archive_interval}, reverse=True)
+        self._duration = duration
+        self.buffers: Dict[str, List[RingBuffer]] = dict()
+        self._clear()
+
+        # Loop values of archive intervals without a record yet, by end of the interval
+        self._pending: Dict[int, Dict[str, _IntervalStats]] = dict()
+        self.us_units = None
+
+        self.hits = 0
+        self.misses = 0
+        # Reports query the cache from their own thread while the engine thread adds records. Adding a record updates
+        # several arrays of every buffer, so queries have to wait until it is complete.
+        self._lock = threading.Lock()
+
+    def _clear(self) -> None:
+        self.buffers = dict([
+            (observation, [RingBuffer(resolution, math.ceil(self._duration / resolution), self.archive_interval)
+                           for resolution in self._resolutions])
+            for observation in self.extractors
+        ])
+
+    def register(self) -> None:
+        # Ahead of the database, so recent data is taken from the cache
+        if self not in weewx.xtypes.xtypes:
+            weewx.xtypes.xtypes.insert(0, self)
+
+    def unregister(self) -> None:
+        if self in weewx.xtypes.xtypes:
+            weewx.xtypes.xtypes.remove(self)
+
+    def add_packet(self, packet: dict) -> None:
+        timestamp = packet['dateTime']
+        stop = math.ceil(timestamp / self.archive_interval) * self.archive_interval
+
+        interval = self._pending.get(stop)
+        if interval is None:
+            interval = self._pending[stop] = dict()
+        for observation in self.extractors:
+            value = packet.get(observation)
+            # Like the accumulator, NaN is skipped as well
+            if value is None or value != value:
+                continue
+            stats = interval.get(observation)
+            if stats is None:
+                stats = interval[observation] = _IntervalStats()
+            stats.add(timestamp, value)
+
+    def add_record(self, record: dict, origin: str) -> None:
+        record_time = record['dateTime']
+        interval = self._pending.pop(record_time, dict())
+        for stop in [stop for stop in self._pending if stop < record_time]:
+            del self._pending[stop]
+
+        with self._lock:
+            if origin != 'software':
+                # Like the records of a catch-up at startup, which are not created from loop packets
+                if self.us_units is not None:
+                    log.info("Archive record of %d was not generated in software. Clearing loop cache", record_time)
+                self._clear()
+                self.us_units = None
+                return
+
+            if record['usUnits'] != self.us_units:
+                if self.us_units is not None:
+                    log.info("Unit system of archive records changed. Clearing loop cache")
+                self._clear()
+                self.us_units = record['usUnits']
+
+            for observation, extractor in list(self.extractors.items()):
+                stats = interval.get(observation)
+                value = stats.extract(extractor) if stats is not None else None
+                if value != record.get(observation):
+                    log.info("Archive record value of %s differs from the accumulated loop packets (%r instead of %r). "
+                             "Not caching it anymore", observation, record.get(observation), value)
+                    del self.extractors[observation]
+                    del self.buffers[observation]
+                    continue
+                for buffer in self.buffers[observation]:
+                    buffer.add(record_time, value)
+
+    def _check_query(self, obs_type: str, db_manager) -> None:
+        if obs_type not in self.extractors:
+            raise weewx.UnknownType(obs_type)
+        # Only archive records of the binding of the archive are cached
+        if db_manager.database_name != self.database_name or db_manager.table_name != self.table_name:
+            raise weewx.UnknownType(obs_type)
+        # Observations without a column are not stored with the archive record
+        if obs_type not in db_manager.obskeys:
+            raise weewx.UnknownType(obs_type)
+
+    def _buffers(self, obs_type: str, db_manager) -> List[RingBuffer]:
+        """Buffers of an observation; only to be called while holding the lock"""
+
+        # The observation may have been removed since checking the query
+        buffers = self.buffers.get(obs_type)
+        # Records are converted to the unit system of the database when they are stored
+        if buffers is None or self.us_units != db_manager.std_unit_system:
+            self.misses += 1
+            raise weewx.UnknownType(obs_type)
+        return buffers
+
+    def get_series(self, obs_type, timespan, db_manager, aggregate_type=None, aggregate_interval=None,
+                   **option_dict):
+        if aggregate_type:
+            # ArchiveTable splits the series into aggregates, which are taken from the cache one by one
+            raise weewx.UnknownAggregation(aggregate_type)
+        self._check_query(obs_type, db_manager)
+
+        start_vec = list()
+        stop_vec = list()
+        data_vec = list()
+        with self._lock:
+            # Archive records are held by the finest buffer
+            buffer = self._buffers(obs_type, db_manager)[-1]
+            if not buffer.covers(timespan.start, timespan.stop, aligned=False):
+                self.misses += 1
+                raise weewx.UnknownType(obs_type)
+            self.hits += 1
+
+            for record_time, value in buffer.records(timespan.start, timespan.stop):
+                start_vec.append(record_time - self.archive_interval)
+                stop_vec.append(record_time)
+                data_vec.append(value)
+            unit_system = self.us_units if stop_vec else None
+
+        unit, unit_group = weewx.units.getStandardUnitType(unit_system, obs_type)
+        return (ValueTuple(start_vec, 'unix_epoch', 'group_time'),
+                ValueTuple(stop_vec, 'unix_epoch', 'group_time'),
+                ValueTuple(data_vec, unit, unit_group))
+
+    def get_aggregate(self, obs_type, timespan, aggregate_type, db_manager, **option_dict):
+        if aggregate_type not in AGGREGATE_TYPES:
+            raise weewx.UnknownAggregation(aggregate_type)
+        self._check_query(obs_type, db_manager)
+
+        if aggregate_type in weewx.xtypes.DailySummaries.agg_sql_dict:
+            try:
+                weewx.xtypes.DailySummaries.check_eligibility(obs_type, timespan, db_manager, aggregate_type)
+            except (weewx.UnknownType, weewx.UnknownAggregation):
+                pass
+            else:
+                # Taken from the daily summaries, whose minimum and maximum are those of loop packets
+                raise weewx.UnknownAggregation(aggregate_type)
+
+        with self._lock:
+            for buffer in self._buffers(obs_type, db_manager):
+                if buffer.covers(timespan.start, timespan.stop):
+                    self.hits += 1
+                    value = buffer.aggregate(timespan.start, timespan.stop, aggregate_type)
+                    break
+            else:
+                self.misses += 1
+                raise weewx.UnknownType(obs_type)
+
+        unit, unit_group = weewx.units.getStandardUnitType(db_manager.std_unit_system, obs_type, aggregate_type)
+        return ValueTuple(value, unit, unit_group)
+
+
+class WllLoopCacheService(StdService):
+    """
+    Service feeding the loop cache and registering it with the WeeWX type system
+
+    Listed in `xtype_services`, after `StdCalibrate`, `StdQC` and `StdWXCalculate`, so the cache sees loop packets as
+    they are accumulated into archive records.
+    """
+
+    def __init__(self, engine, config_dict):
+        super().__init__(engine, config_dict)
+
+        self.cache = None
+        if DRIVER_NAME not in config_dict:
+            log.error("Section [%s] is missing. Loop cache disabled", DRIVER_NAME)
+            return
+
+        self.configuration = create_configuration(config_dict, DRIVER_NAME)
+        if not self.configuration.cache_resolutions:
+            log.debug("No cache resolutions configured. Loop cache disabled")
+            return
+
+        archive_dict = config_dict.get('StdArchive', {})
+        if self.configuration.archive_records and archive_dict.get('record_generation', 'hardware') == 'hardware':
+            log.warning("Archive records of the driver are not reproducible from loop packets. Loop cache disabled. "
+                        "Use software record generation to enable it")
+            return
+
+        manager_dict = weewx.manager.get_manager_dict_from_config(config_dict,
+                                                                  archive_dict.get('data_binding', 'wx_binding'))
+        self.database_name = manager_dict['database_dict']['database_name']
+        self.table_name = manager_dict['table_name']
+
+        self.bind(weewx.STARTUP, self.startup)
+        self.bind(weewx.NEW_LOOP_PACKET, self.new_loop_packet)
+        self.bind(weewx.NEW_ARCHIVE_RECORD, self.new_archive_record)
+
+    def startup(self, event):
+        # The accumulator is configured by StdArchive, which is loaded after this service
+        extractors = dict()
+        for observation in mapped_observations(self.configuration.create_mappers()):
+            extractor = _extractor(observation)
+            if extractor is not None:
+                extractors[observation] = extractor
+
+        self.cache = LoopCache(extractors,
+                               self.configuration.cache_resolutions,
+                               self.configuration.cache_duration,
+                               self.configuration.archive_interval,
+                               self.database_name,
+                               self.table_name)
+        self.cache.register()
+        log.info("Caching %d observations: %s", len(extractors), ", ".join(extractors))
+
+    def new_loop_packet(self, event):
+        if self.cache is not None:
+            self.cache.add_packet(event.packet)
+
+    def new_archive_record(self, event):
+        if self.cache is not None:
+            self.cache.add_record(event.record, event.origin)
+
+    def shutDown(self):
+        if self.cache is None:
+            return
+        self.cache.unregister()
+        log.info("Loop cache answered %d of %d queries", self.cache.hits, self.cache.hits + self.cache.misses)
+        self.cache = None
@@ -0,0 +1,199 @@
+# Copyright © 2020-2024 Michael Schantl and contributors
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Capture raw device traffic and replay it through packets and mappers
+"""
+import gzip
+import json
+import logging
+import os
+import struct
+import threading
+import time
+from enum import IntEnum
+from typing import Callable, Dict, Iterator, List, NamedTuple, Optional
+
+import weewx
+from user.weatherlink_live.mappers import AbstractMapping
+from user.weatherlink_live.packets import WlHttpConditionsRequestPacket, WlHttpBroadcastStartRequestPacket, \
+    WlUdpBroadcastPacket
+
+log = logging.getLogger(__name__)
+
+MAGIC = b"WLLCAP\x00\x01"
+GZIP_MAGIC = b"\x1f\x8b"
+
+# Receive time, source and length of data
+_ITEM_HEADER = struct.Struct('<dBI')
+
+FLUSH_INTERVAL = 5  # seconds
+
+
+class CaptureSource(IntEnum):
+    HTTP_CONDITIONS = 1
+    HTTP_REAL_TIME = 2
+    UDP_BROADCAST = 3
+
+
+class CapturedData(NamedTuple):
+    timestamp: float
+    source: CaptureSource
+    data: bytes
+
+
+class CaptureWriter(object):
+    """
+    Append raw HTTP responses and UDP datagrams to a capture file
+
+    Each item is stored with its receive time and length. Compressed files are gzip streams; appending to an existing
+    file adds a new gzip member.
+    """
+
+    def __init__(self, path: str, compress: bool):
+        self.path = path
+
+        is_new = not os.path.exists(path) or os.path.getsize(path) == 0
+        if not is_new:
+            with open(path, 'rb') as file:
+                is_compressed = file.read(len(GZIP_MAGIC)) == GZIP_MAGIC
+            if is_compressed != compress:
+                log.warning("Capture file %s is %s. Appending in the same format", path,
+                            "compressed" if is_compressed else "not compressed")
+                compress = is_compressed
+        self.compress = compress
+
+        self._file = gzip.open(path, 'ab') if compress else open(path, 'ab')
+        if is_new:
+            self._file.write(MAGIC)
+        # Written from the scheduler as well as the broadcast reception thread
+        self._lock = threading.Lock()
+        self._last_flush = time.monotonic()
+
+        log.info("Capturing device traffic to %s", path)
+
+    def write(self, source: CaptureSource, data: bytes) -> None:
+        timestamp = time.time()
+        with self._lock:
+            if self._file is None:
+                return
+
+            self._file.write(_ITEM_HEADER.pack(timestamp, source, len(data)))
+            self._file.write(data)
+
+            now = time.monotonic()
+            if now - self._last_flush >= FLUSH_INTERVAL:
+                self._file.flush()
+                self._last_flush = now
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.close()
+            self._file = None
+
+
+def read_capture(path: str) -> Iterator[CapturedData]:
+    """
+    Read items of a capture file
+
+    An item truncated by a crash ends the capture.
+    """
+
+    with open(path, 'rb') as file:
+        is_compressed = file.read(len(GZIP_MAGIC)) == GZIP_MAGIC
+
+    with (gzip.open(path, 'rb') if is_compressed else open(path, 'rb')) as file:
+        if file.read(len(MAGIC)) != MAGIC:
+            raise ValueError("%s is not a capture file" % path)
+
+        while True:
+            try:
+                header = file.read(_ITEM_HEADER.size)
+                if len(header) < _ITEM_HEADER.size:
+                    return
+                timestamp, source, length = _ITEM_HEADER.unpack(header)
+                data = file.read(length)
+                if len(data) < length:
+                    return
+            except EOFError:
+                # Last gzip member is incomplete
+                return
+
+            yield CapturedData(timestamp, CaptureSource(source), data)
+
+
+def replay_capture(path: str,
+                   mappers: List[AbstractMapping],
+                   speed: float,
+                   on_record: Optional[Callable[[dict], None]] = None,
+                   us_units: int = weewx.US) -> Dict[str, float]:
+    """
+    Feed captured data through packets and mappers
+
+    :param path: path of capture file
+    :param mappers: mappers to use for creating records
+    :param speed: replay speed relative to real time; `0` to replay as fast as possible
+    :param on_record: called for every created record
+    :param us_units: unit system the mappers emit
+    :return: statistics of replay
+    """
+
+    stats = {"items": 0, "records": 0, "errors": 0}
+    first_timestamp = None
+    start = time.perf_counter()
+
+    for item in read_capture(path):
+        stats["items"] += 1
+
+        if speed > 0:
+            if first_timestamp is None:
+                first_timestamp = item.timestamp
+            delay = (item.timestamp - first_timestamp) / speed - (time.perf_counter() - start)
+            if delay > 0:
+                time.sleep(delay)
+
+        try:
+            json_data = json.loads(item.data.decode("utf-8"))
+            if item.source == CaptureSource.HTTP_REAL_TIME:
+                WlHttpBroadcastStartRequestPacket.try_create(json_data, path)
+                continue
+            elif item.source == CaptureSource.HTTP_CONDITIONS:
+                packet = WlHttpConditionsRequestPacket.try_create(json_data, path)
+            else:
+                packet = WlUdpBroadcastPacket.try_create(json_data, path)
+        except (ValueError, TypeError, AttributeError, weewx.WeeWxIOError) as e:
+            log.warning("Could not decode captured %s data received at %.3f: %r", item.source.name, item.timestamp, e)
+            stats["errors"] += 1
+            continue
+
+        record = dict()
+        for mapper in mappers:
+            mapper.map(packet, record)
+        record['dateTime'] = packet.timestamp
+        record['usUnits'] = us_units
+        stats["records"] += 1
+
+        if on_record is not None:
+            on_record(record)
+
+    stats["seconds"] = time.perf_counter() - start
+    return stats
@@ -19,20 +19,44 @@
 # SOFTWARE.
 
 import logging
-from typing import List
+import os
+from typing import List, Optional
 
+import weewx
 from user.weatherlink_live.mappers import TMapping, THMapping, WindMapping, RainMapping, SolarMapping, UvMapping, \
     WindChillMapping, ThwMapping, ThswMapping, SoilTempMapping, SoilMoistureMapping, LeafWetnessMapping, \
     THIndoorMapping, BaroMapping, AbstractMapping, BatteryStatusMapping
+from user.weatherlink_live.profiler import ProfileMode
 from user.weatherlink_live.static import config as static_config
 from user.weatherlink_live.static.config import KEY_DRIVER_POLLING_INTERVAL, KEY_DRIVER_HOST, KEY_DRIVER_MAPPING, \
-    KEY_MAX_NO_DATA_ITERATIONS
+    KEY_MAX_NO_DATA_ITERATIONS, KEY_WIND_WINDOWS, KEY_ARCHIVE_RECORDS, KEY_SPOOL_FILE, KEY_SPOOL_SIZE, \
+    KEY_STATE_FILE, KEY_STATE_FLUSH_INTERVAL, KEY_MAX_COMPONENT_RESTARTS, KEY_BROADCAST_ERROR_BUDGET, \
+    KEY_BROADCAST_ERROR_WINDOW, KEY_METRICS, KEY_METRICS_LOG_INTERVAL, \
+    KEY_METRICS_PORT, KEY_PROFILE, KEY_PROFILE_DIRECTORY, KEY_PROFILE_INTERVAL, KEY_PROFILE_DUTY_CYCLE, KEY_PROFILE_KEEP, \
+    KEY_CAPTURE_FILE, KEY_CAPTURE_COMPRESS, KEY_PACKET_LOG_SAMPLING, KEY_PACKET_LOG_RATE_LIMIT, \
+    KEY_SPARSE_LOOP_PACKETS, KEY_SPARSE_REFRESH_INTERVAL, KEY_DOWNSAMPLE_INTERVAL, KEY_UNIT_SYSTEM, \
+    KEY_SAMPLE_FILE, KEY_SAMPLE_FLUSH_INTERVAL, KEY_SAMPLE_RETENTION, KEY_CACHE_RESOLUTIONS, KEY_CACHE_DURATION
 from user.weatherlink_live.utils import to_list
 from weeutil.weeutil import to_bool, to_float, to_int
+from weewx.units import unit_constants
 
 POLLING_INTERVAL_MIN = 10
 POLLING_INTERVAL_DEFAULT = POLLING_INTERVAL_MIN
 NO_DATA_ITERATIONS_DEFAULT = 5
+MAX_COMPONENT_RESTARTS_DEFAULT = 5
+BROADCAST_ERROR_BUDGET_DEFAULT = 10
+BROADCAST_ERROR_WINDOW_DEFAULT = 60
+ARCHIVE_INTERVAL_DEFAULT = 300
+SPOOL_SIZE_DEFAULT = 2880  # 2 hours of broadcasts
+STATE_FLUSH_INTERVAL_DEFAULT = 60
+METRICS_LOG_INTERVAL_DEFAULT = 300
+PROFILE_INTERVAL_DEFAULT = 3600
+PROFILE_DUTY_CYCLE_DEFAULT = 0.05  # 3 minutes per hour
+PROFILE_KEEP_DEFAULT = 10
+SPARSE_REFRESH_INTERVAL_DEFAULT = 300
+SAMPLE_FLUSH_INTERVAL_DEFAULT = 10
+SAMPLE_RETENTION_DEFAULT = 7
+CACHE_DURATION_DEFAULT = 86400
 
 MAPPERS = {
     static_config.KEY_MAPPER_TEMPERATURE_ONLY: TMapping,
@@ -71,6 +95,122 @@ def create_configuration(config: dict, driver_name: str):
     if max_no_data_iterations < 1:
         raise ValueError("%s has to be at least 1" % KEY_MAX_NO_DATA_ITERATIONS)
 
+    max_component_restarts = to_int(driver_dict.get(KEY_MAX_COMPONENT_RESTARTS, MAX_COMPONENT_RESTARTS_DEFAULT))
+    if max_component_restarts < 0:
+        raise ValueError("%s must not be negative" % KEY_MAX_COMPONENT_RESTARTS)
+
+    broadcast_error_budget = to_int(driver_dict.get(KEY_BROADCAST_ERROR_BUDGET, BROADCAST_ERROR_BUDGET_DEFAULT))
+    if broadcast_error_budget < 0:
+        raise ValueError("%s must not be negative" % KEY_BROADCAST_ERROR_BUDGET)
+
+    broadcast_error_window = to_float(driver_dict.get(KEY_BROADCAST_ERROR_WINDOW, BROADCAST_ERROR_WINDOW_DEFAULT))
+    if broadcast_error_window <= 0:
+        raise ValueError("%s has to be positive" % KEY_BROADCAST_ERROR_WINDOW)
+
+    wind_windows = [to_int(window) for window in to_list(driver_dict.get(KEY_WIND_WINDOWS, []))]
+    if any(window < 1 for window in wind_windows):
+        raise ValueError("%s has to be at least 1 second" % KEY_WIND_WINDOWS)
+
+    archive_records = to_bool(driver_dict.get(KEY_ARCHIVE_RECORDS, False))
+    archive_interval = to_int(config.get('StdArchive', {}).get('archive_interval', ARCHIVE_INTERVAL_DEFAULT))
+
+    spool_file = driver_dict.get(KEY_SPOOL_FILE, None)
+    spool_file = os.path.join(config.get('WEEWX_ROOT', ''), spool_file) if spool_file else None
+    if spool_file and not archive_records:
+        raise ValueError("%s requires %s to be enabled" % (KEY_SPOOL_FILE, KEY_ARCHIVE_RECORDS))
+
+    spool_size = to_int(driver_dict.get(KEY_SPOOL_SIZE, SPOOL_SIZE_DEFAULT))
+    if spool_size < 1:
+        raise ValueError("%s has to be at least 1" % KEY_SPOOL_SIZE)
+
+    state_file = driver_dict.get(KEY_STATE_FILE, None)
+    state_file = os.path.join(config.get('WEEWX_ROOT', ''), state_file) if state_file else None
+
+    state_flush_interval = to_float(driver_dict.get(KEY_STATE_FLUSH_INTERVAL, STATE_FLUSH_INTERVAL_DEFAULT))
+    if state_flush_interval < 0:
+        raise ValueError("%s must not be negative" % KEY_STATE_FLUSH_INTERVAL)
+
+    metrics = to_bool(driver_dict.get(KEY_METRICS, False))
+
+    metrics_log_interval = to_float(driver_dict.get(KEY_METRICS_LOG_INTERVAL, METRICS_LOG_INTERVAL_DEFAULT))
+    if metrics_log_interval < 0:
+        raise ValueError("%s must not be negative" % KEY_METRICS_LOG_INTERVAL)
+
+    metrics_port = to_int(driver_dict.get(KEY_METRICS_PORT, 0))
+    if metrics_port < 0 or metrics_port > 65535:
+        raise ValueError("%s has to be a valid port number" % KEY_METRICS_PORT)
+    if metrics_port and not metrics:
+        raise ValueError("%s requires %s to be enabled" % (KEY_METRICS_PORT, KEY_METRICS))
+
+    profile = driver_dict.get(KEY_PROFILE, None)
+    try:
+        profile = ProfileMode(profile.lower()) if profile and profile.lower() != 'none' else None
+    except ValueError as e:
+        raise ValueError("%s has to be one of: none, %s" % (
+            KEY_PROFILE, ", ".join(mode.value for mode in ProfileMode))) from e
+
+    profile_directory = driver_dict.get(KEY_PROFILE_DIRECTORY, None)
+    profile_directory = os.path.join(config.get('WEEWX_ROOT', ''), profile_directory) if profile_directory else None
+    if profile and not profile_directory:
+        raise ValueError("%s requires %s to be set" % (KEY_PROFILE, KEY_PROFILE_DIRECTORY))
+
+    profile_interval = to_float(driver_dict.get(KEY_PROFILE_INTERVAL, PROFILE_INTERVAL_DEFAULT))
+    if profile_interval <= 0:
+        raise ValueError("%s has to be positive" % KEY_PROFILE_INTERVAL)
+
+    profile_duty_cycle = to_float(driver_dict.get(KEY_PROFILE_DUTY_CYCLE, PROFILE_DUTY_CYCLE_DEFAULT))
+    if profile_duty_cycle <= 0 or profile_duty_cycle > 1:
+        raise ValueError("%s has to be more than 0 and at most 1" % KEY_PROFILE_DUTY_CYCLE)
+
+    profile_keep = to_int(driver_dict.get(KEY_PROFILE_KEEP, PROFILE_KEEP_DEFAULT))
+    if profile_keep < 1:
+        raise ValueError("%s has to be at least 1" % KEY_PROFILE_KEEP)
+
+    capture_file = driver_dict.get(KEY_CAPTURE_FILE, None)
+    capture_file = os.path.join(config.get('WEEWX_ROOT', ''), capture_file) if capture_file else None
+    capture_compress = to_bool(driver_dict.get(KEY_CAPTURE_COMPRESS, False))
+
+    downsample_interval = to_int(driver_dict.get(KEY_DOWNSAMPLE_INTERVAL, 0))
+    if downsample_interval < 0:
+        raise ValueError("%s must not be negative" % KEY_DOWNSAMPLE_INTERVAL)
+    if downsample_interval and archive_interval % downsample_interval != 0:
+        raise ValueError("%s has to divide the archive interval of %d seconds evenly" % (
+            KEY_DOWNSAMPLE_INTERVAL, archive_interval))
+
+    sparse_loop_packets = to_bool(driver_dict.get(KEY_SPARSE_LOOP_PACKETS, False))
+
+    sparse_refresh_interval = to_float(driver_dict.get(KEY_SPARSE_REFRESH_INTERVAL, SPARSE_REFRESH_INTERVAL_DEFAULT))
+    if sparse_refresh_interval <= 0:
+        raise ValueError("%s has to be positive" % KEY_SPARSE_REFRESH_INTERVAL)
+
+    unit_system_name = driver_dict.get(KEY_UNIT_SYSTEM, 'US').upper()
+    try:
+        unit_system = unit_constants[unit_system_name]
+    except KeyError as e:
+        raise ValueError("%s has to be one of: %s" % (KEY_UNIT_SYSTEM, ", ".join(unit_constants.keys()))) from e
+
+    sample_file = driver_dict.get(KEY_SAMPLE_FILE, None)
+    sample_file = os.path.join(config.get('WEEWX_ROOT', ''), sample_file) if sample_file else None
+
+    sample_flush_interval = to_float(driver_dict.get(KEY_SAMPLE_FLUSH_INTERVAL, SAMPLE_FLUSH_INTERVAL_DEFAULT))
+    if sample_flush_interval <= 0:
+        raise ValueError("%s has to be positive" % KEY_SAMPLE_FLUSH_INTERVAL)
+
+    sample_retention = to_int(driver_dict.get(KEY_SAMPLE_RETENTION, SAMPLE_RETENTION_DEFAULT))
+    if sample_retention < 1:
+        raise ValueError("%s has to be at least 1" % KEY_SAMPLE_RETENTION)
+
+    cache_duration = to_int(driver_dict.get(KEY_CACHE_DURATION, CACHE_DURATION_DEFAULT))
+    if cache_duration < 1:
+        raise ValueError("%s has to be at least 1" % KEY_CACHE_DURATION)
+
+    cache_resolutions = [to_int(resolution) for resolution in to_list(driver_dict.get(KEY_CACHE_RESOLUTIONS, []))]
+    if any(resolution < 1 or resolution > cache_duration for resolution in cache_resolutions):
+        raise ValueError("Each of %s has to be between 1 and %s" % (KEY_CACHE_RESOLUTIONS, KEY_CACHE_DURATION))
+    if any(resolution % archive_interval != 0 for resolution in cache_resolutions):
+        raise ValueError("Each of %s has to be a multiple of the archive interval of %d seconds" % (
+            KEY_CACHE_RESOLUTIONS, archive_interval))
+
     mapping_list = to_list(driver_dict[KEY_DRIVER_MAPPING])
     mappings = parse_mapping_definitions(mapping_list)
     if len(mappings) < 1:
@@ -82,6 +222,14 @@ def create_configuration(config: dict, driver_name: str):
     log_error = to_bool(config.get(static_config.KEY_LOG_FAILURE, True))
     log_error = to_bool(driver_dict.get(static_config.KEY_LOG_FAILURE, log_error))
 
+    packet_log_sampling = to_int(driver_dict.get(KEY_PACKET_LOG_SAMPLING, 1))
+    if packet_log_sampling < 1:
+        raise ValueError("%s has to be at least 1" % KEY_PACKET_LOG_SAMPLING)
+
+    packet_log_rate_limit = to_int(driver_dict.get(KEY_PACKET_LOG_RATE_LIMIT, 0))
+    if packet_log_rate_limit < 0:
+        raise ValueError("%s must not be negative" % KEY_PACKET_LOG_RATE_LIMIT)
+
     socket_timeout = to_float(config.get('socket_timeout', 20))
 
     config_obj = Configuration(
@@ -89,9 +237,40 @@ def create_configuration(config: dict, driver_name: str):
         mappings=mappings,
         polling_interval=polling_interval,
         max_no_data_iterations=max_no_data_iterations,
+        max_component_restarts=max_component_restarts,
+        broadcast_error_budget=broadcast_error_budget,
+        broadcast_error_window=broadcast_error_window,
         log_success=log_success,
         log_error=log_error,
-        socket_timeout=socket_timeout
+        packet_log_sampling=packet_log_sampling,
+        packet_log_rate_limit=packet_log_rate_limit,
+        socket_timeout=socket_timeout,
+        wind_windows=wind_windows,
+        archive_records=archive_records,
+        archive_interval=archive_interval,
+        spool_file=spool_file,
+        spool_size=spool_size,
+        state_file=state_file,
+        state_flush_interval=state_flush_interval,
+        metrics=metrics,
+        metrics_log_interval=metrics_log_interval,
+        metrics_port=metrics_port,
+        profile=profile,
+        profile_directory=profile_directory,
+        profile_interval=profile_interval,
+        profile_duty_cycle=profile_duty_cycle,
+        profile_keep=profile_keep,
+        capture_file=capture_file,
+        capture_compress=capture_compress,
+        downsample_interval=downsample_interval,
+        sparse_loop_packets=sparse_loop_packets,
+        sparse_refresh_interval=sparse_refresh_interval,
+        unit_system=unit_system,
+        sample_file=sample_file,
+        sample_flush_interval=sample_flush_interval,
+        sample_retention=sample_retention,
+        cache_resolutions=cache_resolutions,
+        cache_duration=cache_duration
     )
     return config_obj
 
@@ -114,11 +293,13 @@ def build_mapping_definitions(mapping_definitions: MappingDefinitionList) -> Lis
 
 def create_mappers(mapping_definitions: MappingDefinitionList,
                    log_success: bool,
-                   log_error: bool) -> List[AbstractMapping]:
+                   log_error: bool,
+                   unit_system: int = weewx.US) -> List[AbstractMapping]:
     used_record_keys = []
     mappers = []
     for source_opts in mapping_definitions:
         mapper = _create_mapper(source_opts, used_record_keys, log_success, log_error)
+        mapper.set_unit_system(unit_system)
         mappers.append(mapper)
         used_record_keys.extend(mapper.targets.values())
     return mappers
@@ -150,20 +331,82 @@ class Configuration(object):
                  mappings: MappingDefinitionList,
                  polling_interval: float,
                  max_no_data_iterations: int,
+                 max_component_restarts: int,
+                 broadcast_error_budget: int,
+                 broadcast_error_window: float,
                  log_success: bool,
                  log_error: bool,
-                 socket_timeout: float):
+                 packet_log_sampling: int,
+                 packet_log_rate_limit: int,
+                 socket_timeout: float,
+                 wind_windows: List[int],
+                 archive_records: bool,
+                 archive_interval: int,
+                 spool_file: Optional[str],
+                 spool_size: int,
+                 state_file: Optional[str],
+                 state_flush_interval: float,
+                 metrics: bool,
+                 metrics_log_interval: float,
+                 metrics_port: int,
+                 profile: Optional[ProfileMode],
+                 profile_directory: Optional[str],
+                 profile_interval: float,
+                 profile_duty_cycle: float,
+                 profile_keep: int,
+                 capture_file: Optional[str],
+                 capture_compress: bool,
+                 downsample_interval: int,
+                 sparse_loop_packets: bool,
+                 sparse_refresh_interval: float,
+                 unit_system: int,
+                 sample_file: Optional[str],
+                 sample_flush_interval: float,
+                 sample_retention: int,
+                 cache_resolutions: List[int],
+                 cache_duration: int):
         self.host = host
         self.mappings = mappings
         self.polling_interval = polling_interval
         self.max_no_data_iterations = max_no_data_iterations
+        self.max_component_restarts = max_component_restarts
+        self.broadcast_error_budget = broadcast_error_budget
+        self.broadcast_error_window = broadcast_error_window
 
         self.log_success = log_success
         self.log_error = log_error
+        self.packet_log_sampling = packet_log_sampling
+        self.packet_log_rate_limit = packet_log_rate_limit
         self.socket_timeout = socket_timeout
+        self.wind_windows = wind_windows
+        self.archive_records = archive_records
+        self.archive_interval = archive_interval
+        self.spool_file = spool_file
+        self.spool_size = spool_size
+        self.state_file = state_file
+        self.state_flush_interval = state_flush_interval
+        self.metrics = metrics
+        self.metrics_log_interval = metrics_log_interval
+        self.metrics_port = metrics_port
+        self.profile = profile
+        self.profile_directory = profile_directory
+        self.profile_interval = profile_interval
+        self.profile_duty_cycle = profile_duty_cycle
+        self.profile_keep = profile_keep
+        self.capture_file = capture_file
+        self.capture_compress = capture_compress
+        self.downsample_interval = downsample_interval
+        self.sparse_loop_packets = sparse_loop_packets
+        self.sparse_refresh_interval = sparse_refresh_interval
+        self.unit_system = unit_system
+        self.sample_file = sample_file
+        self.sample_flush_interval = sample_flush_interval
+        self.sample_retention = sample_retention
+        self.cache_resolutions = cache_resolutions
+        self.cache_duration = cache_duration
 
     def __repr__(self):
         return str(self.__dict__)
 
     def create_mappers(self) -> List[AbstractMapping]:
-        return create_mappers(self.mappings, self.log_success, self.log_error)
+        return create_mappers(self.mappings, self.log_success, self.log_error, self.unit_system)
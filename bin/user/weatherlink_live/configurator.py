@@ -22,6 +22,7 @@ from optparse import OptionParser
 from typing import Dict, List, Union
 
 from user.weatherlink_live import configuration
+from user.weatherlink_live.capture import replay_capture
 from user.weatherlink_live.mappers import AbstractMapping
 from user.weatherlink_live.static import version
 from weewx.drivers import AbstractConfigurator
@@ -75,6 +76,51 @@ def _print_mapping(conf_dict: Dict) -> None:
     _print_mapping_tree(mapping_tree)
 
 
+def _replay(conf_dict: Dict, path: str, speed: float, quiet: bool) -> None:
+    config = configuration.create_configuration(conf_dict, version.DRIVER_NAME)
+    mappers = config.create_mappers()
+
+    stats = replay_capture(path, mappers, speed, None if quiet else lambda record: print(record), config.unit_system)
+
+    print("")
+    print("Replayed %d items in %.3f seconds: %d records, %d errors (%.0f records per second)" % (
+        stats["items"], stats["seconds"], stats["records"], stats["errors"],
+        stats["records"] / stats["seconds"] if stats["seconds"] > 0 else 0))
+
+
+def _create_schema(conf_dict: Dict, extra_observations: List[str]) -> dict:
+    from user.weatherlink_live import db_schema
+
+    config = configuration.create_configuration(conf_dict, version.DRIVER_NAME)
+    mappers = config.create_mappers()
+
+    return db_schema.create_schema(db_schema.mapped_observations(mappers) + extra_observations)
+
+
+def _print_schema(schema: dict) -> None:
+    print("# Database schema for the observations of the configured mappings")
+    print("# Generated by: weectl device --print-schema")
+    print("schema = {")
+    for key in ['table', 'day_summaries']:
+        print("    %r: [" % key)
+        for field in schema[key]:
+            print("        %r," % (field,))
+        print("    ],")
+    print("}")
+
+
+def _reconfigure_database(conf_dict: Dict, binding: str, schema: dict, noprompt: bool) -> None:
+    from user.weatherlink_live.database import reconfigure_database
+
+    reconfigure_database(conf_dict, binding, schema, noprompt)
+
+
+def _add_columns(conf_dict: Dict, binding: str, noprompt: bool) -> None:
+    from user.weatherlink_live.database import add_driver_columns
+
+    add_driver_columns(conf_dict, binding, noprompt)
+
+
 class WeatherlinkLiveConfigurator(AbstractConfigurator):
     @property
     def description(self):
@@ -84,6 +130,10 @@ class WeatherlinkLiveConfigurator(AbstractConfigurator):
     def usage(self):
         return """%prog --help
        %prog [config_file] --print-mapping
+       %prog [config_file] --replay=FILE [--replay-speed=SPEED] [--replay-quiet]
+       %prog [config_file] --print-schema [--schema-extra=OBSERVATIONS]
+       %prog [config_file] --reconfigure-database [--binding=BINDING] [--schema-extra=OBSERVATIONS]
+       %prog [config_file] --add-columns [--binding=BINDING]
 """
 
     @property
@@ -96,8 +146,50 @@ class WeatherlinkLiveConfigurator(AbstractConfigurator):
         parser.add_option("--print-mapping",
                           action="store_true", dest="print_mapping",
                           help="Display configured mapping")
+        parser.add_option("--replay",
+                          dest="replay", metavar="FILE",
+                          help="Replay captured device traffic through the configured mapping")
+        parser.add_option("--replay-speed",
+                          type="float", dest="replay_speed", default=1.0, metavar="SPEED",
+                          help="Speed of replay relative to real time. 0 replays as fast as possible. Default: 1")
+        parser.add_option("--replay-quiet",
+                          action="store_true", dest="replay_quiet",
+                          help="Don't print replayed records")
+        parser.add_option("--print-schema",
+                          action="store_true", dest="print_schema",
+                          help="Display a database schema containing only the observations of the configured mapping")
+        parser.add_option("--schema-extra",
+                          dest="schema_extra", metavar="OBSERVATIONS", default="",
+                          help="Comma-separated observations to add to the generated schema, "
+                               "e.g. those calculated by WeeWX")
+        parser.add_option("--reconfigure-database",
+                          action="store_true", dest="reconfigure_database",
+                          help="Copy the database to a new database using the generated schema")
+        parser.add_option("--add-columns",
+                          action="store_true", dest="add_columns",
+                          help="Add the columns and daily summaries of the driver's schema missing from the database")
+        parser.add_option("--binding",
+                          dest="binding", metavar="BINDING", default="wx_binding",
+                          help="Data binding of the database to reconfigure or add columns to. Default: wx_binding")
 
     def do_options(self, options, parser, config_dict, prompt):
         if options.print_mapping:
             _print_mapping(config_dict)
             return
+
+        if options.replay:
+            _replay(config_dict, options.replay, options.replay_speed, options.replay_quiet)
+            return
+
+        if options.print_schema or options.reconfigure_database:
+            extra_observations = [obs.strip() for obs in options.schema_extra.split(",") if obs.strip()]
+            schema = _create_schema(config_dict, extra_observations)
+            if options.print_schema:
+                _print_schema(schema)
+            else:
+                _reconfigure_database(config_dict, options.binding, schema, not prompt)
+            return
+
+        if options.add_columns:
+            _add_columns(config_dict, options.binding, not prompt)
+            return
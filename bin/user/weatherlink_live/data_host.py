@@ -20,29 +20,56 @@
 
 import logging
 import threading
+import time
 from collections import deque
-from typing import List
+from typing import List, Optional, Callable
 
 import weewx
 from user.weatherlink_live.callback import PacketCallback
-from user.weatherlink_live.davis_broadcast import WllBroadcastReceiver
-from user.weatherlink_live.davis_http import start_broadcast, request_current
+from user.weatherlink_live.capture import CaptureWriter
+from user.weatherlink_live.davis_broadcast import WllBroadcastReceiver, ErrorBudget
+from user.weatherlink_live.davis_http import start_broadcast, request_current, CancelEvent, RequestCancelled
 from user.weatherlink_live.mappers import AbstractMapping
+from user.weatherlink_live.metrics import WakeupCounter, PipelineMetrics
+from user.weatherlink_live.packet_logging import get_packet_logger
 from user.weatherlink_live.packets import DavisConditionsPacket
+from user.weatherlink_live.profiler import SamplingProfiler
 
 log = logging.getLogger(__name__)
+packet_log = get_packet_logger(__name__)
 
 
 class DataHost(object):
     """Base host class for polled as well as broadcasted data"""
 
-    def __init__(self, mappers: List[AbstractMapping], data_event: threading.Event):
+    def __init__(self, mappers: List[AbstractMapping], data_event: threading.Event,
+                 metrics: Optional[PipelineMetrics] = None, profiler: Optional[SamplingProfiler] = None,
+                 capture: Optional[CaptureWriter] = None, us_units: int = weewx.US):
         self._mappers = mappers
+        self.us_units = us_units
         self._data_event = data_event
+        self.capture = capture
+        self.profiler = profiler
+        if profiler is not None:
+            self._create_record = profiler.profiled(self._create_record)
 
         self.packets = deque()
         self.error = None
 
+        self.metrics = metrics
+        self.last_record_time = None
+        if metrics is not None:
+            self._map_histograms = [metrics.histogram("map %s" % mapper) for mapper in mappers]
+            self._queue_histogram = metrics.histogram("queue")
+            self._record_counter = metrics.counter("records")
+            self._request_histogram = metrics.histogram("request")
+            self._retry_counter = metrics.counter("http retries")
+            # Parallel to `packets`: time each record was queued
+            self._enqueue_times = deque()
+
+        # Set when closing; interrupts HTTP requests in progress and pending retries
+        self._closed = CancelEvent()
+
     @property
     def has_error(self):
         return self.error is not None
@@ -51,22 +78,56 @@ class DataHost(object):
         if self.has_error:
             raise self.error
 
+    def clear_error(self):
+        self.error = None
+
     def _create_record(self, packet: DavisConditionsPacket):
         record = dict()
 
-        for mapper in self._mappers:
-            mapper.map(packet, record)
-        self.packets.append(record)
+        if self.metrics is None:
+            for mapper in self._mappers:
+                mapper.map(packet, record)
+        else:
+            for mapper, histogram in zip(self._mappers, self._map_histograms):
+                start = time.perf_counter()
+                mapper.map(packet, record)
+                histogram.observe(time.perf_counter() - start)
+            self._record_counter.increment()
+            self.last_record_time = time.perf_counter()
+            self._enqueue_times.append(self.last_record_time)
 
         record['dateTime'] = packet.timestamp
-        record['usUnits'] = weewx.US
+        record['usUnits'] = self.us_units
 
+        # The driver thread may take the record as soon as it is queued, so it has to be complete by then
+        self.packets.append(record)
         self._data_event.set()
 
+    def _request(self, request: Callable, *args, **kwargs):
+        """Run HTTP request, measuring its round-trip time and retries"""
+
+        if self.metrics is None:
+            return request(*args, capture=self.capture, **kwargs)
+
+        start = time.perf_counter()
+        packet = request(*args, retries=self._retry_counter, capture=self.capture, **kwargs)
+        self._request_histogram.observe(time.perf_counter() - start)
+        return packet
+
+    def pop_packet(self) -> dict:
+        record = self.packets.popleft()
+        if self.metrics is not None:
+            self._queue_histogram.observe(time.perf_counter() - self._enqueue_times.popleft())
+        return record
+
     def notify_error(self, e):
         self.error = e
         self._data_event.set()
 
+    def cancel(self):
+        """Interrupt HTTP requests, so a running scheduler tick ends immediately"""
+        self._closed.set()
+
 
 class WllPollHost(DataHost):
     """Host object for polling data from WLL"""
@@ -75,19 +136,34 @@ class WllPollHost(DataHost):
                  host: str,
                  mappers: List[AbstractMapping],
                  data_event: threading.Event,
-                 http_timeout: float = 20):
-        super().__init__(mappers, data_event)
+                 http_timeout: float = 20,
+                 metrics: Optional[PipelineMetrics] = None,
+                 profiler: Optional[SamplingProfiler] = None,
+                 capture: Optional[CaptureWriter] = None,
+                 us_units: int = weewx.US):
+        super().__init__(mappers, data_event, metrics, profiler, capture, us_units)
         self.host = host
         self.http_timeout = http_timeout
 
     def poll(self):
-        packet = request_current(self.host, timeout=self.http_timeout)
-        log.debug("Polled current conditions")
+        # Failures are reported to the supervisor instead of raised, so they don't stop the scheduler, which also
+        # refreshes the broadcast. Polling resumes once the supervisor restarts this host.
+        if self.has_error:
+            packet_log.debug("Poll host failed. Not polling until it is restarted")
+            return
 
-        self._create_record(packet)
+        try:
+            packet = self._request(request_current, self.host, timeout=self.http_timeout, cancel_event=self._closed)
+            packet_log.debug("Polled current conditions")
+
+            self._create_record(packet)
+        except RequestCancelled:
+            packet_log.debug("Poll host closed. Request cancelled")
+        except Exception as e:
+            self.notify_error(e)
 
     def close(self):
-        pass
+        self.cancel()
 
 
 class WLLBroadcastHost(DataHost, PacketCallback):
@@ -97,21 +173,41 @@ class WLLBroadcastHost(DataHost, PacketCallback):
                  host: str,
                  mappers: List[AbstractMapping],
                  data_event: threading.Event,
-                 http_timeout: float = 20):
-        super().__init__(mappers, data_event)
+                 http_timeout: float = 20,
+                 error_budget: int = 10,
+                 error_window: float = 60,
+                 metrics: Optional[PipelineMetrics] = None,
+                 profiler: Optional[SamplingProfiler] = None,
+                 capture: Optional[CaptureWriter] = None,
+                 us_units: int = weewx.US):
+        super().__init__(mappers, data_event, metrics, profiler, capture, us_units)
         self.host = host
         self.http_timeout = http_timeout
+        self.error_budget = ErrorBudget(error_budget, error_window)
+        # Shared by all receivers, as only one of them is running at a time
+        self.wakeups = WakeupCounter("broadcast")
 
         self._receiver = None
         self._port = 22222
 
+        if metrics is not None:
+            self._gap_histogram = metrics.histogram("gap")
+            # Counted by the receivers. Created upfront, so they are exported before the first event.
+            metrics.counter("datagrams")
+            metrics.counter("decode errors")
+
     def refresh_broadcast(self, request_duration: float):
         log.debug("Re-requesting UDP broadcast")
-        packet = start_broadcast(self.host, request_duration, timeout=self.http_timeout)
+        try:
+            packet = self._request(start_broadcast, self.host, request_duration, timeout=self.http_timeout,
+                                   cancel_event=self._closed)
+        except RequestCancelled:
+            log.debug("Host is closed. Not refreshing broadcast")
+            return
         port = packet.broadcast_port
 
         if self._port != port:
-            log.info("Broadcast port changed from %s to %s" % (self._port, port))
+            log.info("Broadcast port changed from %s to %s", self._port, port)
             self._port = port
 
         log.debug("Restarting broadcast reception")
@@ -119,24 +215,39 @@ class WLLBroadcastHost(DataHost, PacketCallback):
         self._start_broadcast_reception()
 
     def _start_broadcast_reception(self):
-        self._receiver = WllBroadcastReceiver(self.host, self._port, self)
+        if self._closed.is_set():
+            log.debug("Host is closed. Not starting broadcast reception")
+            return
+        self._receiver = WllBroadcastReceiver(self.host, self._port, self, self.error_budget, self.wakeups,
+                                              self.metrics, self.profiler, self.capture)
 
     def _stop_broadcast_reception(self):
         if self._receiver is None:
             return
         self._receiver.close()
 
+    def restart(self):
+        """Restart broadcast reception after an error, keeping queued packets"""
+        log.debug("Restarting broadcast reception after error")
+        self._closed.clear()
+        self.clear_error()
+        self._stop_broadcast_reception()
+        self._start_broadcast_reception()
+
     def on_packet_received(self, packet: DavisConditionsPacket):
-        log.debug("Received new broadcast packet")
+        packet_log.debug("Received new broadcast packet")
+        if self.metrics is not None and self.last_record_time is not None:
+            self._gap_histogram.observe(time.perf_counter() - self.last_record_time)
         try:
             self._create_record(packet)
         except Exception as e:
             self.notify_error(e)
-            self.close()
+            self._stop_broadcast_reception()
 
     def on_packet_receive_error(self, e: BaseException):
         self.notify_error(e)
-        self.close()
+        self._stop_broadcast_reception()
 
     def close(self):
+        self.cancel()
         self._stop_broadcast_reception()
@@ -0,0 +1,226 @@
+# Copyright © 2020-2024 Michael Schantl and contributors
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Migration of existing databases to the schemas of this driver
+"""
+import sys
+import time
+from typing import Dict, List, Optional
+
+import weedb
+import weewx.manager
+from weeutil.weeutil import y_or_n
+
+
+_KEY_COLUMNS = ['dateTime', 'usUnits', 'interval']
+_WIND_COLUMNS = ['windSpeed', 'windDir', 'windGust', 'windGustDir']
+
+
+class _ColumnSubsetManager(weewx.manager.DaySummaryManager):
+    """Daily summary manager only reading the columns needed for backfilling some of the daily summaries"""
+
+    backfill_columns = []
+
+    def genBatchRecords(self, startstamp=None, stopstamp=None):
+        columns = _KEY_COLUMNS + [column for column in self.backfill_columns
+                                  if column in self.sqlkeys and column not in _KEY_COLUMNS]
+        sql = "SELECT %s FROM %s WHERE dateTime > ? AND dateTime <= ? ORDER BY dateTime ASC" % (
+            ", ".join(columns), self.table_name)
+        for row in self.genSql(sql, (startstamp, stopstamp)):
+            yield dict(zip(columns, row))
+
+
+def _count_values(db_manager: weewx.manager.Manager, columns: List[str]) -> Dict[str, int]:
+    """Number of non-null values of each column, counted in a single scan of the table"""
+
+    if not columns:
+        return dict()
+
+    row = db_manager.getSql("SELECT %s FROM %s" % (", ".join("COUNT(`%s`)" % column for column in columns),
+                                                   db_manager.table_name))
+    return dict(zip(columns, row))
+
+
+def reconfigure_database(config_dict: dict, binding: str, schema: dict, noprompt: bool = False) -> None:
+    """
+    Copy the database of a binding to a new database using the given schema
+
+    The new database is named like the old one, with the suffix `_new`. Like `weectl database reconfigure`, the old
+    database isn't modified. Daily summaries of the new database are rebuilt after copying.
+    """
+
+    manager_dict = weewx.manager.get_manager_dict_from_config(config_dict, binding)
+    old_database_dict = manager_dict['database_dict']
+    new_database_dict = dict(old_database_dict)
+    new_database_dict['database_name'] = old_database_dict['database_name'] + '_new'
+    table_name = manager_dict['table_name']
+
+    with weewx.manager.Manager.open(old_database_dict, table_name) as old_db:
+        if old_db.std_unit_system is None:
+            print("Database '%s' has not been initialized. Nothing to be done." % old_database_dict['database_name'])
+            return
+
+        new_columns = [column for column, _ in schema['table']]
+        dropped_columns = [column for column in old_db.sqlkeys if column not in new_columns]
+        added_columns = [column for column in new_columns if column not in old_db.sqlkeys]
+        dropped_values = _count_values(old_db, dropped_columns)
+
+    print("Copying database '%s' to '%s'" % (old_database_dict['database_name'], new_database_dict['database_name']))
+    print("The new database will have %d columns (%d dropped, %d added) and %d daily summaries." % (
+        len(new_columns), len(dropped_columns), len(added_columns), len(schema['day_summaries'])))
+    if added_columns:
+        print("Added columns: %s" % ", ".join(added_columns))
+    lost_columns = [column for column in dropped_columns if dropped_values[column] > 0]
+    if lost_columns:
+        print("Data of the following dropped columns will not be copied:")
+        for column in lost_columns:
+            print("  %s: %d values" % (column, dropped_values[column]))
+
+    if y_or_n("Are you sure you wish to proceed (y/n)? ", noprompt=noprompt) != 'y':
+        print("Nothing done.")
+        return
+
+    try:
+        weedb.create(new_database_dict)
+    except weedb.DatabaseExists:
+        ans = y_or_n("New database '%s' already exists. Delete it first (y/n)? " % new_database_dict['database_name'],
+                     noprompt=noprompt)
+        if ans != 'y':
+            print("Nothing done.")
+            return
+        weedb.drop(new_database_dict)
+
+    start = time.time()
+    weewx.manager.reconfig(old_database_dict, new_database_dict, new_schema=schema)
+    print("Copied records in %.2f seconds" % (time.time() - start))
+
+    start = time.time()
+    with weewx.manager.DaySummaryManager.open_with_create(new_database_dict, table_name, schema) as new_db:
+        record_count, day_count = new_db.backfill_day_summary(trans_days=20)
+    print("")
+    print("Rebuilt %d daily summaries from %d records in %.2f seconds" % (day_count, record_count,
+                                                                            time.time() - start))
+
+    print("Database '%s' copied to '%s'." % (old_database_dict['database_name'], new_database_dict['database_name']))
+    print("To use it, rename it to '%s' and set the schema of binding '%s' to the generated schema." % (
+        old_database_dict['database_name'], binding))
+
+
+def _add_columns(db_manager: weewx.manager.Manager, columns: List[tuple], day_summaries: List[tuple]) -> None:
+    """Add all columns and daily summary tables at once"""
+
+    table_name = db_manager.table_name
+    with weedb.Transaction(db_manager.connection) as cursor:
+        if columns and db_manager.connection.dbtype == 'mysql':
+            # Every ALTER TABLE copies the table on MySQL, so add all columns in a single statement
+            cursor.execute("ALTER TABLE %s %s" % (table_name, ", ".join(
+                "ADD COLUMN %s %s" % (column, column_type) for column, column_type in columns)))
+        else:
+            # Adding a column only changes the table definition on SQLite
+            for column, column_type in columns:
+                cursor.add_column(table_name, column, column_type)
+
+        for summary, summary_type in day_summaries:
+            cursor.create_table("%s_day_%s" % (table_name, summary),
+                                weewx.manager.DaySummaryManager.day_schemas[summary_type.lower()])
+
+
+def _backfill_progress(record_count: int):
+    start = time.time()
+
+    def show_progress(timestamp: int, processed: Optional[int] = None):
+        if not processed:
+            return
+        elapsed = time.time() - start
+        print("Records processed: %d of %d (%.0f%%), %.0f records per second\r" % (
+            processed, record_count, 100.0 * processed / record_count, processed / elapsed if elapsed > 0 else 0),
+              end='')
+        sys.stdout.flush()
+
+    return show_progress
+
+
+def add_driver_columns(config_dict: dict, binding: str, noprompt: bool = False) -> None:
+    """
+    Add all columns and daily summaries of the driver's schema missing from the database of a binding
+
+    Columns are added in a single statement or transaction. Only the new daily summaries of columns already containing
+    data are backfilled, reading only those columns.
+    """
+
+    from schemas import wview_extended
+    from user.weatherlink_live.db_schema import create_schema
+    from user.weatherlink_live.observations import added_observations
+
+    # The driver's schema: all observations of wview_extended and the ones added by the driver
+    schema = create_schema([column for column, _ in wview_extended.table] + added_observations())
+
+    manager_dict = weewx.manager.get_manager_dict_from_config(config_dict, binding)
+    database_dict = manager_dict['database_dict']
+    table_name = manager_dict['table_name']
+
+    with weewx.manager.DaySummaryManager.open(database_dict, table_name) as db:
+        missing_columns = [(column, column_type) for column, column_type in schema['table']
+                           if column not in db.sqlkeys]
+        missing_summaries = [(summary, summary_type) for summary, summary_type in schema['day_summaries']
+                             if summary not in db.daykeys]
+
+        # Summaries of existing columns have to be backfilled if there is data
+        existing_columns = [summary for summary, _ in missing_summaries if summary in db.sqlkeys]
+        value_counts = _count_values(db, existing_columns + ['dateTime'])
+        backfill_summaries = [column for column in existing_columns if value_counts[column] > 0]
+        if 'wind' in [summary for summary, _ in missing_summaries] \
+                and all(column in db.sqlkeys for column in _WIND_COLUMNS):
+            backfill_summaries.append('wind')
+        record_count = value_counts['dateTime']
+
+    if not missing_columns and not missing_summaries:
+        print("Database '%s' already contains all columns and daily summaries of the driver" %
+              database_dict['database_name'])
+        return
+
+    print("Adding %d columns and %d daily summaries to database '%s'" % (
+        len(missing_columns), len(missing_summaries), database_dict['database_name']))
+    if backfill_summaries:
+        print("Daily summaries of %s will be backfilled from %d records" % (", ".join(backfill_summaries),
+                                                                            record_count))
+
+    if y_or_n("Are you sure you wish to proceed (y/n)? ", noprompt=noprompt) != 'y':
+        print("Nothing done.")
+        return
+
+    start = time.time()
+    with weewx.manager.Manager.open(database_dict, table_name) as db:
+        _add_columns(db, missing_columns, missing_summaries)
+    print("Added columns and daily summaries in %.2f seconds" % (time.time() - start))
+
+    if backfill_summaries:
+        start = time.time()
+        with _ColumnSubsetManager.open(database_dict, table_name) as db:
+            db.backfill_columns = [column for summary in backfill_summaries
+                                   for column in (_WIND_COLUMNS if summary == 'wind' else [summary])]
+            record_count, day_count = db.backfill_day_summary(progress_fn=_backfill_progress(record_count),
+                                                              trans_days=50, key_set=set(backfill_summaries))
+        print("")
+        print("Backfilled %d daily summaries from %d records in %.2f seconds" % (day_count, record_count,
+                                                                                 time.time() - start))
+
+    print("Set the schema of binding '%s' to 'user.weatherlink_live.schema' to keep it in sync." % binding)
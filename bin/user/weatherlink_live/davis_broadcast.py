@@ -21,30 +21,98 @@
 import json
 import logging
 import threading
-from json import JSONDecodeError
-from socket import socket, AF_INET, SOCK_DGRAM, SOL_SOCKET, SO_BROADCAST, SO_REUSEADDR
+import time
+from collections import deque
+from typing import Optional
+from socket import socket, socketpair, AF_INET, SOCK_DGRAM, SOL_SOCKET, SO_BROADCAST, SO_REUSEADDR
 
 import select
 
 from user.weatherlink_live.callback import PacketCallback
+from user.weatherlink_live.capture import CaptureWriter, CaptureSource
+from user.weatherlink_live.metrics import WakeupCounter, PipelineMetrics
+from user.weatherlink_live.packet_logging import get_packet_logger
 from user.weatherlink_live.packets import WlUdpBroadcastPacket
+from user.weatherlink_live.profiler import SamplingProfiler
 from weewx import WeeWxIOError
 
 log = logging.getLogger(__name__)
+packet_log = get_packet_logger(__name__)
+
+
+def _no_op(*args) -> None:
+    pass
+
+
+def _no_clock() -> float:
+    return 0.0
+
+
+class ErrorBudget(object):
+    """Tolerate a limited number of errors within a sliding time window"""
+
+    def __init__(self, max_errors: int, window: float):
+        self.max_errors = max_errors
+        self.window = window
+
+        self.error_count = 0
+        self._error_times = deque()
+
+    def record_error(self) -> bool:
+        """
+        Record an error
+
+        :return: `true` if the budget is exceeded
+        """
+
+        now = time.monotonic()
+        self.error_count += 1
+
+        error_times = self._error_times
+        error_times.append(now)
+        while error_times and error_times[0] <= now - self.window:
+            error_times.popleft()
+
+        return len(error_times) > self.max_errors
 
 
 class WllBroadcastReceiver(object):
     """Receive UDP broadcasts from WeatherLink Live"""
 
-    def __init__(self, broadcasting_wl_host: str, port: int, callback: PacketCallback):
+    def __init__(self, broadcasting_wl_host: str, port: int, callback: PacketCallback, error_budget: ErrorBudget,
+                 wakeups: WakeupCounter, metrics: Optional[PipelineMetrics] = None,
+                 profiler: Optional[SamplingProfiler] = None, capture: Optional[CaptureWriter] = None):
         self.broadcasting_wl_host = broadcasting_wl_host
         self.port = port
         self.callback = callback
-
-        self.wait_timeout = 5
+        self.error_budget = error_budget
+        self.wakeups = wakeups
+        self.metrics = metrics
+        self.capture = capture
+        if profiler is not None:
+            self._receive = profiler.profiled(self._receive)
+
+        # The metrics hooks are resolved once, so a single receive path serves both cases; without metrics they do
+        # nothing and the clock isn't read
+        if metrics is None:
+            self._clock = _no_clock
+            self._count_datagram = self._count_decode_error = _no_op
+            self._observe_decode = self._observe_packet = self._observe_receive = _no_op
+        else:
+            self._clock = time.perf_counter
+            self._count_datagram = metrics.counter("datagrams").increment
+            self._count_decode_error = metrics.counter("decode errors").increment
+            self._observe_decode = metrics.histogram("decode").observe
+            self._observe_packet = metrics.histogram("packet").observe
+            self._observe_receive = metrics.histogram("receive").observe
+
+        self.join_timeout = 1
 
         self.sock = None
 
+        # Writing to the wake-up socket interrupts select() immediately when closing
+        self._wake_receive, self._wake_send = socketpair()
+
         self.stop_signal = threading.Event()
         self.thread = threading.Thread(name='WLL-BroadcastReception', target=self._reception)
         self.thread.daemon = True
@@ -59,28 +127,61 @@ class WllBroadcastReceiver(object):
             self.sock.bind(('', self.port))
 
             while not self.stop_signal.is_set():
-                r, _, _ = select.select([self.sock], [], [], self.wait_timeout)
-                if not r:
+                # No timeout: closing wakes up select() through the wake-up socket
+                r, _, _ = select.select([self.sock, self._wake_receive], [], [])
+                self.wakeups.increment()
+                if self.sock not in r:
                     continue
 
-                data, source_addr = self.sock.recvfrom(2048)
-                log.debug("Received %d bytes from %s" % (len(data), source_addr))
-                try:
-                    json_data = json.loads(data.decode("utf-8"))
-                except JSONDecodeError as e:
-                    raise WeeWxIOError("Error decoding broadcast packet JSON") from e
-
-                packet = WlUdpBroadcastPacket.try_create(json_data, self.broadcasting_wl_host)
-                self.callback.on_packet_received(packet)
+                self._receive()
 
         except Exception as e:
             self.callback.on_packet_receive_error(e)
             raise e
 
+    def _receive(self):
+        receive_start = self._clock()
+
+        data, source_addr = self.sock.recvfrom(2048)
+        self._count_datagram()
+        packet_log.debug("Received %d bytes from %s", len(data), source_addr)
+        if self.capture is not None:
+            self.capture.write(CaptureSource.UDP_BROADCAST, data)
+        try:
+            decode_start = self._clock()
+            json_data = json.loads(data.decode("utf-8"))
+            packet_start = self._clock()
+            packet = WlUdpBroadcastPacket.try_create(json_data, self.broadcasting_wl_host)
+            packet_end = self._clock()
+        except (ValueError, KeyError, WeeWxIOError) as e:
+            # Invalid UTF-8 and JSON raise ValueError, incomplete packets KeyError or WeeWxIOError. Anything else stops
+            # the reception, which is then restarted by the supervisor.
+            self._count_decode_error()
+            self._on_decode_error(e, source_addr)
+            return
+        self._observe_decode(packet_start - decode_start)
+        self._observe_packet(packet_end - packet_start)
+
+        self.callback.on_packet_received(packet)
+        self._observe_receive(self._clock() - receive_start)
+
+    def _on_decode_error(self, e: Exception, source_addr) -> None:
+        if self.error_budget.record_error():
+            raise WeeWxIOError("Too many broadcast packets could not be decoded (more than %d within %d seconds)" % (
+                self.error_budget.max_errors, self.error_budget.window)) from e
+
+        log.warning("Dropping broadcast packet from %s which could not be decoded (%d dropped so far): %r",
+                    source_addr, self.error_budget.error_count, e)
+
     def close(self):
+        if self.stop_signal.is_set():
+            return
+
         log.debug("Stopping broadcast reception")
         self.stop_signal.set()
-        self.thread.join(self.wait_timeout * 3)
+        self._wake_send.send(b'\0')
+        if threading.current_thread() is not self.thread:
+            self.thread.join(self.join_timeout)
 
         if self.thread.is_alive():
             log.warning("Broadcast reception thread still alive. Force closing socket")
@@ -90,4 +191,7 @@ class WllBroadcastReceiver(object):
             self.sock = None
             log.debug("Closed broadcast receiving socket")
 
+        self._wake_send.close()
+        self._wake_receive.close()
+
         log.debug("Stopped broadcast reception")
@@ -18,31 +18,189 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+import errno
+import io
+import json
 import logging
+import select
+import threading
 import time
-from typing import Optional
-
-import requests
+from contextlib import contextmanager
+from socket import socket, socketpair, getaddrinfo, SOCK_STREAM, SOL_SOCKET, SO_ERROR
+from typing import Optional, Tuple
 
+from user.weatherlink_live.capture import CaptureWriter, CaptureSource
+from user.weatherlink_live.metrics import Counter
 from user.weatherlink_live.packets import WlHttpBroadcastStartRequestPacket, WlHttpConditionsRequestPacket
 from weewx import WeeWxIOError
 
 log = logging.getLogger(__name__)
 
+# Responses of the device are small JSON documents
+_MAX_RESPONSE_SIZE = 1024 * 1024
+_REQUEST = b"GET %s HTTP/1.1\r\nHost: %s\r\nAccept: application/json\r\nConnection: close\r\n\r\n"
+
+
+class RequestCancelled(WeeWxIOError):
+    """Raised by HTTP requests when their host is closed"""
+    pass
+
+
+class CancelEvent(object):
+    """
+    Event cancelling the HTTP requests of a host
+
+    Works like `threading.Event`. Additionally, setting the event wakes up requests waiting for the device through a
+    socket pair registered for the duration of each request, so a request in progress is interrupted immediately
+    instead of running into its timeout.
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._wake_sockets = set()
+
+    def set(self) -> None:
+        with self._lock:
+            self._event.set()
+            for wake_send in self._wake_sockets:
+                wake_send.send(b'\0')
+
+    def clear(self) -> None:
+        self._event.clear()
+
+    def is_set(self) -> bool:
+        return self._event.is_set()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        return self._event.wait(timeout)
+
+    @contextmanager
+    def wake_socket(self):
+        """Socket becoming readable when the event is set"""
+
+        wake_receive, wake_send = socketpair()
+        try:
+            with self._lock:
+                if self._event.is_set():
+                    raise RequestCancelled("HTTP request cancelled")
+                self._wake_sockets.add(wake_send)
+            try:
+                yield wake_receive
+            finally:
+                with self._lock:
+                    self._wake_sockets.discard(wake_send)
+        finally:
+            wake_send.close()
+            wake_receive.close()
+
+
+class _ResponseData(object):
+    """Received response, parsed by `http.client.HTTPResponse` like a socket"""
+
+    def __init__(self, data: bytes):
+        self.data = data
+
+    def makefile(self, mode: str):
+        return io.BytesIO(self.data)
+
+
+def _address(host: str) -> Tuple[str, int]:
+    # Port 80 unless given explicitly (e.g. for a simulated device)
+    if ":" not in host:
+        return host, 80
+    hostname, port = host.rsplit(":", 1)
+    return hostname, int(port)
+
+
+def _wait(sock: socket, wake_receive: socket, deadline: float, write: bool = False) -> None:
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise WeeWxIOError("HTTP request timed out")
+
+    if write:
+        r, w, _ = select.select([wake_receive], [sock], [], remaining)
+    else:
+        r, w, _ = select.select([wake_receive, sock], [], [], remaining)
+    if wake_receive in r:
+        raise RequestCancelled("HTTP request cancelled")
+    if not r and not w:
+        raise WeeWxIOError("HTTP request timed out")
+
+
+def _get(host: str, path: str, timeout: float, cancel_event: CancelEvent) -> bytes:
+    """
+    Request a resource from the device and return the body of the response
+
+    The socket is non-blocking. Connecting, sending and receiving wait for the socket and the cancel event at once,
+    so cancelling doesn't have to wait for the device.
+    """
+
+    # The HTTP parser is only loaded when the first request is made
+    import http.client
+
+    hostname, port = _address(host)
+    family, _, _, _, address = getaddrinfo(hostname, port, type=SOCK_STREAM)[0]
+    deadline = time.monotonic() + timeout
+
+    with cancel_event.wake_socket() as wake_receive, socket(family, SOCK_STREAM) as sock:
+        sock.setblocking(False)
+
+        result = sock.connect_ex(address)
+        if result not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+            raise OSError(result, "Could not connect to %s" % host)
+        _wait(sock, wake_receive, deadline, write=True)
+        result = sock.getsockopt(SOL_SOCKET, SO_ERROR)
+        if result != 0:
+            raise OSError(result, "Could not connect to %s" % host)
+
+        request = memoryview(_REQUEST % (path.encode("ascii"), host.encode("ascii")))
+        while request:
+            _wait(sock, wake_receive, deadline, write=True)
+            request = request[sock.send(request):]
+
+        data = bytearray()
+        while True:
+            _wait(sock, wake_receive, deadline)
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            data += chunk
+            if len(data) > _MAX_RESPONSE_SIZE:
+                raise WeeWxIOError("HTTP response of %s is larger than %d bytes" % (host, _MAX_RESPONSE_SIZE))
+
+    response = http.client.HTTPResponse(_ResponseData(bytes(data)))
+    response.begin()
+    return response.read()
+
+
+def _wait_for_retry(cancel_event: CancelEvent):
+    if cancel_event.wait(2.5):
+        raise RequestCancelled("HTTP request cancelled")
+
 
-def start_broadcast(host: str, duration, timeout: float = 5):
+def start_broadcast(host: str, duration, timeout: float = 5, cancel_event: Optional[CancelEvent] = None,
+                    retries: Optional[Counter] = None, capture: Optional[CaptureWriter] = None):
+    if cancel_event is None:
+        cancel_event = CancelEvent()
     error: Optional[Exception] = None
 
     for i in range(3):
         try:
-            r = requests.get("http://%s:80/v1/real_time?duration=%d" % (host, duration), timeout=timeout)
-            json = r.json()
-            return WlHttpBroadcastStartRequestPacket.try_create(json, host)
+            content = _get(host, "/v1/real_time?duration=%d" % duration, timeout, cancel_event)
+            if capture is not None:
+                capture.write(CaptureSource.HTTP_REAL_TIME, content)
+            json_data = json.loads(content)
+            return WlHttpBroadcastStartRequestPacket.try_create(json_data, host)
+        except RequestCancelled:
+            raise
         except Exception as e:
             error = e
             log.error(e)
-            log.error("HTTP broadcast start request failed. Retry #%d follows shortly" % i)
-        time.sleep(2.5)
+            log.error("HTTP broadcast start request failed. Retry #%d follows shortly", i)
+            if retries is not None:
+                retries.increment()
+        _wait_for_retry(cancel_event)
 
     if error is not None:
         raise error
@@ -50,19 +208,28 @@ def start_broadcast(host: str, duration, timeout: float = 5):
     raise WeeWxIOError("HTTP broadcast start request failed without setting an error")
 
 
-def request_current(host: str, timeout: float = 5):
+def request_current(host: str, timeout: float = 5, cancel_event: Optional[CancelEvent] = None,
+                    retries: Optional[Counter] = None, capture: Optional[CaptureWriter] = None):
+    if cancel_event is None:
+        cancel_event = CancelEvent()
     error: Optional[Exception] = None
 
     for i in range(3):
         try:
-            r = requests.get("http://%s:80/v1/current_conditions" % host, timeout=timeout)
-            json = r.json()
-            return WlHttpConditionsRequestPacket.try_create(json, host)
+            content = _get(host, "/v1/current_conditions", timeout, cancel_event)
+            if capture is not None:
+                capture.write(CaptureSource.HTTP_CONDITIONS, content)
+            json_data = json.loads(content)
+            return WlHttpConditionsRequestPacket.try_create(json_data, host)
+        except RequestCancelled:
+            raise
         except Exception as e:
             error = e
             log.error(e)
-            log.error("HTTP conditions request failed. Retry #%d follows shortly" % i)
-        time.sleep(2.5)
+            log.error("HTTP conditions request failed. Retry #%d follows shortly", i)
+            if retries is not None:
+                retries.increment()
+        _wait_for_retry(cancel_event)
 
     if error is not None:
         raise error
@@ -18,65 +18,51 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
-import weewx.units
-from schemas import wview_extended
+from typing import Dict, Iterable, List, Tuple
 
-_temperature_fields = ["dewpoint2",
-                       "dewpoint3",
-                       "dewpoint4",
-                       "dewpoint5",
-                       "dewpoint6",
-                       "dewpoint7",
-                       "dewpoint8",
-                       "heatindex2",
-                       "heatindex3",
-                       "heatindex4",
-                       "heatindex5",
-                       "heatindex6",
-                       "heatindex7",
-                       "heatindex8",
-                       "wetbulb",
-                       "wetbulb1",
-                       "wetbulb2",
-                       "wetbulb3",
-                       "wetbulb4",
-                       "wetbulb5",
-                       "wetbulb6",
-                       "wetbulb7",
-                       "wetbulb8",
-                       "thw",
-                       "thsw",
-                       "inHeatindex"]
-_rain_count_fields = ['rainCount']  # unit: count
-_rain_count_rate_fields = ['rainCountRate']  # unit: count per hour
-_rain_amount_fields = ['rainSize']  # unit: technically rain amount (inch/mm)
+from schemas import wview_extended
+from user.weatherlink_live.mappers import AbstractMapping
+from user.weatherlink_live.observations import added_observations
 
-_TABLE_FIELDS = wview_extended.table \
-                + [(field, "REAL") for field in _temperature_fields] \
-                + [(field, "REAL") for field in _rain_count_fields] \
-                + [(field, "REAL") for field in _rain_count_rate_fields] \
-                + [(field, "REAL") for field in _rain_amount_fields]
+_TABLE_FIELDS = wview_extended.table + [(field, "REAL") for field in added_observations()]
 
-_DAY_SUMMARIES_FIELDS = wview_extended.day_summaries \
-                        + [(field, "SCALAR") for field in _temperature_fields] \
-                        + [(field, "SCALAR") for field in _rain_count_fields] \
-                        + [(field, "SCALAR") for field in _rain_count_rate_fields] \
-                        + [(field, "SCALAR") for field in _rain_amount_fields]
+_DAY_SUMMARIES_FIELDS = wview_extended.day_summaries + [(field, "SCALAR") for field in added_observations()]
 
 db_schema = {'table': _TABLE_FIELDS, 'day_summaries': _DAY_SUMMARIES_FIELDS}
 
+# Columns every archive table needs, regardless of the configured mappings
+_KEY_FIELDS = wview_extended.table[:3]
+_WIND_FIELDS = ['windSpeed', 'windDir', 'windGust', 'windGustDir']
+
+
+def mapped_observations(mappers: List[AbstractMapping]) -> List[str]:
+    """Observations written by the given mappers, in mapping order"""
+
+    observations = []
+    for mapper in mappers:
+        for map_targets in mapper.map_table.values():
+            for observation in (map_targets if isinstance(map_targets, list) else [map_targets]):
+                if observation not in observations:
+                    observations.append(observation)
+    return observations
+
+
+def create_schema(observations: Iterable[str]) -> Dict[str, List[Tuple[str, str]]]:
+    """
+    Create a schema storing only the given observations
+
+    The wind vector summary is included if all observations it is calculated from are stored.
+    """
 
-def configure_units() -> None:
-    # Define units of new observation
-    weewx.units.obs_group_dict.update(dict([(observation, "group_temperature") for observation in _temperature_fields]))
-    weewx.units.obs_group_dict.update(dict([(observation, "group_count") for observation in _rain_count_fields]))
-    weewx.units.obs_group_dict.update(dict([(observation, "group_rate") for observation in _rain_count_rate_fields]))
-    weewx.units.obs_group_dict.update(dict([(observation, "group_rain") for observation in _rain_amount_fields]))
+    table = list(_KEY_FIELDS)
+    day_summaries = []
+    for observation in observations:
+        if any(field == observation for field, _ in table):
+            continue
+        table.append((observation, "REAL"))
+        day_summaries.append((observation, "SCALAR"))
 
-    # Define unit group 'group_rate'
-    weewx.units.USUnits['group_rate'] = 'per_hour'
-    weewx.units.MetricUnits['group_rate'] = 'per_hour'
-    weewx.units.MetricWXUnits['group_rate'] = 'per_hour'
+    if all(any(field == wind_field for field, _ in table) for wind_field in _WIND_FIELDS):
+        day_summaries.append(('wind', "VECTOR"))
 
-    weewx.units.default_unit_format_dict['per_hour'] = '%.0f'
-    weewx.units.default_unit_label_dict['per_hour'] = ' per hour'
+    return {'table': table, 'day_summaries': day_summaries}
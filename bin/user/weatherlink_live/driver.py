@@ -20,16 +20,38 @@
 
 import logging
 import threading
+import time
+from collections import deque
+from typing import Optional
+
+import weewx.units
 
 from user.weatherlink_live import data_host, scheduler
-from user.weatherlink_live.configuration import create_configuration
+from user.weatherlink_live.archive import ArchiveAccumulator, LoopDownsampler
+from user.weatherlink_live.capture import CaptureWriter
+from user.weatherlink_live.configuration import create_configuration, build_mapping_definitions
+from user.weatherlink_live.metrics import WakeupCounter, PipelineMetrics
+from user.weatherlink_live.packet_logging import get_packet_logger, configure_packet_logging
+from user.weatherlink_live.profiler import SamplingProfiler
 from user.weatherlink_live.service import WllWindGustService
+from user.weatherlink_live.sparse import ChangeFilter
+from user.weatherlink_live.spool import LoopSpool
+from user.weatherlink_live.state import StateStore
+from user.weatherlink_live.supervisor import Supervisor
 from user.weatherlink_live.static.version import DRIVER_NAME, DRIVER_VERSION
 from weewx import WeeWxIOError
 from weewx.drivers import AbstractDevice
 from weewx.engine import InitializationError
 
 log = logging.getLogger(__name__)
+packet_log = get_packet_logger(__name__)
+
+_COMPONENT_SCHEDULER = "scheduler"
+_COMPONENT_POLL_HOST = "poll host"
+_COMPONENT_PUSH_HOST = "push host"
+
+NO_DATA_ITERATION_LENGTH = 5  # seconds
+WAKEUP_REPORT_INTERVAL = 60  # seconds
 
 
 class WeatherlinkLiveDriver(AbstractDevice):
@@ -41,21 +63,81 @@ class WeatherlinkLiveDriver(AbstractDevice):
         """Initialize driver"""
 
         self.run = True
-        log.info("Initializing driver: %s v%s" % (DRIVER_NAME, DRIVER_VERSION))
+        log.info("Initializing driver: %s v%s", DRIVER_NAME, DRIVER_VERSION)
 
         self.configuration = create_configuration(conf_dict, DRIVER_NAME)
-        log.debug("Configuration: %s" % (repr(self.configuration)))
+        log.debug("Configuration: %r", self.configuration)
+        configure_packet_logging(self.configuration.packet_log_sampling, self.configuration.packet_log_rate_limit)
 
         self.mappers = self.configuration.create_mappers()
-        self.wind_service = WllWindGustService(engine, conf_dict, self.mappers, self.configuration.log_success,
-                                               self.configuration.log_error)
+        self.mapper_state_keys = ["mapping:%s" % definition
+                                  for definition in build_mapping_definitions(self.configuration.mappings)]
+
+        self.state_store = StateStore(
+            self.configuration.state_file,
+            self.configuration.state_flush_interval
+        ) if self.configuration.state_file else None
+        self._restore_mapper_state()
+
+        self.wind_service = WllWindGustService(engine, conf_dict, self.mappers, self.configuration.wind_windows,
+                                               self.configuration.log_success, self.configuration.log_error,
+                                               self.state_store)
+
+        self.archive_accumulator = ArchiveAccumulator(
+            self.mappers,
+            self.configuration.archive_interval,
+            self.configuration.unit_system
+        ) if self.configuration.archive_records else None
+        self.archive_records = deque()
+        self.spool = LoopSpool(
+            self.configuration.spool_file,
+            self.configuration.spool_size
+        ) if self.configuration.spool_file else None
+        self.downsampler = LoopDownsampler(
+            self.mappers,
+            self.configuration.downsample_interval,
+            self.configuration.unit_system
+        ) if self.configuration.downsample_interval else None
+        self.change_filter = ChangeFilter(
+            self.mappers,
+            self.configuration.sparse_refresh_interval
+        ) if self.configuration.sparse_loop_packets else None
+        self.last_packet_ts = None
+        self.last_packet_received = None
 
         self.is_running = False
         self.scheduler = None
-        self.no_data_count = 0
+        self.no_data_deadline = None
         self.data_event = None
         self.poll_host = None
         self.push_host = None
+        self.supervisor = None
+
+        self.wakeups = WakeupCounter("driver loop")
+        self.wakeup_report_time = time.monotonic()
+
+        if self.configuration.metrics:
+            self.poll_metrics = PipelineMetrics("poll")
+            self.push_metrics = PipelineMetrics("push")
+        else:
+            self.poll_metrics = None
+            self.push_metrics = None
+        self.metrics_report_time = time.monotonic()
+        self.metrics_exporter = None
+
+        self.profiler = SamplingProfiler(
+            self.configuration.profile,
+            self.configuration.profile_directory,
+            self.configuration.profile_interval,
+            self.configuration.profile_duty_cycle,
+            self.configuration.profile_keep
+        ) if self.configuration.profile else None
+
+        self.capture = CaptureWriter(
+            self.configuration.capture_file,
+            self.configuration.capture_compress
+        ) if self.configuration.capture_file else None
+        self.sample_store = None
 
     @property
     def hardware_name(self):
@@ -74,40 +156,47 @@ class WeatherlinkLiveDriver(AbstractDevice):
         # Either it's the first iteration of the driver
         # or we've just created an archive packet and are
         # now resuming the driver.
-        self._reset_data_count()
+        self._reset_no_data_deadline()
 
         self._log_success("Entering driver loop")
         while True:
-            self._check_no_data_count()
+            self._check_no_data_deadline()
 
-            try:
-                self.scheduler.raise_error()
-                self.poll_host.raise_error()
-                self.push_host.raise_error()
-            except Exception as e:
-                raise WeeWxIOError("Error while receiving or processing packets: %s" % repr(e)) from e
+            # Failed components are restarted in place; raises if a component keeps failing
+            next_restart = self.supervisor.check()
 
-            log.debug("Waiting for new packet")
-            self.data_event.wait(5)  # do a check every 5 secs
-            self.data_event.clear()
+            # No periodic wake-ups: hosts and scheduler set the event on data and on errors, so only sleep until
+            # the no-data deadline or the next pending restart
+            wait_timeout = max(self.no_data_deadline - time.monotonic(), 0)
+            if next_restart is not None and next_restart < wait_timeout:
+                wait_timeout = next_restart
 
-            emitted_poll_packet = False
-            emitted_push_packet = False
+            packet_log.debug("Waiting for new packet")
+            self.data_event.wait(wait_timeout)
+            self.data_event.clear()
+            self.wakeups.increment()
+            self._report_wakeups()
+            self._report_metrics()
 
             while self.poll_host.packets:
-                self._log_success("Emitting poll packet", level=logging.INFO)
-                self._reset_data_count()
-                emitted_poll_packet = True
-                yield self.poll_host.packets.popleft()
+                self._log_packet("Emitting poll packet")
+                self._reset_no_data_deadline()
+                self.supervisor.healthy(_COMPONENT_SCHEDULER)
+                self.supervisor.healthy(_COMPONENT_POLL_HOST)
+                record = self._process_record(self.poll_host.pop_packet())
+                if record is not None:
+                    yield from self._emit(record, self.poll_metrics)
 
             while self.push_host.packets:
-                self._log_success("Emitting push (broadcast) packet", level=logging.INFO)
-                self._reset_data_count()
-                emitted_push_packet = True
-                yield self.push_host.packets.popleft()
-
-            if not emitted_poll_packet and not emitted_push_packet:
-                self._increase_no_data_count()
+                self._log_packet("Emitting push (broadcast) packet")
+                self._reset_no_data_deadline()
+                self.supervisor.healthy(_COMPONENT_PUSH_HOST)
+                record = self.push_host.pop_packet()
+                if self.sample_store is not None:
+                    self.sample_store.add(record)
+                record = self._process_record(record)
+                if record is not None:
+                    yield from self._emit(record, self.push_metrics)
 
     def start(self):
         if self.is_running:
@@ -119,30 +208,168 @@ class WeatherlinkLiveDriver(AbstractDevice):
             self.configuration.host,
             self.mappers,
             self.data_event,
-            self.configuration.socket_timeout
+            self.configuration.socket_timeout,
+            self.poll_metrics,
+            self.profiler,
+            self.capture,
+            self.configuration.unit_system
         )
         self.push_host = data_host.WLLBroadcastHost(
             self.configuration.host,
             self.mappers,
             self.data_event,
-            self.configuration.socket_timeout
+            self.configuration.socket_timeout,
+            self.configuration.broadcast_error_budget,
+            self.configuration.broadcast_error_window,
+            self.push_metrics,
+            self.profiler,
+            self.capture,
+            self.configuration.unit_system
         )
-        self.scheduler = scheduler.Scheduler(
+        self.scheduler = self._create_scheduler()
+
+        self.supervisor = Supervisor(self.configuration.max_component_restarts,
+                                     self.configuration.log_success,
+                                     self.configuration.log_error)
+        self.supervisor.add(_COMPONENT_SCHEDULER, lambda: self.scheduler.error, self._restart_scheduler)
+        self.supervisor.add(_COMPONENT_POLL_HOST, lambda: self.poll_host.error, self.poll_host.clear_error)
+        self.supervisor.add(_COMPONENT_PUSH_HOST, lambda: self.push_host.error, self.push_host.restart)
+
+        if self.configuration.metrics_port:
+            self.metrics_exporter = self._create_metrics_exporter()
+        if self.configuration.sample_file:
+            self.sample_store = self._create_sample_store()
+
+    def _create_metrics_exporter(self):
+        # The HTTP server is only loaded when the exporter is enabled
+        from user.weatherlink_live.exporter import MetricsExporter
+
+        gauges = []
+        for host, metrics in ((self.poll_host, self.poll_metrics), (self.push_host, self.push_metrics)):
+            gauges.append(("queue_depth", metrics.name, lambda host=host: len(host.packets)))
+            gauges.append(("seconds_since_last_record", metrics.name,
+                           lambda host=host: time.perf_counter() - host.last_record_time
+                           if host.last_record_time is not None else None))
+
+        return MetricsExporter(self.configuration.metrics_port, [self.poll_metrics, self.push_metrics], gauges)
+
+    def _create_sample_store(self):
+        # SQLite is only loaded when storing samples
+        from user.weatherlink_live.samples import SampleStore
+
+        return SampleStore(self.configuration.sample_file,
+                           self.configuration.sample_flush_interval,
+                           self.configuration.sample_retention)
+
+    def _create_scheduler(self) -> scheduler.Scheduler:
+        return scheduler.Scheduler(
             self.configuration.polling_interval,
             self.poll_host.poll,
             self.push_host.refresh_broadcast,
-            self.data_event
+            self.data_event,
+            self.profiler
         )
 
+    def _restart_scheduler(self):
+        self.scheduler.cancel()
+        self.scheduler = self._create_scheduler()
+
+    @staticmethod
+    def _emit(record: dict, metrics: Optional[PipelineMetrics]):
+        if metrics is None:
+            yield record
+            return
+
+        # Measures how long the engine takes to process the packet before resuming the driver
+        start = time.perf_counter()
+        yield record
+        metrics.histogram("yield").observe(time.perf_counter() - start)
+
+    def _process_record(self, record: dict) -> Optional[dict]:
+        self.last_packet_ts = record['dateTime']
+        self.last_packet_received = time.time()
+
+        if self.spool is not None:
+            self.spool.append(record)
+        self._accumulate(record)
+        self._save_mapper_state()
+
+        # Spool and archive records are based on complete, not downsampled records
+        if self.downsampler is not None:
+            record = self.downsampler.add_record(record)
+            if record is None:
+                return None
+
+        if self.change_filter is not None:
+            return self.change_filter.filter(record)
+        return record
+
+    def _restore_mapper_state(self) -> None:
+        if self.state_store is None:
+            return
+
+        for key, mapper in zip(self.mapper_state_keys, self.mappers):
+            state = self.state_store.get(key)
+            if state is not None:
+                mapper.restore_state(state)
+
+    def _save_mapper_state(self) -> None:
+        if self.state_store is None:
+            return
+
+        for key, mapper in zip(self.mapper_state_keys, self.mappers):
+            self.state_store.set(key, mapper.state, mapper.state_is_critical)
+        self.state_store.flush()
+
+    def _accumulate(self, record: dict) -> None:
+        if self.archive_accumulator is None:
+            return
+
+        archive_record = self.archive_accumulator.add_record(record)
+        if archive_record is not None:
+            self._log_success("Completed archive record %r", archive_record)
+            self.archive_records.append(archive_record)
+
+    def _replay_spool(self, since_ts) -> None:
+        records = self.spool.records_since(since_ts)
+        log.info("Replaying %d spooled loop records", len(records))
+
+        for record in records:
+            # The unit system may have been changed in the configuration since the record was spooled
+            self._accumulate(weewx.units.to_std_system(record, self.configuration.unit_system))
+
     @property
     def archive_interval(self):
-        raise NotImplementedError("Not supported")
-
-    def genArchiveRecords(self, _):
-        raise NotImplementedError("Not supported")
+        if self.archive_accumulator is None:
+            raise NotImplementedError("Not supported")
+        return self.archive_accumulator.interval
+
+    def genStartupRecords(self, since_ts):
+        if self.spool is not None and self.archive_accumulator is not None:
+            self._replay_spool(since_ts)
+        return self.genArchiveRecords(since_ts)
+
+    def genArchiveRecords(self, since_ts):
+        if self.archive_accumulator is None:
+            raise NotImplementedError("Not supported")
+        return self._gen_archive_records(since_ts)
+
+    def _gen_archive_records(self, since_ts):
+        while self.archive_records:
+            archive_record = self.archive_records.popleft()
+            if since_ts is not None and archive_record['dateTime'] <= since_ts:
+                self._log_success("Skipping archive record at %d. Already archived", archive_record['dateTime'])
+                continue
+
+            self._log_success("Emitting archive record", level=logging.INFO)
+            yield archive_record
 
     def getTime(self):
-        raise NotImplementedError("Not supported")
+        if self.archive_accumulator is None or self.last_packet_ts is None:
+            raise NotImplementedError("Not supported")
+
+        # Estimate the clock of the WeatherLink Live from the timestamp of the most recent packet
+        return int(self.last_packet_ts + (time.time() - self.last_packet_received) + 0.5)
 
     def setTime(self):
         raise NotImplementedError("Not supported")
@@ -151,34 +378,78 @@ class WeatherlinkLiveDriver(AbstractDevice):
         """Close connection"""
 
         self.is_running = False
+        if self.metrics_exporter is not None:
+            self.metrics_exporter.close()
+        # Cancel HTTP requests of the hosts first, so a running scheduler tick ends immediately
+        if self.poll_host is not None:
+            self.poll_host.cancel()
+        if self.push_host is not None:
+            self.push_host.cancel()
         if self.scheduler is not None:
             self.scheduler.cancel()
+        # Only then stop the broadcast reception, which the tick may have restarted
         if self.poll_host is not None:
             self.poll_host.close()
         if self.push_host is not None:
             self.push_host.close()
-
-    def _increase_no_data_count(self):
-        self.no_data_count += 1
-        self._log_failure("No data since %d iterations" % self.no_data_count, logging.WARNING)
-
-    def _reset_data_count(self):
-        self.no_data_count = 0
-
-    def _check_no_data_count(self):
+        if self.spool is not None:
+            self.spool.close()
+        if self.state_store is not None:
+            self.state_store.flush(force=True)
+        if self.profiler is not None:
+            self.profiler.close()
+        if self.capture is not None:
+            self.capture.close()
+        if self.sample_store is not None:
+            self.sample_store.close()
+
+    def _reset_no_data_deadline(self):
         max_iterations = self.configuration.max_no_data_iterations
         if max_iterations < 1:
             raise ValueError("Max iterations without data must not be less than 1 (got: %d)" % max_iterations)
 
-        if self.no_data_count >= max_iterations:
-            raise WeeWxIOError("Received no data for %d iterations" % max_iterations)
+        self.no_data_deadline = time.monotonic() + max_iterations * NO_DATA_ITERATION_LENGTH
+
+    def _check_no_data_deadline(self):
+        if time.monotonic() >= self.no_data_deadline:
+            max_iterations = self.configuration.max_no_data_iterations
+            raise WeeWxIOError("Received no data for %d iterations (%d seconds)" % (
+                max_iterations, max_iterations * NO_DATA_ITERATION_LENGTH))
+
+    def _report_wakeups(self):
+        now = time.monotonic()
+        if now - self.wakeup_report_time < WAKEUP_REPORT_INTERVAL:
+            return
+        self.wakeup_report_time = now
+
+        counters = [self.wakeups, self.scheduler.wakeups, self.push_host.wakeups]
+        if self.configuration.log_success:
+            log.debug("Wake-ups per minute: %s", ", ".join(
+                "%s %.1f" % (counter.name, counter.per_minute()) for counter in counters))
+
+    def _report_metrics(self):
+        if self.poll_metrics is None or self.configuration.metrics_log_interval <= 0:
+            return
+
+        now = time.monotonic()
+        if now - self.metrics_report_time < self.configuration.metrics_log_interval:
+            return
+        self.metrics_report_time = now
+
+        for metrics in (self.poll_metrics, self.push_metrics):
+            log.info("Metrics of %s pipeline: %s", metrics.name, metrics)
 
-    def _log_success(self, msg: str, level: int = logging.DEBUG) -> None:
+    def _log_success(self, msg: str, *args, level: int = logging.DEBUG) -> None:
         if not self.configuration.log_success:
             return
-        log.log(level, msg)
+        log.log(level, msg, *args)
 
-    def _log_failure(self, msg: str, level: int = logging.DEBUG) -> None:
+    def _log_failure(self, msg: str, *args, level: int = logging.DEBUG) -> None:
         if not self.configuration.log_error:
             return
-        log.log(level, msg)
+        log.log(level, msg, *args)
+
+    def _log_packet(self, msg: str, *args) -> None:
+        if not self.configuration.log_success:
+            return
+        packet_log.info(msg, *args)
@@ -0,0 +1,165 @@
+# Copyright © 2020-2024 Michael Schantl and contributors
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Export driver metrics in the Prometheus text exposition format
+"""
+import logging
+import re
+import threading
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socket import socketpair
+from typing import Callable, Dict, List, Optional, Tuple
+
+import select
+
+from user.weatherlink_live.metrics import PipelineMetrics
+
+log = logging.getLogger(__name__)
+
+METRIC_PREFIX = "weatherlink_live_"
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Name of the gauge, pipeline label and function reading the current value (`None` if unknown)
+Gauge = Tuple[str, str, Callable[[], Optional[float]]]
+
+
+def _metric_name(name: str) -> str:
+    return METRIC_PREFIX + re.sub(r'[^a-zA-Z0-9_]', '_', name)
+
+
+def _label_value(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_value(value: float) -> str:
+    return repr(float(value)) if value == value else "NaN"
+
+
+def render(pipelines: List[PipelineMetrics], gauges: List[Gauge]) -> str:
+    """
+    Render metrics in the Prometheus text exposition format
+
+    Values are read without locking. A scrape may see a histogram in the middle of an update, which is
+    acceptable for monitoring.
+    """
+
+    families: Dict[str, Tuple[str, List[str]]] = dict()
+
+    def add(name: str, metric_type: str, line: str):
+        families.setdefault(name, (metric_type, []))[1].append(line)
+
+    for pipeline in pipelines:
+        pipeline_label = 'pipeline="%s"' % _label_value(pipeline.name)
+
+        for counter_name, counter in list(pipeline.counters.items()):
+            name = _metric_name(counter_name) + "_total"
+            add(name, "counter", "%s{%s} %d" % (name, pipeline_label, counter.value))
+
+        name = _metric_name("stage_latency_seconds")
+        for stage, histogram in list(pipeline.histograms.items()):
+            labels = '%s,stage="%s"' % (pipeline_label, _label_value(stage))
+            counts = list(histogram.counts)
+            cumulative = 0
+            for bound, count in zip(histogram.bounds, counts):
+                cumulative += count
+                add(name, "histogram", '%s_bucket{%s,le="%s"} %d' % (name, labels, bound, cumulative))
+            cumulative += counts[-1]
+            add(name, "histogram", '%s_bucket{%s,le="+Inf"} %d' % (name, labels, cumulative))
+            add(name, "histogram", '%s_sum{%s} %s' % (name, labels, _format_value(histogram.sum)))
+            add(name, "histogram", '%s_count{%s} %d' % (name, labels, cumulative))
+
+    for gauge_name, pipeline_name, read in gauges:
+        value = read()
+        if value is None:
+            continue
+        name = _metric_name(gauge_name)
+        add(name, "gauge", '%s{pipeline="%s"} %s' % (name, _label_value(pipeline_name), _format_value(value)))
+
+    lines = []
+    for name, (metric_type, samples) in families.items():
+        lines.append("# TYPE %s %s" % (name, metric_type))
+        lines.extend(samples)
+    return "\n".join(lines) + "\n"
+
+
+class _MetricsRequestHandler(BaseHTTPRequestHandler):
+    timeout = 5  # Don't let a stalled client block the exporter thread
+
+    def do_GET(self):
+        if self.path not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+
+        body = render(self.server.pipelines, self.server.gauges).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        log.debug("Metrics request from %s: " + format, self.address_string(), *args)
+
+
+class MetricsExporter(object):
+    """Serve metrics over HTTP on localhost from a background thread"""
+
+    def __init__(self, port: int, pipelines: List[PipelineMetrics], gauges: List[Gauge]):
+        self.join_timeout = 1
+
+        self._server = HTTPServer(('127.0.0.1', port), _MetricsRequestHandler)
+        self._server.pipelines = pipelines
+        self._server.gauges = gauges
+
+        # Writing to the wake-up socket interrupts select() immediately when closing
+        self._wake_receive, self._wake_send = socketpair()
+
+        self.stop_signal = threading.Event()
+        self.thread = threading.Thread(name='WLL-MetricsExporter', target=self._serve)
+        self.thread.daemon = True
+        self.thread.start()
+        log.info("Serving metrics on http://127.0.0.1:%d/metrics", port)
+
+    def _serve(self):
+        while not self.stop_signal.is_set():
+            r, _, _ = select.select([self._server, self._wake_receive], [], [])
+            if self._server not in r:
+                continue
+
+            try:
+                self._server.handle_request()
+            except Exception as e:
+                log.error("Error while serving metrics: %r", e)
+
+    def close(self):
+        if self.stop_signal.is_set():
+            return
+
+        log.debug("Stopping metrics exporter")
+        self.stop_signal.set()
+        self._wake_send.send(b'\0')
+        self.thread.join(self.join_timeout)
+        if self.thread.is_alive():
+            log.warning("Metrics exporter thread still alive. Force closing socket")
+
+        self._server.server_close()
+        self._wake_send.close()
+        self._wake_receive.close()
@@ -22,10 +22,14 @@
 Mappings of API to observations
 """
 import logging
-from typing import Dict, List, Optional, Union
+import time
+from typing import Any, Dict, List, Optional, Tuple, Union
 
+import weewx
+from user.weatherlink_live.observations import unit_conversion
+from user.weatherlink_live.packet_logging import get_packet_logger
 from user.weatherlink_live.packets import NotInPacket, DavisConditionsPacket
-from user.weatherlink_live.static import PacketSource, targets, labels
+from user.weatherlink_live.static import PacketSource, Aggregation, targets, labels
 from user.weatherlink_live.static.packets import DataStructureType, KEY_TEMPERATURE, KEY_HUMIDITY, KEY_DEW_POINT, \
     KEY_HEAT_INDEX, KEY_WET_BULB, KEY_WIND_DIR, KEY_RAIN_AMOUNT_DAILY, KEY_RAIN_SIZE, KEY_RAIN_RATE, \
     KEY_SOLAR_RADIATION, KEY_UV_INDEX, KEY_WIND_CHILL, KEY_THW_INDEX, KEY_THSW_INDEX, KEY_SOIL_MOISTURE, \
@@ -33,6 +37,7 @@ from user.weatherlink_live.static.packets import DataStructureType, KEY_TEMPERAT
     KEY_HEAT_INDEX_INDOOR, KEY_BARO_ABSOLUTE, KEY_BARO_SEA_LEVEL, KEY_WIND_SPEED, KEY_BATTERY_FLAG
 
 log = logging.getLogger(__name__)
+packet_log = get_packet_logger(__name__)
 
 
 def _parse_option_boolean(opts: list, check_for: str) -> bool:
@@ -45,6 +50,10 @@ def _parse_option_boolean(opts: list, check_for: str) -> bool:
     return uppercase_check_for in uppercase_opts
 
 
+def _local_day(ts: float) -> str:
+    return time.strftime('%Y-%m-%d', time.localtime(ts))
+
+
 class AbstractMapping(object):
     def __init__(self, mapping_opts: list, used_map_targets: list,
                  log_success: bool = False, log_error: bool = True):
@@ -54,28 +63,35 @@ class AbstractMapping(object):
         self.log_error = log_error
 
         self.targets = self.__search_multi_targets(self._map_target_dict, used_map_targets)
-        self._log_success("Mapping targets: %s" % repr(self.targets))
+        self._log_success("Mapping targets: %r", self.targets)
+
+        self.unit_system = weewx.US
+        self._conversions: Dict[str, Tuple[float, float]] = dict()
 
     def __str__(self):
         return type(self).__name__ + (repr(self.mapping_opts) if self.mapping_opts else "")
 
-    def _log_success(self, message: str, level: int = logging.DEBUG) -> None:
+    def _log_success(self, message: str, *args, level: int = logging.DEBUG) -> None:
         if self.log_success:
-            log.log(level, "%s: %s" % (str(self), message))
+            log.log(level, "%s: " + message, self, *args)
 
-    def _log_error(self, message: str, level: int = logging.DEBUG) -> None:
+    def _log_error(self, message: str, *args, level: int = logging.DEBUG) -> None:
         if self.log_error:
-            log.log(level, "%s: %s" % (str(self), message))
+            log.log(level, "%s: " + message, self, *args)
 
     def _log_mapping_success(self, target: str, value: float = None):
-        self._log_success("Mapped: %s=%s" % (target, repr(value)))
+        # Called for every mapped value; formatted only if actually logged
+        if self.log_success:
+            packet_log.debug("%s: Mapped: %s=%r", self, target, value)
 
     def _log_mapping_notResponsible(self, message: str):
         """Logged when the mapper doesn't feel responsible for a packet"""
-        self._log_success("Mapping not responsible: %s" % message)
+        if self.log_success:
+            packet_log.debug("%s: Mapping not responsible: %s", self, message)
 
     def _log_mapping_notInPacket(self):
-        self._log_success("Observation not found in packet")
+        if self.log_success:
+            packet_log.debug("%s: Observation not found in packet", self)
 
     def _parse_option_int(self, opts: list, index: int) -> int:
         try:
@@ -126,9 +142,63 @@ class AbstractMapping(object):
         raise NotImplementedError()
 
     def _set_record_entry(self, record: dict, key: str, value: float = None):
-        record.update({key: value})
+        record[key] = value
         self._log_mapping_success(key, value)
 
+    def _set_converted_record_entry(self, record: dict, key: str, value: float = None):
+        """Replaces `_set_record_entry` if any target has to be converted to another unit system"""
+
+        if value is not None:
+            conversion = self._conversions.get(key)
+            if conversion is not None:
+                value = value * conversion[0] + conversion[1]
+        record[key] = value
+        self._log_mapping_success(key, value)
+
+    def set_unit_system(self, unit_system: int) -> None:
+        """
+        Emit observations in a unit system
+
+        The WeatherLink Live delivers US units. Conversions of all targets are calculated once, so converting a value
+        costs a single multiplication and addition.
+        """
+
+        self.unit_system = unit_system
+        self._conversions = self._create_conversions(unit_system)
+        self._log_success("Unit conversions: %r", self._conversions)
+
+        if self._conversions:
+            self._set_record_entry = self._set_converted_record_entry
+        else:
+            self.__dict__.pop('_set_record_entry', None)
+
+    def _create_conversions(self, unit_system: int) -> Dict[str, Tuple[float, float]]:
+        conversions = dict()
+        for target in self.targets.values():
+            conversion = unit_conversion(target, unit_system)
+            if conversion is not None:
+                conversions[target] = conversion
+        return conversions
+
+    @property
+    def aggregations(self) -> Dict[str, Aggregation]:
+        """How the mapped observations are aggregated over a period of time"""
+        return dict([(target, Aggregation.AVG) for target in self.targets.values()])
+
+    @property
+    def state(self) -> Optional[Dict[str, Any]]:
+        """State to be persisted across restarts"""
+        return None
+
+    @property
+    def state_is_critical(self) -> bool:
+        """Whether losing the latest state would corrupt data after a restart, so it has to be written immediately"""
+        return False
+
+    def restore_state(self, state: Dict[str, Any]) -> None:
+        """Restore state persisted before a restart"""
+        pass
+
     @property
     def map_source_transmitter(self) -> str:
         raise NotImplementedError()
@@ -245,6 +315,11 @@ class WindMapping(AbstractMapping):
         self._set_record_entry(record, target_speed,
                                packet.get_observation(KEY_WIND_SPEED, DataStructureType.ISS, self.tx_id))
 
+    @property
+    def aggregations(self) -> Dict[str, Aggregation]:
+        # Wind is aggregated as vectors
+        return {}
+
     @property
     def map_source_transmitter(self) -> str:
         return labels.LABEL_SOURCE_TX_ID % self.tx_id
@@ -271,9 +346,13 @@ class RainMapping(AbstractMapping):
             3: (1 / 25.4) * 0.1
         }
 
+        # Bucket sizes in the amount and rate units of the unit system
+        self.rain_bucket_factors = self._convert_rain_bucket_sizes(weewx.US)
+
         self.tx_id = self._parse_option_int(mapping_opts, 0)
 
         self.last_daily_rain_count = None
+        self.last_daily_rain_day = None
 
     @property
     def _map_target_dict(self) -> Dict[str, List[str]]:
@@ -296,12 +375,12 @@ class RainMapping(AbstractMapping):
         target_rate_count = self.targets['count_rate']
         target_size = self.targets['size']
 
-        rain_bucket_factor = self.rain_bucket_factor(packet)
-        self._set_record_entry(record, target_size, rain_bucket_factor)
+        rain_amount_factor, rain_rate_factor = self.rain_bucket_factor(packet)
+        self._set_record_entry(record, target_size, rain_amount_factor)
 
         rain_rate_count = packet.get_observation(KEY_RAIN_RATE, DataStructureType.ISS, self.tx_id)
         self._set_record_entry(record, target_rate_count, rain_rate_count)
-        self._set_record_entry(record, target_rate, self._multiply(rain_rate_count, rain_bucket_factor))
+        self._set_record_entry(record, target_rate, self._multiply(rain_rate_count, rain_rate_factor))
 
         current_daily_rain_count = packet.get_observation(KEY_RAIN_AMOUNT_DAILY, DataStructureType.ISS, self.tx_id)
         if current_daily_rain_count is None:
@@ -309,20 +388,56 @@ class RainMapping(AbstractMapping):
             return
 
         if self.last_daily_rain_count is None:
-            self._log_success("First daily rain value", logging.INFO)
+            self._log_success("First daily rain value", level=logging.INFO)
 
         elif self.last_daily_rain_count > current_daily_rain_count:
-            self._log_success("Last daily rain (%d) larger than current (%d). Probably reset" % (
-                self.last_daily_rain_count, current_daily_rain_count), logging.INFO)
+            self._log_success("Last daily rain (%d) larger than current (%d). Probably reset",
+                              self.last_daily_rain_count, current_daily_rain_count, level=logging.INFO)
             self._set_record_entry(record, target_count, current_daily_rain_count)
-            self._set_record_entry(record, target_amount, self._multiply(current_daily_rain_count, rain_bucket_factor))
+            self._set_record_entry(record, target_amount, self._multiply(current_daily_rain_count, rain_amount_factor))
 
         else:
             count_diff = current_daily_rain_count - self.last_daily_rain_count
             self._set_record_entry(record, target_count, count_diff)
-            self._set_record_entry(record, target_amount, self._multiply(count_diff, rain_bucket_factor))
+            self._set_record_entry(record, target_amount, self._multiply(count_diff, rain_amount_factor))
 
         self.last_daily_rain_count = current_daily_rain_count
+        self.last_daily_rain_day = _local_day(packet.timestamp)
+
+    @property
+    def state(self) -> Optional[Dict[str, Any]]:
+        if self.last_daily_rain_count is None:
+            return None
+        return {
+            'last_daily_rain_count': self.last_daily_rain_count,
+            'day': self.last_daily_rain_day,
+        }
+
+    @property
+    def state_is_critical(self) -> bool:
+        # A stale baseline counts the rain since it was written again
+        return True
+
+    def restore_state(self, state: Dict[str, Any]) -> None:
+        # The daily rain count is reset at midnight; a count of a different day would be meaningless
+        day = state.get('day')
+        if day != _local_day(time.time()):
+            self._log_success("Discarding persisted daily rain count of %s", day, level=logging.INFO)
+            return
+
+        self.last_daily_rain_count = state.get('last_daily_rain_count')
+        self.last_daily_rain_day = day
+        self._log_success("Restored daily rain count %r", self.last_daily_rain_count, level=logging.INFO)
+
+    @property
+    def aggregations(self) -> Dict[str, Aggregation]:
+        return {
+            self.targets['amount']: Aggregation.SUM,
+            self.targets['rate']: Aggregation.AVG,
+            self.targets['count']: Aggregation.SUM,
+            self.targets['count_rate']: Aggregation.AVG,
+            self.targets['size']: Aggregation.LAST,
+        }
 
     @property
     def map_source_transmitter(self) -> str:
@@ -334,16 +449,34 @@ class RainMapping(AbstractMapping):
             return None
         return a * b
 
-    def rain_bucket_factor(self, packet) -> Optional[float]:
+    def rain_bucket_factor(self, packet) -> Tuple[Optional[float], Optional[float]]:
+        """Rain amount and rain rate of one bucket tip"""
+
         rain_bucket_size = packet.get_observation(KEY_RAIN_SIZE, DataStructureType.ISS, self.tx_id)
         if rain_bucket_size is None:
-            return None
+            return None, None
 
         try:
-            return self.rain_bucket_sizes[rain_bucket_size]
+            return self.rain_bucket_factors[rain_bucket_size]
         except KeyError as e:
             raise KeyError("Unexpected rain bucket size %s" % repr(rain_bucket_size)) from e
 
+    def _convert_rain_bucket_sizes(self, unit_system: int) -> Dict[int, Tuple[float, float]]:
+        amount_factor = (unit_conversion(self.targets['amount'], unit_system) or (1.0, 0.0))[0]
+        rate_factor = (unit_conversion(self.targets['rate'], unit_system) or (1.0, 0.0))[0]
+        return dict([
+            (key, (size * amount_factor, size * rate_factor)) for key, size in self.rain_bucket_sizes.items()
+        ])
+
+    def _create_conversions(self, unit_system: int) -> Dict[str, Tuple[float, float]]:
+        # Conversions of rain amounts and rates are folded into the bucket sizes
+        self.rain_bucket_factors = self._convert_rain_bucket_sizes(unit_system)
+
+        conversions = super()._create_conversions(unit_system)
+        for key in ('amount', 'rate', 'size'):
+            conversions.pop(self.targets[key], None)
+        return conversions
+
     @property
     def map_table(self) -> Dict[str, str]:
         return {
@@ -718,6 +851,10 @@ class BatteryStatusMapping(AbstractMapping):
             self._set_record_entry(record, target,
                                    packet.get_observation(KEY_BATTERY_FLAG, tx=self.tx_id))
 
+    @property
+    def aggregations(self) -> Dict[str, Aggregation]:
+        return dict([(target, Aggregation.LAST) for target in [self.targets['battery'], *self.further_targets]])
+
     @property
     def map_source_transmitter(self) -> str:
         return labels.LABEL_SOURCE_TX_ID % self.tx_id
@@ -0,0 +1,142 @@
+# Copyright © 2020-2024 Michael Schantl and contributors
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Lightweight runtime metrics of the driver
+"""
+import time
+from bisect import bisect_left
+from typing import Dict, Tuple
+
+# Upper bounds (in seconds) of the latency histogram buckets. A last bucket catches everything above.
+LATENCY_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class WakeupCounter(object):
+    """
+    Count the wake-ups of a single thread
+
+    Every thread gets its own counter, so no locking is needed.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.count = 0
+
+        self._reported_count = 0
+        self._reported_time = time.monotonic()
+
+    def increment(self) -> None:
+        self.count += 1
+
+    def per_minute(self) -> float:
+        """Wake-ups per minute since the previous call"""
+
+        now = time.monotonic()
+        elapsed = now - self._reported_time
+        count = self.count
+        rate = (count - self._reported_count) * 60 / elapsed if elapsed > 0 else 0.0
+
+        self._reported_count = count
+        self._reported_time = now
+        return rate
+
+
+class Counter(object):
+    """Monotonic counter"""
+
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+    def increment(self, amount: int = 1) -> None:
+        self.value += amount
+
+
+class Histogram(object):
+    """Histogram with fixed buckets"""
+
+    __slots__ = ('bounds', 'counts', 'count', 'sum', 'max')
+
+    def __init__(self, bounds: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket containing the quantile `q`"""
+
+        rank = q * self.count
+        cumulative = 0
+        for bound, count in zip(self.bounds, self.counts):
+            cumulative += count
+            if cumulative >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def __str__(self):
+        if self.count == 0:
+            return "n=0"
+        return "n=%d mean=%.2fms p50<=%.2fms p99<=%.2fms max=%.2fms" % (
+            self.count, self.sum / self.count * 1000, self.quantile(0.5) * 1000, self.quantile(0.99) * 1000,
+            self.max * 1000)
+
+
+class PipelineMetrics(object):
+    """
+    Latency histograms and counters of one ingestion pipeline (polling or broadcast)
+
+    Each histogram and counter is only written by a single thread, so no locking is needed.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.histograms: Dict[str, Histogram] = dict()
+        self.counters: Dict[str, Counter] = dict()
+
+    def histogram(self, name: str) -> Histogram:
+        """Get histogram, creating it if it doesn't exist yet"""
+
+        if name not in self.histograms:
+            self.histograms[name] = Histogram()
+        return self.histograms[name]
+
+    def counter(self, name: str) -> Counter:
+        """Get counter, creating it if it doesn't exist yet"""
+
+        if name not in self.counters:
+            self.counters[name] = Counter()
+        return self.counters[name]
+
+    def __str__(self):
+        parts = ["%s: %s" % (name, histogram) for name, histogram in self.histograms.items()]
+        parts.extend("%s: %d" % (name, counter.value) for name, counter in self.counters.items())
+        return "; ".join(parts)
@@ -0,0 +1,101 @@
+# Copyright © 2020-2024 Michael Schantl and contributors
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Observations added by this driver and their units
+"""
+from typing import List, Optional, Tuple
+
+import weewx.units
+
+_temperature_fields = ["dewpoint2",
+                       "dewpoint3",
+                       "dewpoint4",
+                       "dewpoint5",
+                       "dewpoint6",
+                       "dewpoint7",
+                       "dewpoint8",
+                       "heatindex2",
+                       "heatindex3",
+                       "heatindex4",
+                       "heatindex5",
+                       "heatindex6",
+                       "heatindex7",
+                       "heatindex8",
+                       "wetbulb",
+                       "wetbulb1",
+                       "wetbulb2",
+                       "wetbulb3",
+                       "wetbulb4",
+                       "wetbulb5",
+                       "wetbulb6",
+                       "wetbulb7",
+                       "wetbulb8",
+                       "thw",
+                       "thsw",
+                       "inHeatindex"]
+_rain_count_fields = ['rainCount']  # unit: count
+_rain_count_rate_fields = ['rainCountRate']  # unit: count per hour
+_rain_amount_fields = ['rainSize']  # unit: technically rain amount (inch/mm)
+
+
+def added_observations() -> List[str]:
+    """Observations added by this driver, which are not part of the WeeWX schemas"""
+
+    return _temperature_fields + _rain_count_fields + _rain_count_rate_fields + _rain_amount_fields
+
+
+def configure_units() -> None:
+    # Define units of new observation
+    weewx.units.obs_group_dict.update(dict([(observation, "group_temperature") for observation in _temperature_fields]))
+    weewx.units.obs_group_dict.update(dict([(observation, "group_count") for observation in _rain_count_fields]))
+    weewx.units.obs_group_dict.update(dict([(observation, "group_rate") for observation in _rain_count_rate_fields]))
+    weewx.units.obs_group_dict.update(dict([(observation, "group_rain") for observation in _rain_amount_fields]))
+
+    # Define unit group 'group_rate'
+    weewx.units.USUnits['group_rate'] = 'per_hour'
+    weewx.units.MetricUnits['group_rate'] = 'per_hour'
+    weewx.units.MetricWXUnits['group_rate'] = 'per_hour'
+
+    weewx.units.default_unit_format_dict['per_hour'] = '%.0f'
+    weewx.units.default_unit_label_dict['per_hour'] = ' per hour'
+
+
+def unit_conversion(observation: str, unit_system: int) -> Optional[Tuple[float, float]]:
+    """
+    Factor and offset converting an observation from US units (as delivered by the WeatherLink Live) to a unit system
+
+    :return: `(factor, offset)`, so that `converted = value * factor + offset`; `None` if no conversion is necessary
+    """
+
+    group = weewx.units.obs_group_dict.get(observation)
+    if group is None:
+        return None
+
+    from_unit = weewx.units.USUnits.get(group)
+    to_unit = weewx.units.std_groups[unit_system].get(group)
+    if from_unit is None or to_unit is None or from_unit == to_unit:
+        return None
+
+    # All conversions between the units of the standard unit systems are linear
+    convert = weewx.units.conversionDict[from_unit][to_unit]
+    offset = convert(0.0)
+    factor = (convert(100.0) - offset) / 100.0
+    return factor, offset
@@ -0,0 +1,124 @@
+# Copyright © 2020-2024 Michael Schantl and contributors
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""
+Logging of messages emitted for every packet
+
+Formatting is deferred until a message is actually emitted. Whether a level is enabled at all is checked once
+when configuring, so a disabled message costs a single attribute lookup. Enabled messages can be sampled (only every
+n-th message is logged) and rate limited (at most n messages per minute).
+"""
+import logging
+import time
+from typing import Dict
+
+RATE_LIMIT_WINDOW = 60.0
+
+_loggers: Dict[str, 'PacketLogger'] = dict()
+_sampling = 1
+_rate_limit = 0
+
+
+class PacketLogger(object):
+    """Log debug and info messages of a module, which are emitted for every packet"""
+
+    def __init__(self, name: str):
+        self.logger = logging.getLogger(name)
+        self.debug_enabled = False
+        self.info_enabled = False
+
+        self._sampling = 1
+        self._rate_limit = 0
+        self._skipped = 0
+        self._window_start = 0.0
+        self._window_count = 0
+        self._suppressed = 0
+
+    def configure(self, sampling: int, rate_limit: int) -> None:
+        self.debug_enabled = self.logger.isEnabledFor(logging.DEBUG)
+        self.info_enabled = self.logger.isEnabledFor(logging.INFO)
+        self._sampling = sampling
+        self._rate_limit = rate_limit
+        self._skipped = 0
+        self._window_count = 0
+        self._suppressed = 0
+
+    def debug(self, msg: str, *args) -> None:
+        if self.debug_enabled:
+            self._log(logging.DEBUG, msg, args)
+
+    def info(self, msg: str, *args) -> None:
+        if self.info_enabled:
+            self._log(logging.INFO, msg, args)
+
+    def _log(self, level: int, msg: str, args: tuple) -> None:
+        if self._sampling > 1:
+            self._skipped += 1
+            if self._skipped < self._sampling:
+                return
+            self._skipped = 0
+
+        if self._rate_limit > 0 and not self._within_rate_limit():
+            return
+
+        self.logger.log(level, msg, *args)
+
+    def _within_rate_limit(self) -> bool:
+        now = time.monotonic()
+        if now - self._window_start >= RATE_LIMIT_WINDOW:
+            if self._suppressed > 0:
+                self.logger.info("Suppressed %d per-packet messages exceeding the rate limit", self._suppressed)
+            self._window_start = now
+            self._window_count = 0
+            self._suppressed = 0
+
+        if self._window_count >= self._rate_limit:
+            self._suppressed += 1
+            return False
+
+        self._window_count += 1
+        return True
+
+
+def get_packet_logger(name: str) -> PacketLogger:
+    """Get the logger for per-packet messages of a module"""
+
+    logger = _loggers.get(name)
+    if logger is None:
+        logger = PacketLogger(name)
+        logger.configure(_sampling, _rate_limit)
+        _loggers[name] = logger
+    return logger
+
+
+def configure_packet_logging(sampling: int = 1, rate_limit: int = 0) -> None:
+    """
+    Check whether per-packet messages are enabled and set how many of them are logged
+
+    Has to be called again after changing the logging configuration.
+
+    :param sampling: Log only every n-th message of each module
+    :param rate_limit: Log at most this many messages per minute of each module. 0 for no limit
+    """
+
+    global _sampling, _rate_limit
+    _sampling = sampling
+    _rate_limit = rate_limit
+    for logger in _loggers.values():
+        logger.configure(sampling, rate_limit)
@@ -25,10 +25,12 @@ import logging
 from typing import Optional, Any, List, Dict, Set, Tuple
 
 import weewx
+from user.weatherlink_live.packet_logging import get_packet_logger
 from user.weatherlink_live.static import PacketSource
 from user.weatherlink_live.static.packets import DataStructureType
 
 log = logging.getLogger(__name__)
+packet_log = get_packet_logger(__name__)
 
 TxEntry = Dict[str, Optional[Any]]
 ConditionSet = List[TxEntry]
@@ -111,15 +113,19 @@ class DavisConditionsPacket(DavisPacket):
     def _find_tx_entry(self,
                        tx_type: DataStructureType = None,
                        tx_id: int = None) -> Optional[TxEntry]:
-        filtered = self._conditions
-        if tx_type is not None:
-            filtered = [conditions for conditions in filtered if conditions.get('data_structure_type') == tx_type]
-        if tx_id is not None:
-            filtered = [conditions for conditions in filtered if conditions.get('txid') == tx_id]
-        if len(filtered) > 1:
-            raise ValueError(
-                "Combination of dst %s and tx id %s did not result in an unique sensor" % (str(tx_type), str(tx_id)))
-        return filtered[0] if len(filtered) >= 1 else None
+        # Single pass without building filtered lists; this is called for every observation of every packet
+        found = None
+        for conditions in self._conditions:
+            if tx_type is not None and conditions.get('data_structure_type') != tx_type:
+                continue
+            if tx_id is not None and conditions.get('txid') != tx_id:
+                continue
+            if found is not None:
+                raise ValueError(
+                    "Combination of dst %s and tx id %s did not result in an unique sensor" % (str(tx_type),
+                                                                                               str(tx_id)))
+            found = conditions
+        return found
 
     def get_observation_from_multiple(self, combinations: List[dict]):
         """
@@ -186,7 +192,7 @@ class WlHttpConditionsRequestPacket(DavisConditionsPacket):
 
     @staticmethod
     def try_create(packet: dict, host: str):
-        log.debug("Trying to create HTTP conditions packet")
+        packet_log.debug("Trying to create HTTP conditions packet")
         try:
             return WlHttpConditionsRequestPacket(packet, host)
         except (ValueError, KeyError) as e:
@@ -236,7 +242,7 @@ class WlUdpBroadcastPacket(DavisConditionsPacket):
 
     @staticmethod
     def try_create(packet: dict, host: str):
-        log.debug("Trying to create UDP conditions packet")
+        packet_log.debug("Trying to create UDP conditions packet")
         try:
             return WlUdpBroadcastPacket(packet, host)
         except (ValueError, KeyError) as e:
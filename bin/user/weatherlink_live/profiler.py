@@ -0,0 +1,146 @@
+# Copyright © 2020-2024 Michael Schantl and contributors
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Sampling profiler for profiling the driver in production
+"""
+import cProfile
+import functools
+import logging
+import os
+import threading
+import time
+import tracemalloc
+from enum import Enum
+from typing import Callable, Optional
+
+log = logging.getLogger(__name__)
+
+FILE_PREFIX = "wll-profile-"
+TRACEMALLOC_FRAMES = 10
+
+
+class ProfileMode(Enum):
+    CPROFILE = 'cprofile'
+    TRACEMALLOC = 'tracemalloc'
+
+
+class SamplingProfiler(object):
+    """
+    Profile sections of the driver during periodic windows
+
+    A window of `interval * duty_cycle` seconds starts every `interval` seconds. At the end of each window the
+    results are written to a file in `directory`, keeping only the latest `keep` files.
+
+    Windows are only started and ended when a profiled section is entered, so no timer is needed.
+    """
+
+    def __init__(self, mode: ProfileMode, directory: str, interval: float, duty_cycle: float, keep: int):
+        self.mode = mode
+        self.directory = directory
+        self.interval = interval
+        self.duration = interval * duty_cycle
+        self.keep = keep
+
+        # Only one thread can be profiled at a time. Sections entered while the lock is held run unprofiled.
+        self._lock = threading.Lock()
+        self._window_start = time.monotonic()
+        self._window_active = False
+        self._profile: Optional[cProfile.Profile] = None
+        self._started_tracemalloc = False
+
+    def profiled(self, func: Callable) -> Callable:
+        """Wrap function as a profiled section"""
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not self._lock.acquire(blocking=False):
+                return func(*args, **kwargs)
+            try:
+                self._update_window()
+                if self._profile is not None:
+                    return self._profile.runcall(func, *args, **kwargs)
+            finally:
+                self._lock.release()
+            return func(*args, **kwargs)
+
+        return wrapper
+
+    def _update_window(self) -> None:
+        now = time.monotonic()
+        elapsed = now - self._window_start
+
+        if self._window_active and elapsed >= self.duration:
+            self._end_window()
+        if elapsed >= self.interval:
+            self._window_start = now
+            elapsed = 0
+        if not self._window_active and elapsed < self.duration:
+            self._start_window()
+
+    def _start_window(self) -> None:
+        log.debug("Starting %s profiling window of %d seconds", self.mode.value, self.duration)
+        self._window_active = True
+
+        if self.mode == ProfileMode.CPROFILE:
+            self._profile = cProfile.Profile()
+        elif not tracemalloc.is_tracing():
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+            self._started_tracemalloc = True
+
+    def _end_window(self) -> None:
+        self._window_active = False
+        try:
+            self._dump()
+        except OSError as e:
+            log.error("Could not write profile to %s: %r", self.directory, e)
+        finally:
+            self._profile = None
+            if self._started_tracemalloc:
+                tracemalloc.stop()
+                self._started_tracemalloc = False
+
+    def _dump(self) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, "%s%s.%s" % (FILE_PREFIX, time.strftime("%Y%m%d-%H%M%S"),
+                                                          "prof" if self.mode == ProfileMode.CPROFILE else "snapshot"))
+
+        if self._profile is not None:
+            self._profile.dump_stats(path)
+        elif tracemalloc.is_tracing():
+            tracemalloc.take_snapshot().dump(path)
+        else:
+            return
+        log.info("Wrote %s profile to %s", self.mode.value, path)
+
+        self._rotate()
+
+    def _rotate(self) -> None:
+        # Timestamps in the file names sort chronologically
+        files = sorted(name for name in os.listdir(self.directory) if name.startswith(FILE_PREFIX))
+        for name in files[:-self.keep]:
+            os.remove(os.path.join(self.directory, name))
+
+    def close(self) -> None:
+        """Write results of a running window"""
+
+        with self._lock:
+            if self._window_active:
+                self._end_window()
@@ -0,0 +1,175 @@
+# Copyright © 2020-2024 Michael Schantl and contributors
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+High-resolution store of broadcast records
+"""
+import logging
+import sqlite3
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List
+
+log = logging.getLogger(__name__)
+
+_TABLE_PREFIX = "samples_"
+# Records waiting to be written. About 7 hours of broadcasts; bounds memory use while the disk is stalled.
+_QUEUE_SIZE = 10000
+_EXCLUDED_KEYS = {'dateTime', 'usUnits', 'interval'}
+
+
+def _partition(timestamp: float) -> str:
+    """Name of the table holding records of the (UTC) day of the timestamp"""
+    return _TABLE_PREFIX + datetime.fromtimestamp(timestamp, timezone.utc).strftime('%Y%m%d')
+
+
+class SampleStore(object):
+    """
+    SQLite database storing every record received by broadcast
+
+    Records are queued in memory and written by a background thread every flush interval using a single transaction,
+    so adding a record never waits for the disk. If writing can't keep up, the oldest queued records are dropped. After
+    a write error, no further records are stored. Every UTC day is stored in a table of its own (e.g.
+    `samples_20240131`), with a column per observation. Tables older than the retention are dropped as a whole.
+    """
+
+    def __init__(self, path: str, flush_interval: float, retention_days: int):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.retention_days = retention_days
+
+        self._queue = deque(maxlen=_QUEUE_SIZE)
+        self._columns: Dict[str, List[str]] = dict()
+        self.failed = False
+        self.dropped = 0
+        self.join_timeout = 10
+
+        self.stop_signal = threading.Event()
+        self.thread = threading.Thread(name='WLL-SampleStore', target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def add(self, record: dict) -> None:
+        if self.failed:
+            return
+
+        if len(self._queue) == _QUEUE_SIZE:
+            if self.dropped == 0:
+                log.warning("Writing samples to %s can't keep up. Dropping the oldest samples", self.path)
+            self.dropped += 1
+
+        # Copied, as services of the engine modify loop packets
+        self._queue.append(dict(record))
+
+    def _run(self):
+        log.debug("Starting sample store %s", self.path)
+        connection = None
+        try:
+            connection = sqlite3.connect(self.path, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            # Committed transactions may be lost on power failure, but the database stays consistent
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._load_partitions(connection)
+
+            while not self.stop_signal.wait(self.flush_interval):
+                self._write(connection)
+            self._write(connection)
+        except Exception as e:
+            self.failed = True
+            self._queue.clear()
+            log.error("Writing samples to %s failed. No further samples are stored: %r", self.path, e)
+        finally:
+            if connection is not None:
+                connection.close()
+            log.debug("Stopped sample store %s", self.path)
+
+    def _load_partitions(self, connection: sqlite3.Connection):
+        tables = [row[0] for row in connection.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE ?", (_TABLE_PREFIX + "%",))]
+        for table in tables:
+            self._columns[table] = [row[1] for row in connection.execute("PRAGMA table_info(%s)" % table)]
+        self._drop_expired(connection)
+
+    def _write(self, connection: sqlite3.Connection):
+        records = []
+        while self._queue:
+            records.append(self._queue.popleft())
+        if not records:
+            return
+
+        partitions: Dict[str, List[dict]] = dict()
+        for record in records:
+            partitions.setdefault(_partition(record['dateTime']), []).append(record)
+
+        start = time.perf_counter()
+        connection.execute("BEGIN")
+        try:
+            for table, table_records in partitions.items():
+                columns = self._prepare_table(connection, table, table_records)
+                connection.executemany("INSERT INTO %s (%s) VALUES (%s)" % (
+                    table, ", ".join(columns), ", ".join("?" * len(columns))),
+                                       [tuple(record.get(column) for column in columns) for record in table_records])
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        log.debug("Stored %d samples in %.3f seconds", len(records), time.perf_counter() - start)
+
+        self._drop_expired(connection)
+
+    def _prepare_table(self, connection: sqlite3.Connection, table: str, records: List[dict]) -> List[str]:
+        """Create the table or add columns for observations not stored yet"""
+
+        observations = []
+        for record in records:
+            for key in record:
+                if key not in _EXCLUDED_KEYS and key not in observations:
+                    observations.append(key)
+
+        columns = self._columns.get(table)
+        if columns is None:
+            connection.execute("CREATE TABLE %s (dateTime REAL NOT NULL, usUnits INTEGER NOT NULL)" % table)
+            connection.execute("CREATE INDEX %s_dateTime ON %s (dateTime)" % (table, table))
+            columns = self._columns[table] = ['dateTime', 'usUnits']
+
+        for observation in observations:
+            if observation not in columns:
+                connection.execute("ALTER TABLE %s ADD COLUMN %s REAL" % (table, observation))
+                columns.append(observation)
+        return columns
+
+    def _drop_expired(self, connection: sqlite3.Connection):
+        oldest_kept = _partition(time.time() - timedelta(days=self.retention_days).total_seconds())
+        expired = [table for table in self._columns if table < oldest_kept]
+        for table in expired:
+            log.info("Dropping expired samples table %s", table)
+            connection.execute("DROP TABLE %s" % table)
+            del self._columns[table]
+
+    def close(self):
+        if self.stop_signal.is_set():
+            return
+
+        self.stop_signal.set()
+        self.thread.join(self.join_timeout)
+        if self.thread.is_alive():
+            log.warning("Sample store still writing. Remaining samples may be lost")
@@ -26,6 +26,9 @@ from datetime import datetime
 from math import floor
 from typing import Optional, Callable
 
+from user.weatherlink_live.metrics import WakeupCounter
+from user.weatherlink_live.profiler import SamplingProfiler
+
 POLL_INTERVAL_MIN = 10.0
 POLL_INTERVAL_MAX = 300.0
 PUSH_REFRESH_INTERVAL = 1200.0  # Refresh broadcast every 20 minutes
@@ -44,7 +47,8 @@ class Scheduler(object):
     """Centrally schedule HTTP requests to avoid overloading server"""
 
     def __init__(self, polling_interval: float, poll_callback: Callable[[], None],
-                 push_refresh_callback: Callable[[float], None], data_event: threading.Event):
+                 push_refresh_callback: Callable[[float], None], data_event: threading.Event,
+                 profiler: Optional[SamplingProfiler] = None):
 
         self.polling_interval = polling_interval
         if polling_interval < POLL_INTERVAL_MIN:
@@ -59,23 +63,28 @@ class Scheduler(object):
         self.data_event = data_event
 
         self.error = None
+        self.wakeups = WakeupCounter("scheduler")
+        if profiler is not None:
+            self._do_tick = profiler.profiled(self._do_tick)
 
         self._push_refresh_tick_count = floor(PUSH_REFRESH_INTERVAL / self.polling_interval)
         self._push_refresh_ticks = self._push_refresh_tick_count
-        log.debug("Push refresh will happen every %d scheduler ticks" % self._push_refresh_tick_count)
-
-        self._tick_task_id = None
+        log.debug("Push refresh will happen every %d scheduler ticks", self._push_refresh_tick_count)
 
-        self._scheduler = sched.scheduler(timefunc=time.time, delayfunc=time.sleep)
+        # Waiting on an event instead of sleeping lets cancel() wake up the scheduler thread immediately
+        self._wake_event = threading.Event()
+        self._scheduler = sched.scheduler(timefunc=time.time, delayfunc=self._wake_event.wait)
 
         self._run = True
+        # The first tick runs on the scheduler thread as well, so creating (or restarting) the scheduler doesn't block
+        # the caller for the duration of the HTTP requests
+        self._scheduler.enter(0, 0, self._scheduler_tick)
+
         self._scheduler_thread = threading.Thread(target=self._run_scheduler)
         self._scheduler_thread.name = "WLL-HTTP-Scheduler"
         self._scheduler_thread.daemon = True
         self._scheduler_thread.start()
 
-        self._scheduler_tick()
-
     @property
     def has_error(self) -> bool:
         return self.error is not None
@@ -90,11 +99,19 @@ class Scheduler(object):
         self.data_event.set()
 
     def _run_scheduler(self):
+        # Nothing is scheduled anymore after an error, so the thread ends. Cancelling wakes up the thread, which then
+        # ends without running further ticks.
         while self._run:
-            self._scheduler.run(blocking=True)
+            delay = self._scheduler.run(blocking=False)
+            if delay is None:
+                break
+            self._wake_event.wait(delay)
 
     def _scheduler_tick(self):
+        if not self._run:
+            return
         log.debug("Scheduler tick")
+        self.wakeups.increment()
 
         try:
             self._do_tick()
@@ -103,33 +120,51 @@ class Scheduler(object):
             self._notify_error(e)
             return
 
+        if not self._run:
+            log.debug("Scheduler cancelled. Not rescheduling")
+            return
+
         next_tick_abs_time = time.time() + self.polling_interval
-        log.debug("Next scheduler tick at %s" % _format_iso(next_tick_abs_time))
-        self._tick_task_id = self._scheduler.enterabs(next_tick_abs_time, 0, self._scheduler_tick)
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("Next scheduler tick at %s", _format_iso(next_tick_abs_time))
+        self._scheduler.enterabs(next_tick_abs_time, 0, self._scheduler_tick)
 
     def _do_tick(self):
         log.debug("Notifying poll callback")
         self._poll_callback()
 
+        if not self._run:
+            log.debug("Scheduler cancelled. Not refreshing broadcast")
+            return
+
         if self._push_refresh_ticks >= self._push_refresh_tick_count:
             log.debug("Notifying push refresh callback")
             self._push_refresh_callback(PUSH_DURATION)
             self._push_refresh_ticks = 0
 
         self._push_refresh_ticks += 1
-        log.debug(
-            "%d scheduler ticks until next push refresh" % (self._push_refresh_tick_count - self._push_refresh_ticks))
+        log.debug("%d scheduler ticks until next push refresh",
+                  self._push_refresh_tick_count - self._push_refresh_ticks)
 
     def cancel(self):
+        """
+        Cancel all ticks and wait for a tick in progress to end
+
+        No callback is called once this returns. HTTP requests of the callbacks are not interrupted by the scheduler;
+        cancel them first (see `DataHost.cancel`), otherwise this waits for them.
+        """
+
         log.debug("Cancelling scheduler")
         self._run = False
 
-        if self._tick_task_id is not None:
+        for task in self._scheduler.queue:
             log.debug("Cancelling tick task")
-            self._scheduler.cancel(self._tick_task_id)
-
-        if not self._scheduler.empty():
-            raise ValueError("Scheduler did not cancel all task")
-
-        self._scheduler_thread.join(30)
+            try:
+                self._scheduler.cancel(task)
+            except ValueError:
+                pass  # task started in the meantime
+
+        self._wake_event.set()
+        if threading.current_thread() is not self._scheduler_thread:
+            self._scheduler_thread.join()
         log.info("All tasks cancelled")
@@ -19,51 +19,97 @@
 # SOFTWARE.
 
 import logging
-from typing import List, Dict
+import time
+from typing import List, Dict, Optional, Tuple
 
 import weewx
 from user.weatherlink_live.mappers import AbstractMapping, WindMapping
+from user.weatherlink_live.packet_logging import get_packet_logger
+from user.weatherlink_live.state import StateStore
+from user.weatherlink_live.wind import RollingMaximum, RollingVectorMean, VectorMean
+from weeutil.weeutil import startOfInterval, to_int
 from weewx.engine import StdService
 
 log = logging.getLogger(__name__)
+packet_log = get_packet_logger(__name__)
+
+_STATE_KEY = 'service:wind_gust'
 
 
 class WllWindGustService(StdService):
-    """Service for calculating ARCHIVE records from LOOP wind measurements"""
+    """Service for calculating wind gusts and averages from LOOP wind measurements"""
 
-    def __init__(self, engine, config_dict, mappers: List[AbstractMapping], log_success: bool = False,
-                 log_failure: bool = True):
+    def __init__(self, engine, config_dict, mappers: List[AbstractMapping], windows: List[int] = (),
+                 log_success: bool = False, log_failure: bool = True, state_store: Optional[StateStore] = None):
         super().__init__(engine, config_dict)
 
         self.mappers = mappers
+        self.windows = windows
         self.log_success = log_success
         self.log_failure = log_failure
+        self.state_store = state_store
 
         self.map_targets = self._extract_map_sources()
-        self._log_success("Found %d wind mappings" % len(self.map_targets))
+        self._log_success("Found %d wind mappings", len(self.map_targets))
         if len(self.map_targets) < 1:
             self._log_failure("No wind mappings available. Aborting service.")
             return
 
+        self.archive_interval = to_int(config_dict.get('StdArchive', {}).get('archive_interval', 300))
+
+        self.rolling_gusts = self._create_rolling_gusts()
+        self.rolling_means = self._create_rolling_means()
+
+        self.period_end_ts = None
+        self.period_means = self._create_period_means()
+        self.last_period_end_ts = None
+        self.last_period_means = dict()
+
         self._clear()
 
         self.bind(weewx.STARTUP, self.startup)
         self.bind(weewx.NEW_LOOP_PACKET, self.new_loop_packet)
         self.bind(weewx.END_ARCHIVE_PERIOD, self.end_archive_period)
+        self.bind(weewx.NEW_ARCHIVE_RECORD, self.new_archive_record)
 
-    def _log_success(self, message: str, level: int = logging.DEBUG):
+    def _log_success(self, message: str, *args, level: int = logging.DEBUG):
         if not self.log_success:
             return
-        log.log(level, "%s: %s" % (type(self).__name__, message))
+        log.log(level, "%s: " + message, type(self).__name__, *args)
 
-    def _log_failure(self, message: str, level: int = logging.ERROR):
+    def _log_failure(self, message: str, *args, level: int = logging.ERROR):
         if not self.log_failure:
             return
-        log.log(level, "%s: %s" % (type(self).__name__, message))
+        log.log(level, "%s: " + message, type(self).__name__, *args)
+
+    def _log_packet(self, message: str, *args):
+        if not self.log_success:
+            return
+        packet_log.debug("%s: " + message, type(self).__name__, *args)
 
     def _extract_map_sources(self) -> List[Dict[str, str]]:
         return [mapper.targets for mapper in self.mappers if isinstance(mapper, WindMapping)]
 
+    def _create_rolling_gusts(self) -> Dict[str, Dict[int, RollingMaximum]]:
+        return dict([
+            (wind_mapping['gust_speed'], dict([(window, RollingMaximum(window)) for window in self.windows]))
+            for wind_mapping in self.map_targets
+        ])
+
+    def _create_rolling_means(self) -> Dict[str, Dict[int, RollingVectorMean]]:
+        return dict([
+            (wind_mapping['wind_speed'], dict([(window, RollingVectorMean(window)) for window in self.windows]))
+            for wind_mapping in self.map_targets
+        ])
+
+    def _create_period_means(self) -> Dict[str, VectorMean]:
+        return dict([(wind_mapping['wind_speed'], VectorMean()) for wind_mapping in self.map_targets])
+
+    @staticmethod
+    def window_target(target: str, window: int) -> str:
+        """Name of the observation holding the value of a rolling window"""
+        return "%s_%ds" % (target, window)
+
     def _clear(self):
         self._log_success("Clearing max gust values")
         self.max_loop_gust = dict()
@@ -71,6 +117,33 @@ class WllWindGustService(StdService):
     def startup(self, _):
         self._log_success("Service startup")
         self._clear()
+        self._restore_state()
+
+    def _restore_state(self):
+        if self.state_store is None:
+            return
+
+        state = self.state_store.get(_STATE_KEY)
+        if state is None:
+            return
+
+        # Gusts are only valid for the archive period they were measured in
+        current_period_end_ts = startOfInterval(time.time(), self.archive_interval) + self.archive_interval
+        if state.get('period_end_ts') != current_period_end_ts:
+            self._log_success("Discarding persisted gusts of another archive period")
+            return
+
+        self.max_loop_gust = dict(state.get('max_loop_gust', {}))
+        self._log_success("Restored max gust values: %r", self.max_loop_gust, level=logging.INFO)
+
+    def _save_state(self, timestamp: float):
+        if self.state_store is None:
+            return
+
+        self.state_store.set(_STATE_KEY, {
+            'period_end_ts': startOfInterval(timestamp, self.archive_interval) + self.archive_interval,
+            'max_loop_gust': dict(self.max_loop_gust),
+        })
 
     def new_loop_packet(self, event):
         record = event.packet
@@ -82,7 +155,7 @@ class WllWindGustService(StdService):
             k_gust_speed = wind_mapping['gust_speed']
 
             if k_wind_dir not in record or k_wind_speed not in record:
-                self._log_success("Wind observations %s:%s not in record" % (k_wind_speed, k_wind_dir))  # not an error
+                self._log_packet("Wind observations %s:%s not in record", k_wind_speed, k_wind_dir)  # not an error
                 continue
 
             current_speed = record[k_wind_speed]
@@ -92,18 +165,107 @@ class WllWindGustService(StdService):
             max_gust_dir = self.max_loop_gust.get(k_gust_dir, None)
 
             if current_speed is None:
-                self._log_failure("Current wind speed is set but N/A. Skipping calculation", logging.INFO)
+                self._log_failure("Current wind speed is set but N/A. Skipping calculation", level=logging.INFO)
                 continue
 
-            if max_gust_dir is None or current_speed >= max_gust_speed:
-                self._log_success("New wind vector %.02f:%s larger than %.02f:%s" % (
-                    current_speed, current_dir, max_gust_speed, max_gust_dir))
-                self.max_loop_gust[k_gust_speed] = current_speed
-                self.max_loop_gust[k_gust_dir] = current_dir
+            # Downsampled records already contain the gust of the aggregated records
+            gust_speed = record.get(k_gust_speed)
+            if gust_speed is not None:
+                gust_dir = record.get(k_gust_dir)
+            else:
+                gust_speed = current_speed
+                gust_dir = current_dir
 
-            self._log_success("Updating record with dict: %s" % repr(self.max_loop_gust))
+            if max_gust_dir is None or gust_speed >= max_gust_speed:
+                self._log_packet("New wind vector %.02f:%s larger than %.02f:%s",
+                                 gust_speed, gust_dir, max_gust_speed, max_gust_dir)
+                self.max_loop_gust[k_gust_speed] = gust_speed
+                self.max_loop_gust[k_gust_dir] = gust_dir
+
+            self._update_rolling_gusts(record, wind_mapping, gust_speed, gust_dir)
+
+            self._log_packet("Updating record with dict: %r", self.max_loop_gust)
             record.update(self.max_loop_gust)
 
+            self._update_means(record, wind_mapping, current_speed, current_dir)
+
+        self._save_state(record['dateTime'])
+
+    def _update_rolling_gusts(self, record: dict, wind_mapping: Dict[str, str], current_speed: float, current_dir):
+        k_gust_dir = wind_mapping['gust_dir']
+        k_gust_speed = wind_mapping['gust_speed']
+        timestamp = record['dateTime']
+
+        for window, rolling_gust in self.rolling_gusts[k_gust_speed].items():
+            rolling_gust.add(timestamp, current_speed, current_dir)
+            gust_speed, gust_dir = rolling_gust.maximum
+
+            record[self.window_target(k_gust_speed, window)] = gust_speed
+            record[self.window_target(k_gust_dir, window)] = gust_dir
+
+    def _update_means(self, record: dict, wind_mapping: Dict[str, str], current_speed: float, current_dir):
+        k_wind_dir = wind_mapping['wind_dir']
+        k_wind_speed = wind_mapping['wind_speed']
+        timestamp = record['dateTime']
+
+        self._check_period(timestamp)
+        self.period_means[k_wind_speed].add(current_speed, current_dir)
+
+        for window, rolling_mean in self.rolling_means[k_wind_speed].items():
+            rolling_mean.add(timestamp, current_speed, current_dir)
+
+            record[self.window_target(k_wind_speed, window)] = rolling_mean.speed
+            record[self.window_target(k_wind_dir, window)] = rolling_mean.direction
+
+    def _check_period(self, timestamp: float):
+        period_end_ts = startOfInterval(timestamp, self.archive_interval) + self.archive_interval
+        if period_end_ts == self.period_end_ts:
+            return
+
+        if self.period_end_ts is not None:
+            self._log_success("Archive period ending at %d completed", self.period_end_ts)
+            self.last_period_end_ts = self.period_end_ts
+            self.last_period_means = dict([
+                (k_wind_speed, (period_mean.speed, period_mean.direction))
+                for k_wind_speed, period_mean in self.period_means.items()
+            ])
+
+        self.period_end_ts = period_end_ts
+        for period_mean in self.period_means.values():
+            period_mean.clear()
+
+    def _period_means_ending_at(self, timestamp: float) -> Optional[Dict[str, Tuple[float, float]]]:
+        if timestamp == self.last_period_end_ts:
+            return self.last_period_means
+        if timestamp == self.period_end_ts:
+            return dict([
+                (k_wind_speed, (period_mean.speed, period_mean.direction))
+                for k_wind_speed, period_mean in self.period_means.items()
+            ])
+        return None
+
+    def new_archive_record(self, event):
+        if getattr(event, 'origin', None) != 'software':
+            return
+
+        record = event.record
+        period_means = self._period_means_ending_at(record['dateTime'])
+        if period_means is None:
+            self._log_failure("No wind averages for archive record at %d", record['dateTime'], level=logging.INFO)
+            return
+
+        for wind_mapping in self.map_targets:
+            k_wind_dir = wind_mapping['wind_dir']
+            k_wind_speed = wind_mapping['wind_speed']
+
+            mean_speed, mean_dir = period_means[k_wind_speed]
+            if mean_speed is None:
+                continue
+
+            self._log_success("Averaged wind vector %.02f:%s for archive record", mean_speed, mean_dir)
+            record[k_wind_speed] = mean_speed
+            record[k_wind_dir] = mean_dir
+
     def end_archive_period(self, _):
         self._log_success("End of archive period")
         self._clear()
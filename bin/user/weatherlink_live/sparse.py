@@ -0,0 +1,78 @@
+# Copyright © 2020-2024 Michael Schantl and contributors
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""
+Reduction of loop records to changed values
+"""
+import time
+from typing import List, Set
+
+from user.weatherlink_live.mappers import AbstractMapping, WindMapping
+from user.weatherlink_live.static import Aggregation
+
+# Fields every loop record needs
+_REQUIRED_FIELDS = ('dateTime', 'usUnits')
+
+_MISSING = object()
+
+
+class ChangeFilter(object):
+    """Reduce loop records to the fields whose values changed since the last emitted record"""
+
+    def __init__(self, mappers: List[AbstractMapping], refresh_interval: float):
+        self.refresh_interval = refresh_interval
+
+        self.always_fields: Set[str] = set(_REQUIRED_FIELDS)
+        self.sum_fields: Set[str] = set()
+        for mapper in mappers:
+            if isinstance(mapper, WindMapping):
+                # Wind gusts and averages are calculated from every single sample
+                self.always_fields.update(mapper.targets.values())
+            for target, aggregation in mapper.aggregations.items():
+                if aggregation == Aggregation.SUM:
+                    self.sum_fields.add(target)
+
+        self._last_values = dict()
+        self._next_refresh = None
+
+    def filter(self, record: dict) -> dict:
+        """
+        Return the fields of the record which changed since the last record
+
+        Every `refresh_interval` seconds, the complete record is returned. Values which are summed up (like rain) are
+        increments, so they are returned whenever they are not zero.
+        """
+
+        now = time.monotonic()
+        last_values = self._last_values
+
+        if self._next_refresh is None or now >= self._next_refresh:
+            self._next_refresh = now + self.refresh_interval
+            last_values.clear()
+            last_values.update(record)
+            return record
+
+        always_fields = self.always_fields
+        sum_fields = self.sum_fields
+        sparse = dict()
+        for key, value in record.items():
+            if key in always_fields or (value and key in sum_fields) or last_values.get(key, _MISSING) != value:
+                sparse[key] = value
+        last_values.update(record)
+        return sparse
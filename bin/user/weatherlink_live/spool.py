@@ -0,0 +1,207 @@
+# Copyright © 2020-2024 Michael Schantl and contributors
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Crash-safe spool of recent loop records
+"""
+import logging
+import math
+import mmap
+import os
+import struct
+import zlib
+from typing import Dict, List, Optional
+
+log = logging.getLogger(__name__)
+
+_MAGIC = b'WLLSPOOL'
+_VERSION = 2
+
+# Header: magic, version, slot size, slot count, count of field names; followed by NUL-separated field names
+_HEADER = struct.Struct('<8sHIIH')
+_HEADER_SIZE = 4096
+
+# Slot: CRC32 of the rest of the slot, sequence number, timestamp, unit system, count of fields; followed by the fields
+_SLOT_CRC = struct.Struct('<I')
+_SLOT_HEADER = struct.Struct('<QdHH')
+_FIELD = struct.Struct('<Hd')
+SLOT_SIZE = 1024
+_MAX_FIELDS = (SLOT_SIZE - _SLOT_CRC.size - _SLOT_HEADER.size) // _FIELD.size
+
+
+class LoopSpool(object):
+    """
+    Memory-mapped ring buffer of loop records
+
+    Every record is written into a fixed-size slot of a memory-mapped file, so appending a record is a single write
+    into the page cache. The operating system writes the pages back to disk, which survives crashes and restarts of
+    WeeWX (but not a power loss). Each slot carries a sequence number and a checksum; partially written slots are
+    detected and ignored when reading.
+    """
+
+    def __init__(self, path: str, slot_count: int):
+        if slot_count < 1:
+            raise ValueError("Spool has to hold at least 1 record (got: %d)" % slot_count)
+
+        self.path = path
+        self.slot_count = slot_count
+
+        self._file = None
+        self._mmap = None
+        self._field_names = []
+        self._field_indices = dict()
+        self._next_seq = 1
+
+    @property
+    def size(self) -> int:
+        return _HEADER_SIZE + self.slot_count * SLOT_SIZE
+
+    def open(self) -> None:
+        if self._mmap is not None:
+            return
+
+        exists = os.path.exists(self.path) and os.path.getsize(self.path) == self.size
+        self._file = open(self.path, 'r+b' if exists else 'w+b')
+        if not exists:
+            self._file.truncate(self.size)
+        self._mmap = mmap.mmap(self._file.fileno(), self.size)
+
+        if exists and self._read_header():
+            self._next_seq = max([seq for seq, _, _, _ in self._iter_slots()], default=0) + 1
+            log.debug("Opened loop spool %s. Next sequence number: %d", self.path, self._next_seq)
+        else:
+            log.info("Creating new loop spool %s with %d slots", self.path, self.slot_count)
+            self._mmap[:] = bytes(self.size)
+            self._field_names = []
+            self._field_indices = dict()
+            self._next_seq = 1
+            self._write_header()
+
+    def close(self) -> None:
+        if self._mmap is not None:
+            self._mmap.flush()
+            self._mmap.close()
+            self._mmap = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _read_header(self) -> bool:
+        magic, version, slot_size, slot_count, field_count = _HEADER.unpack_from(self._mmap, 0)
+        if magic != _MAGIC or version != _VERSION or slot_size != SLOT_SIZE or slot_count != self.slot_count:
+            log.warning("Loop spool %s has an incompatible format. Discarding it", self.path)
+            return False
+
+        names_data = self._mmap[_HEADER.size:_HEADER_SIZE].split(b'\0')
+        self._field_names = [name.decode('utf-8') for name in names_data[:field_count]]
+        self._field_indices = dict([(name, i) for i, name in enumerate(self._field_names)])
+        return True
+
+    def _write_header(self) -> None:
+        names_data = b'\0'.join([name.encode('utf-8') for name in self._field_names])
+        if _HEADER.size + len(names_data) > _HEADER_SIZE:
+            raise ValueError("Too many field names for loop spool header")
+
+        self._mmap[_HEADER.size:_HEADER.size + len(names_data)] = names_data
+        _HEADER.pack_into(self._mmap, 0, _MAGIC, _VERSION, SLOT_SIZE, self.slot_count, len(self._field_names))
+
+    def _field_index(self, name: str) -> Optional[int]:
+        index = self._field_indices.get(name)
+        if index is not None:
+            return index
+
+        self._field_names.append(name)
+        try:
+            self._write_header()
+        except ValueError:
+            self._field_names.pop()
+            log.error("Field %s does not fit into loop spool header. Not spooling it", name)
+            return None
+
+        index = len(self._field_names) - 1
+        self._field_indices[name] = index
+        return index
+
+    def append(self, record: dict) -> None:
+        """Write a loop record into the next slot"""
+
+        self.open()
+
+        fields = []
+        for name, value in record.items():
+            if name == 'dateTime' or name == 'usUnits':
+                continue
+
+            index = self._field_index(name)
+            if index is None:
+                continue
+            fields.append((index, math.nan if value is None else value))
+
+        if len(fields) > _MAX_FIELDS:
+            log.error("Loop record has %d fields, but only %d fit into a spool slot. Truncating",
+                      len(fields), _MAX_FIELDS)
+            fields = fields[:_MAX_FIELDS]
+
+        seq = self._next_seq
+        self._next_seq += 1
+
+        data = bytearray(_SLOT_HEADER.pack(seq, record['dateTime'], record['usUnits'], len(fields)))
+        for field in fields:
+            data += _FIELD.pack(*field)
+
+        offset = _HEADER_SIZE + (seq % self.slot_count) * SLOT_SIZE
+        self._mmap[offset + _SLOT_CRC.size:offset + _SLOT_CRC.size + len(data)] = data
+        _SLOT_CRC.pack_into(self._mmap, offset, zlib.crc32(data))
+
+    def _iter_slots(self):
+        for slot in range(self.slot_count):
+            offset = _HEADER_SIZE + slot * SLOT_SIZE
+            crc, = _SLOT_CRC.unpack_from(self._mmap, offset)
+            seq, timestamp, unit_system, field_count = _SLOT_HEADER.unpack_from(self._mmap, offset + _SLOT_CRC.size)
+            if seq == 0 or field_count > _MAX_FIELDS:
+                continue
+
+            data_start = offset + _SLOT_CRC.size
+            data_end = data_start + _SLOT_HEADER.size + field_count * _FIELD.size
+            if zlib.crc32(self._mmap[data_start:data_end]) != crc:
+                log.debug("Ignoring corrupt loop spool slot %d", slot)
+                continue
+
+            yield seq, timestamp, unit_system, (data_start + _SLOT_HEADER.size, field_count)
+
+    def records_since(self, since_ts: Optional[float]) -> List[dict]:
+        """Return all spooled loop records newer than the given timestamp, oldest first"""
+
+        self.open()
+
+        slots = sorted(self._iter_slots(), key=lambda slot: slot[0])
+        records = []
+        for _, timestamp, unit_system, (fields_offset, field_count) in slots:
+            if since_ts is not None and timestamp <= since_ts:
+                continue
+
+            record: Dict[str, Optional[float]] = {'dateTime': int(timestamp), 'usUnits': unit_system}
+            for i in range(field_count):
+                index, value = _FIELD.unpack_from(self._mmap, fields_offset + i * _FIELD.size)
+                if index < len(self._field_names):
+                    record[self._field_names[index]] = None if math.isnan(value) else value
+            records.append(record)
+
+        return records
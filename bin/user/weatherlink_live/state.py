@@ -0,0 +1,103 @@
+# Copyright © 2020-2024 Michael Schantl and contributors
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Persistent state of mappers and services
+"""
+import json
+import logging
+import os
+import time
+from typing import Any, Dict, Optional
+
+log = logging.getLogger(__name__)
+
+State = Dict[str, Any]
+
+
+class StateStore(object):
+    """
+    Small JSON file holding state which should survive restarts
+
+    Changes are kept in memory and written at most once per flush interval. State which must not be lost, because a
+    stale value would count something twice after a crash, is set with `immediate` and written on the next flush. The
+    file is replaced atomically, so it is never left half-written.
+    """
+
+    def __init__(self, path: str, flush_interval: float):
+        self.path = path
+        self.flush_interval = flush_interval
+
+        self._state: Dict[str, State] = self._load()
+        self._dirty = False
+        self._immediate = False
+        self._last_flush = time.monotonic()
+
+    def _load(self) -> Dict[str, State]:
+        if not os.path.exists(self.path):
+            return dict()
+
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+        except (OSError, ValueError) as e:
+            log.warning("Could not load state file %s. Starting with empty state: %r", self.path, e)
+            return dict()
+
+        if not isinstance(state, dict):
+            log.warning("State file %s is malformed. Starting with empty state", self.path)
+            return dict()
+        return state
+
+    def get(self, key: str) -> Optional[State]:
+        return self._state.get(key)
+
+    def set(self, key: str, state: Optional[State], immediate: bool = False) -> None:
+        if state is None or self._state.get(key) == state:
+            return
+
+        self._state[key] = state
+        self._dirty = True
+        self._immediate = self._immediate or immediate
+
+    def flush(self, force: bool = False) -> None:
+        """Write state to disk, if it changed and the flush interval passed (or if forced or immediate)"""
+
+        if not self._dirty:
+            return
+        if not force and not self._immediate and time.monotonic() - self._last_flush < self.flush_interval:
+            return
+
+        tmp_path = self.path + '.tmp'
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self._state, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            log.error("Could not write state file %s: %r", self.path, e)
+            return
+        finally:
+            self._last_flush = time.monotonic()
+
+        self._dirty = False
+        self._immediate = False
+        log.debug("Wrote state file %s", self.path)
@@ -24,3 +24,11 @@ from enum import Enum
 class PacketSource(Enum):
     WEATHER_POLL = 10
     WEATHER_PUSH = 20
+
+
+class Aggregation(Enum):
+    """How values of an observation are combined over a period of time"""
+    AVG = 'avg'
+    SUM = 'sum'
+    LAST = 'last'
+    MAX = 'max'
@@ -25,6 +25,36 @@ KEY_DRIVER_POLLING_INTERVAL = 'polling_interval'
 KEY_DRIVER_HOST = "host"
 KEY_DRIVER_MAPPING = 'mapping'
 KEY_MAX_NO_DATA_ITERATIONS = "max_no_data_iterations"
+KEY_WIND_WINDOWS = "wind_windows"
+KEY_ARCHIVE_RECORDS = "archive_records"
+KEY_SPOOL_FILE = "spool_file"
+KEY_SPOOL_SIZE = "spool_size"
+KEY_STATE_FILE = "state_file"
+KEY_STATE_FLUSH_INTERVAL = "state_flush_interval"
+KEY_MAX_COMPONENT_RESTARTS = "max_component_restarts"
+KEY_BROADCAST_ERROR_BUDGET = "broadcast_error_budget"
+KEY_BROADCAST_ERROR_WINDOW = "broadcast_error_window"
+KEY_METRICS = "metrics"
+KEY_METRICS_LOG_INTERVAL = "metrics_log_interval"
+KEY_METRICS_PORT = "metrics_port"
+KEY_PROFILE = "profile"
+KEY_PROFILE_DIRECTORY = "profile_directory"
+KEY_PROFILE_INTERVAL = "profile_interval"
+KEY_PROFILE_DUTY_CYCLE = "profile_duty_cycle"
+KEY_PROFILE_KEEP = "profile_keep"
+KEY_CAPTURE_FILE = "capture_file"
+KEY_CAPTURE_COMPRESS = "capture_compress"
+KEY_PACKET_LOG_SAMPLING = "packet_log_sampling"
+KEY_PACKET_LOG_RATE_LIMIT = "packet_log_rate_limit"
+KEY_SPARSE_LOOP_PACKETS = "sparse_loop_packets"
+KEY_SPARSE_REFRESH_INTERVAL = "sparse_refresh_interval"
+KEY_DOWNSAMPLE_INTERVAL = "downsample_interval"
+KEY_UNIT_SYSTEM = "unit_system"
+KEY_SAMPLE_FILE = "sample_file"
+KEY_SAMPLE_FLUSH_INTERVAL = "sample_flush_interval"
+KEY_SAMPLE_RETENTION = "sample_retention"
+KEY_CACHE_RESOLUTIONS = "cache_resolutions"
+KEY_CACHE_DURATION = "cache_duration"
 
 KEY_MAPPER_TEMPERATURE_ONLY = 't'
 KEY_MAPPER_TEMPERATURE_HUMIDITY = 'th'
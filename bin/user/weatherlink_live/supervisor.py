@@ -0,0 +1,135 @@
+# Copyright © 2020-2024 Michael Schantl and contributors
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Supervision and restart of driver components
+"""
+import logging
+import time
+from typing import Callable, Dict, Optional
+
+from weewx import WeeWxIOError
+
+log = logging.getLogger(__name__)
+
+RESTART_BACKOFF_MIN = 0.5
+RESTART_BACKOFF_MAX = 60.0
+
+
+class SupervisedComponent(object):
+    """A driver component which is restarted on errors"""
+
+    def __init__(self, name: str, get_error: Callable[[], Optional[BaseException]], restart: Callable[[], None]):
+        self.name = name
+        self.get_error = get_error
+        self.restart = restart
+
+        self.failures = 0
+        self.restart_at = None
+
+    @property
+    def backoff(self) -> float:
+        return min(RESTART_BACKOFF_MIN * (2 ** (self.failures - 1)), RESTART_BACKOFF_MAX)
+
+
+class Supervisor(object):
+    """
+    Restart failed components instead of tearing down the whole driver
+
+    Failed components are restarted with exponential backoff. Mappers, queues and all other components are kept. Only
+    if a component fails more than the configured number of times without delivering data in between, the error is
+    escalated to WeeWX.
+    """
+
+    def __init__(self, max_restarts: int, log_success: bool = False, log_error: bool = True):
+        self.max_restarts = max_restarts
+        self.log_success = log_success
+        self.log_error = log_error
+
+        self.components: Dict[str, SupervisedComponent] = dict()
+
+    def add(self, name: str, get_error: Callable[[], Optional[BaseException]], restart: Callable[[], None]) -> None:
+        self.components[name] = SupervisedComponent(name, get_error, restart)
+
+    def healthy(self, name: str) -> None:
+        """Signal that a component delivered data"""
+        component = self.components[name]
+        if component.failures > 0 and component.restart_at is None:
+            self._log_success("Component %s recovered", name, level=logging.INFO)
+            component.failures = 0
+
+    def check(self) -> Optional[float]:
+        """
+        Check all components and restart failed ones whose backoff expired
+
+        :return: seconds until the next pending restart; `None` if no restart is pending
+        :raise WeeWxIOError: if a component failed too often
+        """
+
+        now = time.monotonic()
+        next_restart = None
+
+        for component in self.components.values():
+            if component.restart_at is None:
+                error = component.get_error()
+                if error is None:
+                    continue
+                self._schedule_restart(component, error, now)
+
+            if component.restart_at <= now:
+                self._restart(component, now)
+
+            if component.restart_at is not None:
+                delay = component.restart_at - now
+                next_restart = delay if next_restart is None else min(next_restart, delay)
+
+        return next_restart
+
+    def _schedule_restart(self, component: SupervisedComponent, error: BaseException, now: float) -> None:
+        component.failures += 1
+        if component.failures > self.max_restarts:
+            raise WeeWxIOError("Component %s failed %d times in a row: %s" % (
+                component.name, component.failures, repr(error))) from error
+
+        component.restart_at = now + component.backoff
+        self._log_error("Component %s failed: %r. Restarting in %.1f seconds (attempt %d of %d)",
+                        component.name, error, component.backoff, component.failures, self.max_restarts,
+                        level=logging.WARNING)
+
+    def _restart(self, component: SupervisedComponent, now: float) -> None:
+        self._log_success("Restarting component %s", component.name, level=logging.INFO)
+        try:
+            component.restart()
+        except Exception as e:
+            component.restart_at = None
+            self._schedule_restart(component, e, now)
+            return
+
+        component.restart_at = None
+
+    def _log_success(self, msg: str, *args, level: int = logging.DEBUG) -> None:
+        if not self.log_success:
+            return
+        log.log(level, msg, *args)
+
+    def _log_error(self, msg: str, *args, level: int = logging.DEBUG) -> None:
+        if not self.log_error:
+            return
+        log.log(level, msg, *args)
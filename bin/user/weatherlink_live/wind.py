@@ -0,0 +1,209 @@
+# Copyright © 2020-2024 Michael Schantl and contributors
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Incremental wind statistics
+"""
+import math
+from collections import deque
+from typing import Any, Optional, Tuple
+
+# Resultant vectors shorter than this fraction of the summed speeds are treated as calm
+_CALM_RATIO = 1e-9
+
+
+def _vector_components(speed: float, direction: Optional[float]) -> Tuple[float, float]:
+    if direction is None:
+        return 0.0, 0.0
+
+    direction_rad = math.radians(direction)
+    return speed * math.sin(direction_rad), speed * math.cos(direction_rad)
+
+
+def _clamp_timestamp(timestamp: float, newest: Optional[float], window: float) -> Optional[float]:
+    """Timestamp to store a sample with, or `None` if the sample is already outside the window"""
+
+    if newest is None or timestamp >= newest:
+        return timestamp
+    if timestamp <= newest - window:
+        return None
+    return newest
+
+
+class RollingMaximum(object):
+    """
+    Maximum of all samples within a sliding time window
+
+    Samples are kept in a monotonic deque (values strictly decreasing from oldest to newest), so adding a sample and
+    querying the maximum is O(1) amortized.
+
+    Poll and broadcast records can arrive out of order. A sample older than the newest one is treated as if it was
+    taken at the time of the newest sample, which keeps the deque ordered by time. Samples already outside the window
+    are dropped.
+    """
+
+    def __init__(self, window: float):
+        if window <= 0:
+            raise ValueError("Window has to be positive (got: %s)" % repr(window))
+
+        self.window = window
+        self._samples = deque()
+        self._newest = None
+
+    def add(self, timestamp: float, value: float, payload: Any = None) -> None:
+        """Add a sample and expire all samples that fell out of the window"""
+
+        timestamp = _clamp_timestamp(timestamp, self._newest, self.window)
+        if timestamp is None:
+            return
+        self._newest = timestamp
+
+        samples = self._samples
+
+        oldest = timestamp - self.window
+        while samples and samples[0][0] <= oldest:
+            samples.popleft()
+
+        # Newer samples with the same value win, so the payload is the most recent one
+        while samples and samples[-1][1] <= value:
+            samples.pop()
+        samples.append((timestamp, value, payload))
+
+    @property
+    def maximum(self) -> Optional[Tuple[float, Any]]:
+        """Return maximum value and its payload as of the last added sample"""
+        if not self._samples:
+            return None
+
+        _, value, payload = self._samples[0]
+        return value, payload
+
+    def clear(self) -> None:
+        self._samples.clear()
+        self._newest = None
+
+
+class VectorMean(object):
+    """
+    Running mean of wind samples
+
+    The speed is the scalar mean of all sample speeds, the direction is the direction of the speed-weighted mean vector.
+    Adding and removing samples is O(1).
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.speed_sum = 0.0
+        self.x_sum = 0.0
+        self.y_sum = 0.0
+
+    def add(self, speed: float, direction: Optional[float]) -> None:
+        x, y = _vector_components(speed, direction)
+        self._add_components(speed, x, y)
+
+    def _add_components(self, speed: float, x: float, y: float) -> None:
+        self.count += 1
+        self.speed_sum += speed
+        self.x_sum += x
+        self.y_sum += y
+
+    def _remove_components(self, speed: float, x: float, y: float) -> None:
+        self.count -= 1
+        if self.count <= 0:
+            # Start over to avoid accumulating floating-point residue
+            self.clear()
+            return
+
+        self.speed_sum -= speed
+        self.x_sum -= x
+        self.y_sum -= y
+
+    @property
+    def speed(self) -> Optional[float]:
+        if self.count < 1:
+            return None
+        return self.speed_sum / self.count
+
+    @property
+    def direction(self) -> Optional[float]:
+        if self.count < 1 or self.speed_sum <= 0:
+            return None
+        if math.hypot(self.x_sum, self.y_sum) <= _CALM_RATIO * self.speed_sum:
+            return None
+
+        direction = math.degrees(math.atan2(self.x_sum, self.y_sum)) % 360.0
+        # Modulo of tiny negative angles rounds up to 360
+        return 0.0 if direction >= 360.0 else direction
+
+    def clear(self) -> None:
+        self.count = 0
+        self.speed_sum = 0.0
+        self.x_sum = 0.0
+        self.y_sum = 0.0
+
+
+class RollingVectorMean(object):
+    """
+    Running mean of wind samples within a sliding time window
+
+    Out-of-order samples are handled like in `RollingMaximum`.
+    """
+
+    def __init__(self, window: float):
+        if window <= 0:
+            raise ValueError("Window has to be positive (got: %s)" % repr(window))
+
+        self.window = window
+        self.mean = VectorMean()
+        self._samples = deque()
+        self._newest = None
+
+    def add(self, timestamp: float, speed: float, direction: Optional[float]) -> None:
+        """Add a sample and expire all samples that fell out of the window"""
+
+        timestamp = _clamp_timestamp(timestamp, self._newest, self.window)
+        if timestamp is None:
+            return
+        self._newest = timestamp
+
+        samples = self._samples
+        mean = self.mean
+
+        oldest = timestamp - self.window
+        while samples and samples[0][0] <= oldest:
+            _, old_speed, old_x, old_y = samples.popleft()
+            mean._remove_components(old_speed, old_x, old_y)
+
+        x, y = _vector_components(speed, direction)
+        samples.append((timestamp, speed, x, y))
+        mean._add_components(speed, x, y)
+
+    @property
+    def speed(self) -> Optional[float]:
+        return self.mean.speed
+
+    @property
+    def direction(self) -> Optional[float]:
+        return self.mean.direction
+
+    def clear(self) -> None:
+        self.mean.clear()
+        self._samples.clear()
+        self._newest = None
@@ -29,7 +29,12 @@ _logger.warning("Using driver \"%s\" is deprecated! Use \"%s\" instead." % ("use
 DRIVER_NAME = weatherlink_live.DRIVER_NAME
 DRIVER_VERSION = weatherlink_live.DRIVER_VERSION
 
-schema = weatherlink_live.schema
+
+def __getattr__(name):
+    if name == "schema":
+        return weatherlink_live.schema
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
+
 
 loader = weatherlink_live.loader
 confeditor_loader = weatherlink_live.confeditor_loader
@@ -78,20 +78,35 @@ class WeatherLinkLiveInstaller(ExtensionInstaller):
                 ]),
                 ('bin/user/weatherlink_live', [
                     'bin/user/weatherlink_live/__init__.py',
+                    'bin/user/weatherlink_live/archive.py',
+                    'bin/user/weatherlink_live/cache.py',
                     'bin/user/weatherlink_live/callback.py',
+                    'bin/user/weatherlink_live/capture.py',
                     'bin/user/weatherlink_live/config_editor.py',
                     'bin/user/weatherlink_live/configuration.py',
                     'bin/user/weatherlink_live/configurator.py',
                     'bin/user/weatherlink_live/data_host.py',
+                    'bin/user/weatherlink_live/database.py',
                     'bin/user/weatherlink_live/davis_broadcast.py',
                     'bin/user/weatherlink_live/davis_http.py',
                     'bin/user/weatherlink_live/db_schema.py',
                     'bin/user/weatherlink_live/driver.py',
+                    'bin/user/weatherlink_live/exporter.py',
                     'bin/user/weatherlink_live/mappers.py',
+                    'bin/user/weatherlink_live/metrics.py',
+                    'bin/user/weatherlink_live/observations.py',
+                    'bin/user/weatherlink_live/packet_logging.py',
                     'bin/user/weatherlink_live/packets.py',
+                    'bin/user/weatherlink_live/profiler.py',
+                    'bin/user/weatherlink_live/samples.py',
                     'bin/user/weatherlink_live/scheduler.py',
                     'bin/user/weatherlink_live/service.py',
+                    'bin/user/weatherlink_live/sparse.py',
+                    'bin/user/weatherlink_live/spool.py',
+                    'bin/user/weatherlink_live/state.py',
+                    'bin/user/weatherlink_live/supervisor.py',
                     'bin/user/weatherlink_live/utils.py',
+                    'bin/user/weatherlink_live/wind.py',
                 ]),
                 ('bin/user/weatherlink_live/static', [
                     'bin/user/weatherlink_live/static/__init__.py',
@@ -103,4 +118,5 @@ class WeatherLinkLiveInstaller(ExtensionInstaller):
                 ]),
             ],
             config=wll_config_dict,
+            xtype_services='user.weatherlink_live.cache.WllLoopCacheService',
         )
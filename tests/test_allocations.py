@@ -0,0 +1,167 @@
+# Copyright © 2020-2024 Michael Schantl and contributors
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""
+Tests of the memory allocated while processing a packet of the reference configuration
+
+Run with `PYTHONPATH=bin python3 -m unittest discover tests`
+"""
+import gc
+import json
+import os
+import random
+import sys
+import threading
+import tracemalloc
+import unittest
+from typing import Callable
+
+from user.weatherlink_live import configuration
+from user.weatherlink_live.data_host import DataHost
+from user.weatherlink_live.packets import WlHttpConditionsRequestPacket, WlUdpBroadcastPacket
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "tools"))
+
+from wll_simulator import SimulatedStation, DST_ISS, DST_LEAF_SOIL  # noqa: E402
+
+HOST = "test"
+
+# Reference configuration: Vantage Pro2 Plus with soil/leaf station
+TRANSMITTERS = [(DST_ISS, 1), (DST_LEAF_SOIL, 2)]
+MAPPING = [
+    'th:1', 'rain:1', 'wind:1', 'uv:1', 'solar:1', 'windchill:1', 'thw:1', 'thsw:1:appTemp', 'soil_temp:2:1',
+    'soil_temp:2:2', 'soil_temp:2:3', 'soil_temp:2:4', 'soil_moist:2:1', 'soil_moist:2:2', 'soil_moist:2:3',
+    'soil_moist:2:4', 'leaf_wet:2:1', 'leaf_wet:2:2', 'th_indoor', 'baro', 'battery:1', 'battery:2',
+]
+
+# Budgets per packet, measured with CPython 3.11 plus about 25% headroom. allocated_blocks: memory blocks allocated
+# while processing a packet, including the ones freed again. peak_bytes: peak of memory allocated.
+BUDGETS = {
+    'create_record/http': {'allocated_blocks': 275, 'peak_bytes': 1700},
+    'create_record/udp': {'allocated_blocks': 375, 'peak_bytes': 5700},
+    'process/http': {'allocated_blocks': 395, 'peak_bytes': 9500},
+    'process/udp': {'allocated_blocks': 430, 'peak_bytes': 8000},
+}
+
+
+def _create_packet(source: str, json_data: dict):
+    if source == 'http':
+        return WlHttpConditionsRequestPacket.try_create(json_data, HOST)
+    return WlUdpBroadcastPacket.try_create(json_data, HOST)
+
+
+def count_allocated_blocks(func: Callable[[], None]) -> int:
+    """
+    Count the memory blocks allocated by a function, without subtracting the ones freed again
+
+    The count of allocated blocks is sampled on every call and return, and increases between two samples are summed
+    up. Blocks allocated and freed between two samples are missed, so this is a lower bound.
+    """
+
+    state = [0, 0]
+
+    def sample(frame, event, arg):
+        blocks = sys.getallocatedblocks()
+        if blocks > state[1]:
+            state[0] += blocks - state[1]
+        state[1] = blocks
+
+    gc.collect()
+    gc.disable()
+    try:
+        state[1] = sys.getallocatedblocks()
+        sys.setprofile(sample)
+        try:
+            func()
+        finally:
+            sys.setprofile(None)
+    finally:
+        gc.enable()
+    return state[0]
+
+
+def measure_peak_bytes(func: Callable[[], None]) -> int:
+    """Peak of memory allocated by a function"""
+
+    tracemalloc.start()
+    try:
+        current_before, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak - current_before
+
+
+@unittest.skipUnless(sys.implementation.name == 'cpython', "Budgets are measured with CPython")
+class AllocationBudgetTest(unittest.TestCase):
+    def setUp(self):
+        station = SimulatedStation("001D0A700000", TRANSMITTERS, random.Random(0))
+        station.step(60)
+        self.packets = {
+            'http': station.current_conditions(),
+            'udp': station.broadcast(),
+        }
+        mappers = configuration.create_mappers(configuration.parse_mapping_definitions(MAPPING), False, False)
+        self.host = DataHost(mappers, threading.Event())
+
+    def _assert_within_budget(self, name: str, func: Callable[[], None]) -> None:
+        # Warm up caches filled by the first packets
+        for _ in range(3):
+            func()
+
+        budget = BUDGETS[name]
+        allocated_blocks = count_allocated_blocks(func)
+        peak_bytes = measure_peak_bytes(func)
+        self.assertLessEqual(allocated_blocks, budget['allocated_blocks'], "%s: allocated blocks" % name)
+        self.assertLessEqual(peak_bytes, budget['peak_bytes'], "%s: peak bytes" % name)
+
+    def _test_create_record(self, source: str) -> None:
+        packet = _create_packet(source, self.packets[source])
+
+        def create_record():
+            self.host._create_record(packet)
+            self.host.pop_packet()
+
+        self._assert_within_budget('create_record/%s' % source, create_record)
+
+    def _test_process(self, source: str) -> None:
+        # Complete path of a received packet: decoding, creating the packet and the record
+        data = json.dumps(self.packets[source]).encode("utf-8")
+
+        def process():
+            self.host._create_record(_create_packet(source, json.loads(data.decode("utf-8"))))
+            self.host.pop_packet()
+
+        self._assert_within_budget('process/%s' % source, process)
+
+    def test_create_record_http(self):
+        self._test_create_record('http')
+
+    def test_create_record_udp(self):
+        self._test_create_record('udp')
+
+    def test_process_http(self):
+        self._test_process('http')
+
+    def test_process_udp(self):
+        self._test_process('udp')
@@ -0,0 +1,128 @@
+# Copyright © 2020-2024 Michael Schantl and contributors
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Tests of the generation of archive records and downsampled loop records
+
+Run with `PYTHONPATH=bin python3 -m unittest discover tests`
+"""
+import types
+import unittest
+
+import weewx
+
+from user.weatherlink_live.archive import ArchiveAccumulator, LoopDownsampler
+from user.weatherlink_live.configuration import create_mappers
+from user.weatherlink_live.driver import WeatherlinkLiveDriver
+
+MAPPINGS = [['th', '1'], ['rain', '1'], ['wind', '1']]
+START = 1700000100
+
+
+def _loop_record(timestamp: float, **values) -> dict:
+    record = {'dateTime': timestamp, 'usUnits': weewx.US}
+    record.update(values)
+    return record
+
+
+class ArchiveAccumulatorTest(unittest.TestCase):
+    def setUp(self):
+        self.accumulator = ArchiveAccumulator(create_mappers(MAPPINGS, False, True), 300, weewx.US)
+
+    def test_period_boundaries(self):
+        self.assertIsNone(self.accumulator.add_record(_loop_record(START + 10, outTemp=50.0)))
+        # A record exactly on the boundary belongs to the period it ends
+        self.assertIsNone(self.accumulator.add_record(_loop_record(START + 300, outTemp=60.0)))
+
+        archive_record = self.accumulator.add_record(_loop_record(START + 301, outTemp=70.0))
+        self.assertEqual(START + 300, archive_record['dateTime'])
+        self.assertEqual(weewx.US, archive_record['usUnits'])
+        self.assertEqual(5, archive_record['interval'])
+        self.assertEqual(55.0, archive_record['outTemp'])
+
+        archive_record = self.accumulator.flush()
+        self.assertEqual(START + 600, archive_record['dateTime'])
+        self.assertEqual(70.0, archive_record['outTemp'])
+        self.assertIsNone(self.accumulator.flush())
+
+    def test_records_of_completed_period_are_ignored(self):
+        self.accumulator.add_record(_loop_record(START + 10, outTemp=50.0))
+        self.accumulator.add_record(_loop_record(START + 310, outTemp=60.0))
+
+        self.assertIsNone(self.accumulator.add_record(_loop_record(START + 20, outTemp=0.0)))
+        self.assertEqual(60.0, self.accumulator.flush()['outTemp'])
+
+    def test_aggregations(self):
+        self.accumulator.add_record(_loop_record(START + 10, outTemp=50.0, rain=0.01, rainSize=0.01,
+                                                 windSpeed=10.0, windDir=80.0))
+        self.accumulator.add_record(_loop_record(START + 20, outTemp=51.0, rain=0.02, rainSize=0.01,
+                                                 windSpeed=10.0, windDir=100.0))
+        self.accumulator.add_record(_loop_record(START + 30, outTemp=None, rain=0.0, rainSize=0.2,
+                                                 windSpeed=4.0, windDir=None))
+        archive_record = self.accumulator.flush()
+
+        self.assertAlmostEqual(50.5, archive_record['outTemp'])
+        self.assertAlmostEqual(0.03, archive_record['rain'])
+        self.assertEqual(0.2, archive_record['rainSize'])
+        self.assertNotIn('outHumidity', archive_record)
+
+        # Calm wind only contributes to the speed
+        self.assertAlmostEqual(8.0, archive_record['windSpeed'])
+        self.assertAlmostEqual(90.0, archive_record['windDir'])
+        # The latest of equal maxima is the gust
+        self.assertEqual(10.0, archive_record['windGust'])
+        self.assertEqual(100.0, archive_record['windGustDir'])
+
+    def test_interval_has_to_be_full_minutes(self):
+        with self.assertRaises(ValueError):
+            ArchiveAccumulator([], 90, weewx.US)
+
+
+class LoopDownsamplerTest(unittest.TestCase):
+    def test_downsampled_record(self):
+        downsampler = LoopDownsampler(create_mappers(MAPPINGS, False, True), 10, weewx.US)
+        downsampler.add_record(_loop_record(START + 2.5, outTemp=50.0, rain=0.01))
+        downsampler.add_record(_loop_record(START + 5, outTemp=52.0, rain=0.01))
+
+        record = downsampler.add_record(_loop_record(START + 12.5, outTemp=60.0, rain=0.0))
+        self.assertEqual({'dateTime': START + 10, 'usUnits': weewx.US, 'outTemp': 51.0, 'rain': 0.02}, record)
+
+
+class GenArchiveRecordsTest(unittest.TestCase):
+    def setUp(self):
+        config = {
+            'StdArchive': {'archive_interval': 300},
+            'WeatherLinkLive': {'host': '127.0.0.1', 'mapping': ['th:1'], 'archive_records': 'true'}
+        }
+        self.driver = WeatherlinkLiveDriver(config, types.SimpleNamespace(bind=lambda *args: None))
+
+    def test_skips_archived_records(self):
+        for period in range(4):
+            self.driver._accumulate(_loop_record(START + period * 300 + 10, outTemp=float(period)))
+
+        records = list(self.driver.genArchiveRecords(START + 300))
+        self.assertEqual([START + 600, START + 900], [record['dateTime'] for record in records])
+        self.assertEqual([1.0, 2.0], [record['outTemp'] for record in records])
+
+        # Emitted and skipped records are not emitted again
+        self.assertEqual([], list(self.driver.genArchiveRecords(None)))
+
+    def test_archive_interval(self):
+        self.assertEqual(300, self.driver.archive_interval)
@@ -0,0 +1,155 @@
+# Copyright © 2020-2024 Michael Schantl and contributors
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Tests of broadcast reception with malformed datagrams
+
+Run with `PYTHONPATH=bin python3 -m unittest discover tests`
+"""
+import json
+import logging
+import threading
+import time
+import unittest
+from socket import socket, AF_INET, SOCK_DGRAM
+from unittest import mock
+
+from weewx import WeeWxIOError
+
+from user.weatherlink_live.callback import PacketCallback
+from user.weatherlink_live.davis_broadcast import WllBroadcastReceiver, ErrorBudget
+from user.weatherlink_live.metrics import WakeupCounter, PipelineMetrics
+
+VALID = json.dumps({
+    'did': '001D0A700000',
+    'ts': 1700000000,
+    'conditions': [{'lsid': 1, 'data_structure_type': 1, 'txid': 1, 'temp': 50.0}],
+}).encode('utf-8')
+
+MALFORMED = [
+    # Truncated
+    VALID[:40],
+    # Not UTF-8
+    b'\xff\xfe' + VALID,
+    # Incomplete packet
+    json.dumps({'did': '001D0A700000', 'ts': 1700000000}).encode('utf-8'),
+]
+
+
+def _free_port() -> int:
+    with socket(AF_INET, SOCK_DGRAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class CountingCallback(PacketCallback):
+    def __init__(self):
+        self.packets = 0
+        self.error = None
+        self.error_event = threading.Event()
+
+    def on_packet_received(self, packet):
+        self.packets += 1
+
+    def on_packet_receive_error(self, e: BaseException):
+        self.error = e
+        self.error_event.set()
+
+
+class BroadcastReceptionTest(unittest.TestCase):
+    def setUp(self):
+        self.port = _free_port()
+        self.callback = CountingCallback()
+        self.sender = socket(AF_INET, SOCK_DGRAM)
+        self.receiver = None
+
+        # Reception ends by raising the error, which is reported to the callback as well
+        excepthook = threading.excepthook
+        threading.excepthook = lambda args: None
+        self.addCleanup(setattr, threading, 'excepthook', excepthook)
+
+    def tearDown(self):
+        if self.receiver is not None:
+            self.receiver.close()
+        self.sender.close()
+
+    def _start(self, error_budget: ErrorBudget, metrics: PipelineMetrics = None) -> None:
+        self.receiver = WllBroadcastReceiver('127.0.0.1', self.port, self.callback, error_budget,
+                                             WakeupCounter("broadcast"), metrics)
+        # The socket is bound by the reception thread
+        deadline = time.monotonic() + 5
+        while self.receiver.sock is None and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def _send(self, datagrams) -> None:
+        for data in datagrams:
+            self.sender.sendto(data, ('127.0.0.1', self.port))
+            # Don't overrun the receive buffer
+            time.sleep(0.001)
+
+    def _wait_for(self, condition) -> None:
+        deadline = time.monotonic() + 5
+        while not condition() and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def test_malformed_within_budget(self):
+        error_budget = ErrorBudget(30, 60)
+        metrics = PipelineMetrics("broadcast")
+        self._start(error_budget, metrics)
+
+        # Every fifth datagram is malformed
+        datagrams = [MALFORMED[i // 5 % len(MALFORMED)] if i % 5 == 4 else VALID for i in range(100)]
+        with self.assertLogs('user.weatherlink_live.davis_broadcast', logging.WARNING):
+            self._send(datagrams)
+            self._wait_for(lambda: self.callback.packets + error_budget.error_count >= len(datagrams))
+
+        self.assertEqual(80, self.callback.packets)
+        self.assertEqual(20, error_budget.error_count)
+        self.assertEqual(20, metrics.counter("decode errors").value)
+        self.assertIsNone(self.callback.error)
+        self.assertTrue(self.receiver.thread.is_alive())
+
+    def test_budget_exceeded(self):
+        error_budget = ErrorBudget(5, 60)
+        self._start(error_budget)
+
+        with self.assertLogs('user.weatherlink_live.davis_broadcast', logging.WARNING):
+            self._send([VALID] + MALFORMED * 4)
+            self.assertTrue(self.callback.error_event.wait(5))
+
+        self.assertIsInstance(self.callback.error, WeeWxIOError)
+        self.assertEqual(1, self.callback.packets)
+        self.assertEqual(6, error_budget.error_count)
+        self.receiver.thread.join(5)
+        self.assertFalse(self.receiver.thread.is_alive())
+
+    def test_unexpected_error_stops_reception(self):
+        error_budget = ErrorBudget(5, 60)
+        self._start(error_budget)
+
+        with mock.patch('user.weatherlink_live.davis_broadcast.WlUdpBroadcastPacket.try_create',
+                        side_effect=TypeError("Bug")):
+            self._send([VALID])
+            self.assertTrue(self.callback.error_event.wait(5))
+
+        self.assertIsInstance(self.callback.error, TypeError)
+        self.assertEqual(0, error_budget.error_count)
+        self.receiver.thread.join(5)
+        self.assertFalse(self.receiver.thread.is_alive())
@@ -0,0 +1,237 @@
+# Copyright © 2020-2024 Michael Schantl and contributors
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""
+Tests of the loop cache answering queries of reports
+
+Run with `PYTHONPATH=bin python3 -m unittest discover tests`
+"""
+import math
+import random
+import unittest
+
+import weewx
+import weewx.accum
+import weewx.manager
+import weewx.xtypes
+from schemas import wview_extended
+from weeutil.weeutil import TimeSpan, startOfDay
+
+from user.weatherlink_live.cache import LoopCache, RingBuffer, AGGREGATE_TYPES, _extractor
+from user.weatherlink_live.configuration import create_mappers
+from user.weatherlink_live.db_schema import mapped_observations
+
+ARCHIVE_INTERVAL = 300
+# Morning of a day, so no time span of the test starts and ends at midnight
+START = startOfDay(1700000000) + 7 * 3600
+
+
+def _is_close(a, b) -> bool:
+    if a is None or b is None:
+        return a == b
+    return math.isclose(a, b, rel_tol=1e-9, abs_tol=1e-9)
+
+
+class RingBufferTest(unittest.TestCase):
+    def setUp(self):
+        self.buffer = RingBuffer(ARCHIVE_INTERVAL, 4, ARCHIVE_INTERVAL)
+
+    def _add(self, count: int) -> None:
+        for i in range(1, count + 1):
+            self.buffer.add(START + i * ARCHIVE_INTERVAL, float(i))
+
+    def test_wrap_around(self):
+        self._add(10)
+
+        # Only the 4 most recent records are held; older bins were overwritten in place
+        self.assertEqual([(START + i * ARCHIVE_INTERVAL, float(i)) for i in range(7, 11)],
+                         list(self.buffer.records(START, START + 10 * ARCHIVE_INTERVAL)))
+        self.assertEqual(34.0, self.buffer.aggregate(START + 6 * ARCHIVE_INTERVAL, START + 10 * ARCHIVE_INTERVAL,
+                                                     'sum'))
+        self.assertEqual(4, self.buffer.aggregate(START, START + 10 * ARCHIVE_INTERVAL, 'count'))
+
+    def test_covers(self):
+        self.assertFalse(self.buffer.covers(START, START + ARCHIVE_INTERVAL))
+
+        self._add(10)
+        stop = START + 10 * ARCHIVE_INTERVAL
+        self.assertTrue(self.buffer.covers(stop - 4 * ARCHIVE_INTERVAL, stop))
+        # Overwritten records are only in the database
+        self.assertFalse(self.buffer.covers(stop - 5 * ARCHIVE_INTERVAL, stop))
+        # Bins are only aggregated as a whole
+        self.assertFalse(self.buffer.covers(stop - 4 * ARCHIVE_INTERVAL + 60, stop))
+        self.assertTrue(self.buffer.covers(stop - 4 * ARCHIVE_INTERVAL + 60, stop, aligned=False))
+
+    def test_covers_since_first_record(self):
+        self.buffer.add(START + ARCHIVE_INTERVAL, 1.0)
+
+        # Records before the first one added are only in the database
+        self.assertTrue(self.buffer.covers(START, START + ARCHIVE_INTERVAL))
+        self.assertFalse(self.buffer.covers(START - ARCHIVE_INTERVAL, START + ARCHIVE_INTERVAL))
+
+    def test_coarse_bins(self):
+        buffer = RingBuffer(3600, 2, ARCHIVE_INTERVAL)
+        hour = START + 3600
+        for i, value in enumerate([3.0, 1.0, None, 2.0]):
+            buffer.add(hour + i * ARCHIVE_INTERVAL, value)
+
+        self.assertEqual(3, buffer.aggregate(hour - 3600, hour + 3600, 'count'))
+        self.assertEqual(2.0, buffer.aggregate(hour - 3600, hour + 3600, 'avg'))
+        self.assertEqual(1.0, buffer.aggregate(hour - 3600, hour + 3600, 'min'))
+        self.assertEqual(3.0, buffer.aggregate(hour - 3600, hour + 3600, 'max'))
+        self.assertEqual(2.0, buffer.aggregate(hour - 3600, hour + 3600, 'last'))
+        self.assertIsNone(buffer.aggregate(hour + 3600, hour + 7200, 'avg'))
+
+
+class LoopCacheTest(unittest.TestCase):
+    """Queries answered by the cache compared to `weewx.xtypes.ArchiveTable` answering them from the database"""
+
+    def setUp(self):
+        self.rng = random.Random(0)
+        mappers = create_mappers([['th', '1'], ['rain', '1'], ['wind', '1']], False, True)
+        self.extractors = dict([(observation, _extractor(observation)) for observation in mapped_observations(mappers)
+                                if _extractor(observation)])
+
+        self.db = weewx.manager.DaySummaryManager.open_with_create(
+            {'database_name': ':memory:', 'driver': 'weedb.sqlite'}, schema=wview_extended.schema)
+        self.addCleanup(self.db.close)
+        self.observations = [observation for observation in self.extractors if observation in self.db.obskeys]
+
+        self.cache = LoopCache(dict(self.extractors), [600, 3600], 86400, ARCHIVE_INTERVAL, ':memory:', 'archive')
+        self.cache.register()
+        self.addCleanup(self.cache.unregister)
+
+        self.archive_table = weewx.xtypes.ArchiveTable()
+
+    def _packet(self, timestamp: int) -> dict:
+        packet = {'dateTime': timestamp, 'usUnits': weewx.US}
+        for observation in self.extractors:
+            # Not every packet contains every observation
+            if self.rng.random() < 0.1:
+                continue
+            if observation == 'rain':
+                packet[observation] = self.rng.choice([0.0, 0.0, 0.0, 0.01])
+            else:
+                packet[observation] = self.rng.uniform(0, 100)
+        if self.rng.random() < 0.02:
+            packet['outTemp'] = float('nan')
+        return packet
+
+    def _feed(self, start: int, stop: int) -> None:
+        """Feed the loop packets within (start, stop] and the software archive records created from them"""
+
+        accumulator = None
+        timestamp = start + 3
+        while timestamp <= stop:
+            interval_stop = math.ceil(timestamp / ARCHIVE_INTERVAL) * ARCHIVE_INTERVAL
+            if accumulator is not None and accumulator.timespan.stop != interval_stop:
+                self._add_record(accumulator)
+                accumulator = None
+            if accumulator is None:
+                accumulator = weewx.accum.Accum(TimeSpan(interval_stop - ARCHIVE_INTERVAL, interval_stop))
+
+            packet = self._packet(timestamp)
+            accumulator.addRecord(packet)
+            self.cache.add_packet(packet)
+            timestamp += self.rng.choice([2, 3, 10])
+        self._add_record(accumulator)
+
+    def _add_record(self, accumulator: weewx.accum.Accum) -> None:
+        record = accumulator.getRecord()
+        record['interval'] = ARCHIVE_INTERVAL // 60
+        self.cache.add_record(record, 'software')
+        self.db.addRecord(record)
+
+    def _spans(self, stop: int):
+        """Time spans within the last 6 hours before `stop`; aligned to archive intervals and to hours"""
+
+        spans = []
+        for _ in range(40):
+            span_stop = stop - self.rng.randrange(0, 24) * ARCHIVE_INTERVAL
+            span_start = span_stop - self.rng.randrange(1, 48) * ARCHIVE_INTERVAL
+            spans.append(TimeSpan(span_start, span_stop))
+            spans.append(TimeSpan(span_start - span_start % 3600, span_stop - span_stop % 3600 + 3600))
+        return [span for span in spans if span.start < span.stop <= stop]
+
+    def test_aggregates(self):
+        stop = START + 6 * 3600
+        self._feed(START, stop)
+        self.assertEqual(sorted(self.extractors), sorted(self.cache.extractors))
+
+        for span in self._spans(stop):
+            for observation in self.observations:
+                for aggregate_type in AGGREGATE_TYPES:
+                    with self.subTest(observation=observation, aggregate_type=aggregate_type, span=span):
+                        hits = self.cache.hits
+                        cached = weewx.xtypes.get_aggregate(observation, span, aggregate_type, self.db)
+                        self.assertEqual(hits + 1, self.cache.hits)
+
+                        expected = self.archive_table.get_aggregate(observation, span, aggregate_type, self.db)
+                        self.assertTrue(_is_close(expected[0], cached[0]), "%r != %r" % (expected, cached))
+                        self.assertEqual(expected[1:], cached[1:])
+
+    def test_series(self):
+        stop = START + 6 * 3600
+        self._feed(START, stop)
+
+        for span in self._spans(stop)[:20]:
+            for observation in self.observations:
+                for aggregate_type, aggregate_interval in [(None, None), ('avg', 600), ('sum', 3600), ('max', 3600),
+                                                           ('count', 600)]:
+                    with self.subTest(observation=observation, aggregate_type=aggregate_type, span=span):
+                        hits = self.cache.hits
+                        cached = weewx.xtypes.get_series(observation, span, self.db, aggregate_type,
+                                                         aggregate_interval)
+                        self.assertGreater(self.cache.hits, hits)
+
+                        expected = self.archive_table.get_series(observation, span, self.db, aggregate_type,
+                                                                 aggregate_interval)
+                        self.assertEqual(expected[0], cached[0])
+                        self.assertEqual(expected[1], cached[1])
+                        self.assertEqual(expected[2][1:], cached[2][1:])
+                        self.assertEqual(len(expected[2][0]), len(cached[2][0]))
+                        for expected_value, cached_value in zip(expected[2][0], cached[2][0]):
+                            self.assertTrue(_is_close(expected_value, cached_value),
+                                            "%r != %r" % (expected_value, cached_value))
+
+    def test_queries_passed_on_to_database(self):
+        stop = START + 6 * 3600
+        self._feed(START, stop)
+
+        # Before the first cached record
+        with self.assertRaises(weewx.UnknownType):
+            self.cache.get_aggregate('outTemp', TimeSpan(START - 3600, START + 3600), 'avg', self.db)
+        # Taken from the daily summaries
+        day = startOfDay(START)
+        with self.assertRaises(weewx.UnknownAggregation):
+            self.cache.get_aggregate('outTemp', TimeSpan(day, day + 86400), 'max', self.db)
+        # Observations without a column
+        with self.assertRaises(weewx.UnknownType):
+            self.cache.get_aggregate('rainSize', TimeSpan(stop - 3600, stop), 'avg', self.db)
+
+    def test_records_not_generated_in_software_clear_cache(self):
+        stop = START + 3600
+        self._feed(START, stop)
+        self.cache.get_aggregate('outTemp', TimeSpan(stop - 3600, stop), 'avg', self.db)
+
+        self.cache.add_record({'dateTime': stop + ARCHIVE_INTERVAL, 'usUnits': weewx.US}, 'hardware')
+        with self.assertRaises(weewx.UnknownType):
+            self.cache.get_aggregate('outTemp', TimeSpan(stop - 3600, stop), 'avg', self.db)
@@ -0,0 +1,105 @@
+# Copyright © 2020-2024 Michael Schantl and contributors
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Tests of the HTTP requests to the device
+
+Run with `PYTHONPATH=bin python3 -m unittest discover tests`
+"""
+import json
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socket import socket
+
+from user.weatherlink_live.davis_http import CancelEvent, RequestCancelled, request_current
+
+CONDITIONS = {
+    'data': {
+        'did': '001D0A700000',
+        'ts': 1700000000,
+        'conditions': [{'lsid': 1, 'data_structure_type': 1, 'txid': 1, 'temp': 50.0}],
+    },
+    'error': None,
+}
+
+
+class ConditionsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = json.dumps(CONDITIONS).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class RequestTest(unittest.TestCase):
+    def test_request_current(self):
+        server = HTTPServer(('127.0.0.1', 0), ConditionsHandler)
+        thread = threading.Thread(target=server.handle_request)
+        thread.start()
+        try:
+            packet = request_current('127.0.0.1:%d' % server.server_address[1], timeout=5)
+        finally:
+            thread.join(5)
+            server.server_close()
+
+        self.assertEqual(1700000000, packet.timestamp)
+        self.assertEqual(50.0, packet.get_observation('temp'))
+
+    def test_cancel_interrupts_request_in_progress(self):
+        # Accepts connections, but never answers
+        with socket() as server:
+            server.bind(('127.0.0.1', 0))
+            server.listen(1)
+
+            cancel_event = CancelEvent()
+            errors = []
+
+            def request():
+                try:
+                    request_current('127.0.0.1:%d' % server.getsockname()[1], timeout=30, cancel_event=cancel_event)
+                except Exception as e:
+                    errors.append(e)
+
+            thread = threading.Thread(target=request)
+            thread.start()
+            time.sleep(0.2)
+
+            start = time.monotonic()
+            cancel_event.set()
+            thread.join(5)
+
+            self.assertFalse(thread.is_alive())
+            self.assertLess(time.monotonic() - start, 0.1)
+            self.assertEqual(1, len(errors))
+            self.assertIsInstance(errors[0], RequestCancelled)
+
+    def test_cancelled_before_request(self):
+        cancel_event = CancelEvent()
+        cancel_event.set()
+
+        with self.assertRaises(RequestCancelled):
+            request_current('127.0.0.1:9', timeout=30, cancel_event=cancel_event)
@@ -0,0 +1,55 @@
+# Copyright © 2020-2024 Michael Schantl and contributors
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""
+Tests of the startup cost of the driver
+
+Run with `PYTHONPATH=bin python3 -m unittest discover tests`
+"""
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "tools"))
+
+from import_budget import BUDGET_MS, FORBIDDEN_MODULES, IMPORTS, PACKAGE, is_module_or_submodule, \
+    measure_imports  # noqa: E402
+
+
+class ImportBudgetTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        # Imports the driver in a fresh interpreter with `-X importtime`
+        cls.times = measure_imports(sys.executable)
+        cls.imported = [t.module for t in cls.times]
+
+    def test_driver_is_imported(self):
+        for module in IMPORTS:
+            self.assertIn(module, self.imported)
+
+    def test_forbidden_modules_are_not_imported(self):
+        for forbidden in FORBIDDEN_MODULES:
+            with self.subTest(forbidden):
+                self.assertEqual([], [m for m in self.imported if is_module_or_submodule(m, forbidden)])
+
+    def test_import_time_of_driver_modules(self):
+        own_us = sum(t.self_us for t in self.times if is_module_or_submodule(t.module, PACKAGE))
+        self.assertLessEqual(own_us / 1000, BUDGET_MS)
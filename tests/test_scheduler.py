@@ -0,0 +1,114 @@
+# Copyright © 2020-2024 Michael Schantl and contributors
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Tests of the HTTP scheduler and its supervision
+
+Run with `PYTHONPATH=bin python3 -m unittest discover tests`
+"""
+import threading
+import time
+import unittest
+
+from weewx import WeeWxIOError
+
+from user.weatherlink_live.data_host import WllPollHost
+from user.weatherlink_live.scheduler import Scheduler
+
+
+class SchedulerTest(unittest.TestCase):
+    def test_first_tick_runs_on_scheduler_thread(self):
+        release = threading.Event()
+        polled = threading.Event()
+
+        def poll():
+            polled.set()
+            release.wait(5)
+
+        start = time.monotonic()
+        scheduler = Scheduler(10, poll, lambda duration: None, threading.Event())
+        elapsed = time.monotonic() - start
+        try:
+            self.assertTrue(polled.wait(1))
+            self.assertLess(elapsed, 1)
+        finally:
+            release.set()
+            scheduler.cancel()
+
+    def test_failed_tick_is_reported(self):
+        data_event = threading.Event()
+
+        def poll():
+            raise WeeWxIOError("Request failed")
+
+        scheduler = Scheduler(10, poll, lambda duration: None, data_event)
+        try:
+            self.assertTrue(data_event.wait(1))
+            self.assertIsInstance(scheduler.error, WeeWxIOError)
+        finally:
+            scheduler.cancel()
+
+    def test_cancel_waits_for_tick_in_progress(self):
+        polled = threading.Event()
+        release = threading.Event()
+        refreshes = []
+
+        def poll():
+            polled.set()
+            release.wait(5)
+
+        scheduler = Scheduler(10, poll, refreshes.append, threading.Event())
+        self.assertTrue(polled.wait(1))
+
+        cancelling = threading.Thread(target=scheduler.cancel)
+        cancelling.start()
+        cancelling.join(0.2)
+        self.assertTrue(cancelling.is_alive())
+
+        release.set()
+        cancelling.join(1)
+        self.assertFalse(cancelling.is_alive())
+        self.assertFalse(scheduler._scheduler_thread.is_alive())
+        # The tick was cancelled after polling, so the broadcast isn't refreshed anymore
+        self.assertEqual([], refreshes)
+
+
+class WllPollHostTest(unittest.TestCase):
+    def test_failed_poll_is_reported_to_host(self):
+        data_event = threading.Event()
+        host = WllPollHost("localhost", [], data_event)
+
+        def request(*args, **kwargs):
+            raise WeeWxIOError("Request failed")
+
+        host._request = request
+        host.poll()
+
+        self.assertTrue(data_event.is_set())
+        self.assertIsInstance(host.error, WeeWxIOError)
+
+        # Not polling again until restarted
+        data_event.clear()
+        host.poll()
+        self.assertFalse(data_event.is_set())
+
+        host.clear_error()
+        host.poll()
+        self.assertTrue(data_event.is_set())
@@ -0,0 +1,99 @@
+# Copyright © 2020-2024 Michael Schantl and contributors
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""
+Tests of the time closing the driver takes while running against the simulated device
+
+Run with `PYTHONPATH=bin python3 -m unittest discover tests`
+"""
+import os
+import sys
+import threading
+import time
+import types
+import unittest
+from socket import socket, AF_INET, SOCK_DGRAM
+
+from user.weatherlink_live.driver import WeatherlinkLiveDriver
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "tools"))
+
+import wll_simulator  # noqa: E402
+
+# Seconds closing the driver may take
+SHUTDOWN_BUDGET = 0.1
+MAPPING = ['th:1', 'rain:1', 'wind:1', 'th_indoor', 'baro']
+
+
+def _free_port() -> int:
+    with socket(AF_INET, SOCK_DGRAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class ShutdownTest(unittest.TestCase):
+    def _start(self, latency: float, http_requests: int) -> WeatherlinkLiveDriver:
+        """Start the driver against a simulated device and wait until the device received `http_requests` requests"""
+
+        simulator_args = wll_simulator.create_parser().parse_args([
+            "--http-port", "0",
+            "--broadcast-port", str(_free_port()),
+            "--latency", str(latency),
+        ])
+        device = wll_simulator.SimulatedDevice(0, simulator_args, simulator_args.transmitters)
+        device.start()
+        self.addCleanup(device.stop)
+
+        driver = WeatherlinkLiveDriver({
+            'WeatherLinkLive': {
+                'host': "127.0.0.1:%d" % device.server.server_address[1],
+                'mapping': MAPPING,
+            },
+        }, types.SimpleNamespace(bind=lambda *args: None))
+        driver.start()
+
+        deadline = time.monotonic() + 5
+        while device.stats["http"] < http_requests:
+            if time.monotonic() > deadline:
+                driver.closePort()
+                self.fail("Simulated device received only %d HTTP requests" % device.stats["http"])
+            time.sleep(0.01)
+        # Let the driver process the responses
+        time.sleep(0.2)
+        return driver
+
+    def _assert_close_within_budget(self, driver: WeatherlinkLiveDriver) -> None:
+        start = time.perf_counter()
+        driver.closePort()
+        elapsed = time.perf_counter() - start
+
+        self.assertLess(elapsed, SHUTDOWN_BUDGET)
+        self.assertNotIn("WLL-HTTP-Scheduler", [thread.name for thread in threading.enumerate()])
+
+    def test_idle(self):
+        # Polled and requested broadcasts; the scheduler and the broadcast receiver are waiting
+        driver = self._start(0, 2)
+        self._assert_close_within_budget(driver)
+
+    def test_tick_in_progress(self):
+        # The first poll is waiting for a response, which takes longer than the HTTP timeout
+        driver = self._start(60, 1)
+        self._assert_close_within_budget(driver)
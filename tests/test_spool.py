@@ -0,0 +1,139 @@
+# Copyright © 2020-2024 Michael Schantl and contributors
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Tests of the memory-mapped loop spool
+
+Run with `PYTHONPATH=bin python3 -m unittest discover tests`
+"""
+import os
+import tempfile
+import types
+import unittest
+
+import weewx
+
+from user.weatherlink_live.driver import WeatherlinkLiveDriver
+from user.weatherlink_live.spool import LoopSpool, SLOT_SIZE, _HEADER_SIZE
+
+START = 1700000000
+
+
+class LoopSpoolTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'loop.spool')
+        self.spool = LoopSpool(self.path, 4)
+
+    def tearDown(self):
+        self.spool.close()
+        self.directory.cleanup()
+
+    def _append(self, count: int, start: int = 0) -> None:
+        for i in range(start, start + count):
+            self.spool.append({'dateTime': START + i, 'usUnits': weewx.US, 'outTemp': float(i), 'rain': None})
+
+    def _timestamps(self, since_ts=None):
+        return [record['dateTime'] for record in self.spool.records_since(since_ts)]
+
+    def test_round_trip(self):
+        self.spool.append({'dateTime': START, 'usUnits': weewx.US, 'outTemp': 50.5, 'rain': None})
+        self.spool.append({'dateTime': START + 3, 'usUnits': weewx.METRICWX, 'windSpeed': 2.0})
+
+        self.assertEqual([
+            {'dateTime': START, 'usUnits': weewx.US, 'outTemp': 50.5, 'rain': None},
+            {'dateTime': START + 3, 'usUnits': weewx.METRICWX, 'windSpeed': 2.0},
+        ], self.spool.records_since(None))
+        self.assertEqual([START + 3], self._timestamps(START))
+
+    def test_wrap_around(self):
+        self._append(10)
+
+        # Only the most recent records fit, oldest first
+        self.assertEqual([START + 6, START + 7, START + 8, START + 9], self._timestamps())
+        self.assertEqual(_HEADER_SIZE + 4 * SLOT_SIZE, os.path.getsize(self.path))
+
+    def test_corrupt_slot_is_skipped(self):
+        self._append(4)
+
+        # Flip a bit of the timestamp of sequence number 2, which is stored in slot 2
+        offset = _HEADER_SIZE + 2 * SLOT_SIZE
+        self.spool._mmap[offset + 14] ^= 0x01
+
+        self.assertEqual([START, START + 2, START + 3], self._timestamps())
+
+    def test_truncated_slot_is_skipped(self):
+        self._append(4)
+
+        # A write interrupted after the slot header, before the fields and the checksum
+        offset = _HEADER_SIZE + 3 * SLOT_SIZE
+        self.spool._mmap[offset + 24:offset + SLOT_SIZE] = bytes(SLOT_SIZE - 24)
+
+        self.assertEqual([START, START + 1, START + 3], self._timestamps())
+
+    def test_reopen(self):
+        self._append(6)
+        self.spool.close()
+
+        self.spool = LoopSpool(self.path, 4)
+        self.assertEqual([START + 2, START + 3, START + 4, START + 5], self._timestamps())
+        self.assertEqual(5.0, self.spool.records_since(START + 4)[0]['outTemp'])
+
+        # Appending continues after the most recent record instead of overwriting it
+        self._append(1, 6)
+        self.assertEqual([START + 3, START + 4, START + 5, START + 6], self._timestamps())
+
+    def test_reopen_with_different_size_discards_spool(self):
+        self._append(2)
+        self.spool.close()
+
+        self.spool = LoopSpool(self.path, 8)
+        self.assertEqual([], self._timestamps())
+
+
+class SpoolReplayTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'loop.spool')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_records_are_converted_to_configured_unit_system(self):
+        # Spooled before the unit system was changed from METRICWX to US
+        spool = LoopSpool(self.path, 4)
+        spool.append({'dateTime': START + 10, 'usUnits': weewx.METRICWX, 'outTemp': 10.0})
+        spool.append({'dateTime': START + 310, 'usUnits': weewx.METRICWX, 'outTemp': 20.0})
+        spool.close()
+
+        config = {
+            'StdArchive': {'archive_interval': 300},
+            'WeatherLinkLive': {'host': '127.0.0.1', 'mapping': ['th:1'], 'archive_records': 'true',
+                                'spool_file': self.path, 'spool_size': '4', 'unit_system': 'US'}
+        }
+        driver = WeatherlinkLiveDriver(config, types.SimpleNamespace(bind=lambda *args: None))
+        try:
+            records = list(driver.genStartupRecords(None))
+        finally:
+            driver.spool.close()
+
+        self.assertEqual(1, len(records))
+        self.assertEqual(weewx.US, records[0]['usUnits'])
+        self.assertAlmostEqual(50.0, records[0]['outTemp'])
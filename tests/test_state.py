@@ -0,0 +1,140 @@
+# Copyright © 2020-2024 Michael Schantl and contributors
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Tests of the persistent state store and the restore of rain count baselines
+
+Run with `PYTHONPATH=bin python3 -m unittest discover tests`
+"""
+import json
+import os
+import tempfile
+import time
+import unittest
+
+from user.weatherlink_live.configuration import create_mappers
+from user.weatherlink_live.packets import WlUdpBroadcastPacket
+from user.weatherlink_live.state import StateStore
+
+
+def _broadcast(timestamp: int, daily_rain_count: int) -> WlUdpBroadcastPacket:
+    return WlUdpBroadcastPacket({
+        'did': '001D0A700000',
+        'ts': timestamp,
+        'conditions': [{
+            'lsid': 1,
+            'data_structure_type': 1,
+            'txid': 1,
+            'rain_size': 1,
+            'rain_rate_last': 0,
+            'rainfall_daily': daily_rain_count,
+        }]
+    }, 'test')
+
+
+class StateStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'state.json')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_round_trip(self):
+        store = StateStore(self.path, 3600)
+        store.set('mapping:rain:1', {'last_daily_rain_count': 10})
+        store.flush(force=True)
+
+        self.assertEqual({'last_daily_rain_count': 10}, StateStore(self.path, 3600).get('mapping:rain:1'))
+        self.assertFalse(os.path.exists(self.path + '.tmp'))
+
+    def test_writes_are_coalesced(self):
+        store = StateStore(self.path, 3600)
+        store.set('service:wind_gust', {'gust': 10.0})
+        store.flush()
+        self.assertFalse(os.path.exists(self.path))
+
+        # Immediate state is written on the next flush, together with the pending changes
+        store.set('mapping:rain:1', {'last_daily_rain_count': 10}, immediate=True)
+        store.flush()
+        with open(self.path, 'r', encoding='utf-8') as f:
+            self.assertEqual({'service:wind_gust': {'gust': 10.0}, 'mapping:rain:1': {'last_daily_rain_count': 10}},
+                             json.load(f))
+
+    def test_missing_file(self):
+        store = StateStore(self.path, 3600)
+        self.assertIsNone(store.get('mapping:rain:1'))
+
+    def test_corrupt_file(self):
+        with open(self.path, 'w', encoding='utf-8') as f:
+            f.write('{"mapping:rain:1": {"last_daily')
+
+        with self.assertLogs('user.weatherlink_live.state', 'WARNING'):
+            store = StateStore(self.path, 3600)
+        self.assertIsNone(store.get('mapping:rain:1'))
+
+        # The corrupt file is replaced on the next write
+        store.set('mapping:rain:1', {'last_daily_rain_count': 3}, immediate=True)
+        store.flush()
+        self.assertEqual({'last_daily_rain_count': 3}, StateStore(self.path, 3600).get('mapping:rain:1'))
+
+    def test_malformed_file(self):
+        with open(self.path, 'w', encoding='utf-8') as f:
+            json.dump([1, 2, 3], f)
+
+        with self.assertLogs('user.weatherlink_live.state', 'WARNING'):
+            store = StateStore(self.path, 3600)
+        self.assertIsNone(store.get('mapping:rain:1'))
+
+
+class RainStateTest(unittest.TestCase):
+    def setUp(self):
+        self.mapper = create_mappers([['rain', '1']], False, True)[0]
+        self.now = int(time.time())
+
+    def _map(self, daily_rain_count: int) -> dict:
+        record = dict()
+        self.mapper.map(_broadcast(self.now, daily_rain_count), record)
+        return record
+
+    def test_restore_on_same_day(self):
+        self._map(10)
+        state = self.mapper.state
+
+        self.mapper = create_mappers([['rain', '1']], False, True)[0]
+        self.mapper.restore_state(state)
+
+        # Rain since the state was written is counted after the restart
+        record = self._map(12)
+        self.assertEqual(2, record['rainCount'])
+        self.assertAlmostEqual(0.02, record['rain'])
+
+    def test_restore_across_day_change(self):
+        yesterday = time.strftime('%Y-%m-%d', time.localtime(self.now - 86400))
+        self.mapper.restore_state({'last_daily_rain_count': 50, 'day': yesterday})
+        self.assertIsNone(self.mapper.state)
+
+        # The daily count was reset at midnight, so the first count is only a baseline
+        record = self._map(3)
+        self.assertNotIn('rainCount', record)
+        self.assertNotIn('rain', record)
+
+        record = self._map(4)
+        self.assertEqual(1, record['rainCount'])
@@ -0,0 +1,84 @@
+# Copyright © 2020-2024 Michael Schantl and contributors
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Tests of the rolling wind statistics
+
+Run with `PYTHONPATH=bin python3 -m unittest discover tests`
+"""
+import unittest
+
+from user.weatherlink_live.wind import RollingMaximum, RollingVectorMean
+
+
+class RollingMaximumTest(unittest.TestCase):
+    def test_expires_samples_outside_window(self):
+        rolling = RollingMaximum(10)
+        rolling.add(100, 5.0, 90)
+        rolling.add(105, 3.0, 180)
+        rolling.add(110, 2.0, 270)
+
+        self.assertEqual((3.0, 180), rolling.maximum)
+
+    def test_interleaved_poll_and_push_timestamps(self):
+        rolling = RollingMaximum(10)
+        # Broadcasts every 2.5 seconds, a poll record arriving late with an older timestamp
+        rolling.add(100.0, 4.0, 'push')
+        rolling.add(102.5, 3.0, 'push')
+        rolling.add(101.0, 6.0, 'poll')
+        rolling.add(105.0, 2.0, 'push')
+
+        self.assertEqual((6.0, 'poll'), rolling.maximum)
+
+        # The late sample is kept until the window of the newest sample at its arrival has passed
+        rolling.add(112.0, 1.0, 'push')
+        self.assertEqual((6.0, 'poll'), rolling.maximum)
+        rolling.add(112.5, 1.0, 'push')
+        self.assertEqual((2.0, 'push'), rolling.maximum)
+
+        # Expiry still works for samples added in order afterwards
+        rolling.add(130.0, 1.5, 'push')
+        self.assertEqual((1.5, 'push'), rolling.maximum)
+
+    def test_drops_samples_older_than_window(self):
+        rolling = RollingMaximum(10)
+        rolling.add(120, 2.0, 'push')
+        rolling.add(105, 9.0, 'poll')
+
+        self.assertEqual((2.0, 'push'), rolling.maximum)
+
+
+class RollingVectorMeanTest(unittest.TestCase):
+    def test_interleaved_poll_and_push_timestamps(self):
+        rolling = RollingVectorMean(10)
+        rolling.add(100.0, 2.0, 90)
+        rolling.add(102.5, 4.0, 90)
+        rolling.add(101.0, 6.0, 90)
+        rolling.add(92.0, 100.0, 90)
+
+        self.assertAlmostEqual(4.0, rolling.speed)
+        self.assertAlmostEqual(90.0, rolling.direction)
+
+        rolling.add(112.5, 1.0, 90)
+        self.assertAlmostEqual(1.0, rolling.speed)
+
+
+if __name__ == '__main__':
+    unittest.main()
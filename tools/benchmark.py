@@ -0,0 +1,308 @@
+# Copyright © 2020-2024 Michael Schantl and contributors
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Benchmarks of packet creation and mapping
+
+Measures the throughput (packets per second) and memory allocation of every mapper type and of the complete path of
+creating a record (`DataHost._create_record`), for polled (HTTP) as well as broadcast (UDP) packets. Packets are built by
+the device simulator, so they have the same shape as real ones. The `logging/` benchmarks create records with
+`log_success` enabled and per-packet debug messages disabled, sampled, rate limited or all logged; with debug logging
+disabled, they should be as fast as `create_record/medium`.
+
+Usage:
+
+    python3 tools/benchmark.py --output results.json
+    python3 tools/benchmark.py --compare results.json
+
+WeeWX has to be importable. Results are written as JSON; comparing to a previous run reports throughput regressions
+and exits with status 1 if any benchmark got slower than the threshold.
+
+The allocation budgets for processing a packet of the reference configuration are enforced by the unit tests in
+`tests/test_allocations.py`.
+"""
+import argparse
+import gc
+import json
+import logging
+import os
+import platform
+import random
+import sys
+import threading
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Tuple
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "bin"))
+
+from wll_simulator import SimulatedStation, DST_ISS, DST_LEAF_SOIL  # noqa: E402
+from user.weatherlink_live import configuration  # noqa: E402
+from user.weatherlink_live.data_host import DataHost  # noqa: E402
+from user.weatherlink_live.packet_logging import configure_packet_logging  # noqa: E402
+from user.weatherlink_live.packets import WlHttpConditionsRequestPacket, WlUdpBroadcastPacket  # noqa: E402
+
+HOST = "benchmark"
+
+
+# Mapping options used for benchmarking a single mapper of each type
+MAPPER_OPTIONS = {
+    't': ['1'],
+    'th': ['1'],
+    'wind': ['1'],
+    'rain': ['1'],
+    'solar': ['1'],
+    'uv': ['1'],
+    'windchill': ['1'],
+    'thw': ['1'],
+    'thsw': ['1'],
+    'soil_temp': ['8', '1'],
+    'soil_moist': ['8', '1'],
+    'leaf_wet': ['8', '1'],
+    'th_indoor': [],
+    'baro': [],
+    'battery': ['1'],
+}
+
+# Transmitters and mappings from small to large installations
+CONFIGS = {
+    # Vantage Vue
+    'small': (
+        [(DST_ISS, 1)],
+        "th:1, rain:1, wind:1, windchill:1, thw:1:appTemp, battery:1, th_indoor, baro"
+    ),
+    # Vantage Pro2 Plus with soil/leaf station
+    'medium': (
+        [(DST_ISS, 1), (DST_LEAF_SOIL, 2)],
+        "th:1, rain:1, wind:1, uv:1, solar:1, windchill:1, thw:1, thsw:1:appTemp, soil_temp:2:1, soil_temp:2:2, "
+        "soil_temp:2:3, soil_temp:2:4, soil_moist:2:1, soil_moist:2:2, soil_moist:2:3, soil_moist:2:4, leaf_wet:2:1, "
+        "leaf_wet:2:2, th_indoor, baro, battery:1, battery:2"
+    ),
+    # Vantage Pro2 Plus, 6 additional temperature/humidity transmitters and a soil/leaf station
+    'large': (
+        [(DST_ISS, tx_id) for tx_id in range(1, 8)] + [(DST_LEAF_SOIL, 8)],
+        "th:1, rain:1, wind:1, uv:1, solar:1, windchill:1, thw:1, thsw:1:appTemp, th:2, th:3, th:4, th:5, th:6, th:7, "
+        "soil_temp:8:1, soil_temp:8:2, soil_temp:8:3, soil_temp:8:4, soil_moist:8:1, soil_moist:8:2, soil_moist:8:3, "
+        "soil_moist:8:4, leaf_wet:8:1, leaf_wet:8:2, th_indoor, baro, battery:1, battery:2, battery:3, battery:4, "
+        "battery:5, battery:6, battery:7, battery:8"
+    ),
+}
+
+
+def create_packets(transmitters: List[Tuple[int, int]], seed: int = 0) -> Dict[str, dict]:
+    """Create the JSON data of an HTTP and a UDP packet"""
+
+    station = SimulatedStation("001D0A700000", transmitters, random.Random(seed))
+    station.step(60)
+    return {
+        'http': station.current_conditions(),
+        'udp': station.broadcast(),
+    }
+
+
+def create_packet(source: str, json_data: dict):
+    if source == 'http':
+        return WlHttpConditionsRequestPacket.try_create(json_data, HOST)
+    return WlUdpBroadcastPacket.try_create(json_data, HOST)
+
+
+def create_mappers(mapping: str, log_success: bool = False):
+    definitions = configuration.parse_mapping_definitions([item.strip() for item in mapping.split(",")])
+    return configuration.create_mappers(definitions, log_success, False)
+
+
+def configure_logging(level: int = logging.WARNING, sampling: int = 1, rate_limit: int = 0) -> None:
+    """Log to /dev/null, so enabled messages are formatted without cluttering the output"""
+
+    root = logging.getLogger()
+    if not root.handlers:
+        root.addHandler(logging.StreamHandler(open(os.devnull, 'w')))
+    root.setLevel(level)
+    configure_packet_logging(sampling, rate_limit)
+
+
+def with_logging(func: Callable[[], None], level: int, sampling: int = 1, rate_limit: int = 0) -> Callable[[], None]:
+    """Mark a benchmark to be run with the given logging configuration"""
+
+    func.logging = (level, sampling, rate_limit)
+    return func
+
+
+def measure(func: Callable[[], None], min_time: float, repeat: int) -> Dict[str, float]:
+    """
+    Measure throughput and allocations of a function processing a single packet
+
+    The throughput is the best of `repeat` runs lasting at least `min_time` seconds each. `peak_bytes` is the peak of
+    memory allocated while processing a packet; `retained_blocks` is the count of memory blocks still allocated per
+    packet afterwards (should be 0).
+    """
+
+    # Calibrate the count of iterations per run
+    iterations = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(iterations):
+            func()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            break
+        iterations *= 2
+
+    best = elapsed
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(iterations):
+            func()
+        best = min(best, time.perf_counter() - start)
+
+    gc.collect()
+    blocks_before = sys.getallocatedblocks()
+    for _ in range(iterations):
+        func()
+    retained_blocks = (sys.getallocatedblocks() - blocks_before) / iterations
+
+    tracemalloc.start()
+    func()
+    tracemalloc.reset_peak()
+    current_before, _ = tracemalloc.get_traced_memory()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'packets_per_second': iterations / best,
+        'peak_bytes': peak - current_before,
+        'retained_blocks': round(retained_blocks, 3),
+    }
+
+
+def create_benchmarks() -> Dict[str, Callable[[], None]]:
+    benchmarks = dict()
+    large_packets = create_packets(CONFIGS['large'][0])
+
+    for source, json_data in large_packets.items():
+        def decode(source=source, data=json.dumps(json_data).encode("utf-8")):
+            create_packet(source, json.loads(data.decode("utf-8")))
+
+        benchmarks["packet/%s" % source] = decode
+
+    for mapper_type in configuration.MAPPERS.keys():
+        mapper = create_mappers(":".join([mapper_type] + MAPPER_OPTIONS[mapper_type]))[0]
+        for source, json_data in large_packets.items():
+            def map_packet(mapper=mapper, packet=create_packet(source, json_data)):
+                mapper.map(packet, dict())
+
+            benchmarks["mapper/%s/%s" % (mapper_type, source)] = map_packet
+
+    for config_name, (transmitters, mapping) in CONFIGS.items():
+        host = DataHost(create_mappers(mapping), threading.Event())
+        for source, json_data in create_packets(transmitters).items():
+            def create_record(host=host, packet=create_packet(source, json_data)):
+                host._create_record(packet)
+                host.pop_packet()
+
+            benchmarks["create_record/%s/%s" % (config_name, source)] = create_record
+
+            # Complete path of a received packet: decoding, creating the packet and the record
+            def process(host=host, source=source, data=json.dumps(json_data).encode("utf-8")):
+                host._create_record(create_packet(source, json.loads(data.decode("utf-8"))))
+                host.pop_packet()
+
+            benchmarks["process/%s/%s" % (config_name, source)] = process
+
+    # Creating records with log_success enabled; per-packet messages disabled, sampled, rate limited and all logged
+    transmitters, mapping = CONFIGS['medium']
+    logging_modes = {
+        'disabled': (logging.INFO, 1, 0),
+        'sampled': (logging.DEBUG, 100, 0),
+        'rate_limited': (logging.DEBUG, 1, 60),
+        'all': (logging.DEBUG, 1, 0),
+    }
+    host = DataHost(create_mappers(mapping, log_success=True), threading.Event())
+    for mode, (level, sampling, rate_limit) in logging_modes.items():
+        for source, json_data in create_packets(transmitters).items():
+            def create_record(host=host, packet=create_packet(source, json_data)):
+                host._create_record(packet)
+                host.pop_packet()
+
+            benchmarks["logging/%s/%s" % (mode, source)] = with_logging(create_record, level, sampling, rate_limit)
+
+    return benchmarks
+
+
+def compare(results: Dict[str, dict], baseline: Dict[str, dict], threshold: float) -> List[str]:
+    """Return names of benchmarks with a throughput regression"""
+
+    regressions = []
+    print("")
+    print("%-40s %14s %14s %8s" % ("Benchmark", "Baseline", "Current", "Change"))
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        before = baseline[name]['packets_per_second']
+        after = result['packets_per_second']
+        change = after / before - 1
+        marker = ""
+        if change < -threshold:
+            regressions.append(name)
+            marker = "  REGRESSION"
+        print("%-40s %14.0f %14.0f %+7.1f%%%s" % (name, before, after, change * 100, marker))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark packet creation and mapping")
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    parser.add_argument("--compare", metavar="FILE", help="Compare to results of a previous run")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="Relative throughput loss reported as regression. Default: 0.1")
+    parser.add_argument("--filter", default="", help="Only run benchmarks containing this text")
+    parser.add_argument("--min-time", type=float, default=0.2, help="Minimum duration of a run. Default: 0.2")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per benchmark. Default: 5")
+    args = parser.parse_args()
+
+    results = dict()
+    print("%-40s %14s %12s %10s" % ("Benchmark", "Packets/s", "Peak bytes", "Retained"))
+    for name, func in create_benchmarks().items():
+        if args.filter not in name:
+            continue
+        configure_logging(*getattr(func, 'logging', ()))
+        result = measure(func, args.min_time, args.repeat)
+        results[name] = result
+        print("%-40s %14.0f %12d %10.3f" % (
+            name, result['packets_per_second'], result['peak_bytes'], result['retained_blocks']))
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump({
+                'timestamp': int(time.time()),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'results': results,
+            }, file, indent=2)
+
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)['results']
+        if compare(results, baseline, args.threshold):
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
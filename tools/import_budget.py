@@ -0,0 +1,139 @@
+# Copyright © 2020-2024 Michael Schantl and contributors
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Check the startup cost of the driver
+
+Imports the driver the way WeeWX does (the package, then the driver module when the loader is called) in a fresh
+interpreter with `-X importtime` and fails if
+
+- a module only needed for HTTP requests, configuration or database creation is imported, or
+- importing the modules of the driver itself takes longer than the budget.
+
+Usage:
+
+    python3 tools/import_budget.py
+    python3 tools/import_budget.py --budget-ms 30 --top 20
+
+WeeWX has to be importable. Which modules are imported doesn't depend on the machine, so that check is suitable for CI.
+The time budget is generous by default, as import times vary between machines. The unit tests in
+`tests/test_import_budget.py` run the same checks.
+"""
+import argparse
+import os
+import subprocess
+import sys
+from typing import List, NamedTuple
+
+BIN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "bin")
+
+PACKAGE = "user.weatherlink_live"
+IMPORTS = [PACKAGE, "user.weatherlink_live.driver"]
+
+# Milliseconds importing the modules of the driver itself may take
+BUDGET_MS = 50.0
+
+# Modules which must only be loaded when needed
+FORBIDDEN_MODULES = [
+    "requests",
+    "weecfg",
+    "schemas",
+    "http.server",
+    "user.weatherlink_live.config_editor",
+    "user.weatherlink_live.configurator",
+    "user.weatherlink_live.database",
+    "user.weatherlink_live.db_schema",
+    "user.weatherlink_live.exporter",
+    "user.weatherlink_live.samples",
+    "user.weatherlink_live.cache",
+]
+
+
+class ImportTime(NamedTuple):
+    module: str
+    self_us: int
+    cumulative_us: int
+
+
+def measure_imports(python: str) -> List[ImportTime]:
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [os.path.abspath(BIN_DIR), env.get('PYTHONPATH')]))
+
+    process = subprocess.run([python, "-X", "importtime", "-c", "; ".join("import %s" % m for m in IMPORTS)],
+                             env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    if process.returncode != 0:
+        sys.stderr.write(process.stderr)
+        raise SystemExit("Importing the driver failed")
+
+    times = []
+    for line in process.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, module = line[len("import time:"):].split("|", 2)
+        times.append(ImportTime(module.strip(), int(self_us), int(cumulative_us)))
+    return times
+
+
+def is_module_or_submodule(module: str, parent: str) -> bool:
+    return module == parent or module.startswith(parent + ".")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the import time of the driver")
+    parser.add_argument("--budget-ms", type=float, default=BUDGET_MS,
+                        help="Maximum time spent importing modules of the driver itself. Default: %.0f" % BUDGET_MS)
+    parser.add_argument("--top", type=int, default=10, help="Number of slowest imports to list. Default: 10")
+    parser.add_argument("--python", default=sys.executable, help="Interpreter to check. Default: this one")
+    args = parser.parse_args()
+
+    times = measure_imports(args.python)
+
+    print("%-50s %10s %12s" % ("Module", "Self [ms]", "Total [ms]"))
+    for entry in sorted(times, key=lambda t: t.cumulative_us, reverse=True)[:args.top]:
+        print("%-50s %10.1f %12.1f" % (entry.module, entry.self_us / 1000, entry.cumulative_us / 1000))
+
+    total_us = sum(t.cumulative_us for t in times if t.module in IMPORTS)
+    own_us = sum(t.self_us for t in times if is_module_or_submodule(t.module, PACKAGE))
+    print("")
+    print("Total import time: %.1f ms" % (total_us / 1000))
+    print("Import time of the driver modules: %.1f ms (budget: %.1f ms)" % (own_us / 1000, args.budget_ms))
+
+    failures = []
+    imported = [t.module for t in times]
+    for forbidden in FORBIDDEN_MODULES:
+        for module in imported:
+            if is_module_or_submodule(module, forbidden):
+                failures.append("%s is imported on startup" % module)
+                break
+    if own_us / 1000 > args.budget_ms:
+        failures.append("Importing the driver modules took %.1f ms (budget: %.1f ms)" % (own_us / 1000,
+                                                                                         args.budget_ms))
+
+    print("")
+    for failure in failures:
+        print("Import budget exceeded: %s" % failure)
+    if failures:
+        sys.exit(1)
+    print("Import budget met")
+
+
+if __name__ == '__main__':
+    main()
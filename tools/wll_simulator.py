@@ -0,0 +1,438 @@
+# Copyright © 2020-2024 Michael Schantl and contributors
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Simulator of WeatherLink Live devices for testing the driver without hardware
+
+Every simulated device serves the local HTTP API (`/v1/current_conditions` and `/v1/real_time`) and sends UDP
+broadcasts after being requested to do so, just like a real WeatherLink Live. Payloads have the same shape as the ones
+of a real device: The HTTP API returns all data structures (ISS, LEAF_SOIL, WLL_BARO and WLL_TH), while broadcasts only
+contain the wind and rain data of ISS transmitters.
+
+Usage:
+
+    python3 tools/wll_simulator.py --transmitters iss:1,leaf_soil:2 --http-port 8080
+
+Then configure the driver with `host = 127.0.0.1:8080`.
+
+Only uses the Python standard library, so it can be run without WeeWX being installed.
+"""
+import argparse
+import json
+import logging
+import random
+import signal
+import socket
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import List, Optional, Tuple
+from urllib.parse import urlparse, parse_qs
+
+log = logging.getLogger("wll_simulator")
+
+BROADCAST_INTERVAL = 2.5  # seconds; as sent by a real device
+DEFAULT_BROADCAST_DURATION = 1200
+
+DST_ISS = 1
+DST_LEAF_SOIL = 2
+DST_WLL_BARO = 3
+DST_WLL_TH = 4
+
+TRANSMITTER_TYPES = {
+    'iss': DST_ISS,
+    'leaf_soil': DST_LEAF_SOIL,
+}
+
+RAIN_SIZE = 1  # Rain collector size: 0.01 in per count
+
+
+def _walk(rng: random.Random, value: float, step: float, minimum: float, maximum: float) -> float:
+    return min(max(value + rng.uniform(-step, step), minimum), maximum)
+
+
+class SimulatedTransmitter(object):
+    """Sensor transmitter with randomly changing observations"""
+
+    def __init__(self, dst: int, txid: int, rng: random.Random):
+        self.dst = dst
+        self.txid = txid
+        self.lsid = rng.randrange(100000, 999999)
+        self.rng = rng
+
+        self.temp = rng.uniform(40, 80)
+        self.hum = rng.uniform(30, 90)
+        self.wind_speed = rng.uniform(0, 10)
+        self.wind_dir = rng.uniform(0, 360)
+        self.wind_gust = self.wind_speed
+        self.wind_gust_dir = self.wind_dir
+        self.rain_rate = 0.0  # counts per hour
+        self.rain_daily = 0.0  # counts
+        self.solar_rad = rng.uniform(0, 800)
+        self.uv_index = rng.uniform(0, 8)
+        self.soil_temps = [rng.uniform(40, 70) for _ in range(4)]
+        self.soil_moists = [rng.uniform(0, 100) for _ in range(4)]
+        self.leaf_wets = [rng.uniform(0, 15) for _ in range(2)]
+
+    def step(self, dt: float):
+        """Advance the simulated weather by `dt` seconds"""
+
+        rng = self.rng
+        self.temp = _walk(rng, self.temp, 0.05 * dt, -20, 110)
+        self.hum = _walk(rng, self.hum, 0.1 * dt, 5, 100)
+        self.wind_speed = _walk(rng, self.wind_speed, 0.5 * dt, 0, 60)
+        self.wind_dir = (self.wind_dir + rng.uniform(-5, 5) * dt) % 360
+        if self.wind_speed >= self.wind_gust or rng.random() < 0.01 * dt:
+            self.wind_gust = self.wind_speed
+            self.wind_gust_dir = self.wind_dir
+        if rng.random() < 0.002 * dt:
+            # Rain starts or stops
+            self.rain_rate = rng.uniform(10, 200) if self.rain_rate == 0 else 0.0
+        self.rain_daily += self.rain_rate * dt / 3600
+        self.solar_rad = _walk(rng, self.solar_rad, 2 * dt, 0, 1200)
+        self.uv_index = _walk(rng, self.uv_index, 0.02 * dt, 0, 12)
+        self.soil_temps = [_walk(rng, value, 0.01 * dt, 20, 90) for value in self.soil_temps]
+        self.soil_moists = [_walk(rng, value, 0.05 * dt, 0, 200) for value in self.soil_moists]
+        self.leaf_wets = [_walk(rng, value, 0.05 * dt, 0, 15) for value in self.leaf_wets]
+
+    def _wind_and_rain(self) -> dict:
+        return {
+            "wind_speed_last": round(self.wind_speed, 2),
+            "wind_dir_last": int(self.wind_dir),
+            "rain_size": RAIN_SIZE,
+            "rain_rate_last": int(self.rain_rate),
+            "rainfall_daily": int(self.rain_daily),
+            "wind_speed_hi_last_10_min": round(self.wind_gust, 2),
+            "wind_dir_at_hi_speed_last_10_min": int(self.wind_gust_dir),
+        }
+
+    def current_conditions(self) -> dict:
+        """Entry of the `current_conditions` HTTP API"""
+
+        entry = {"lsid": self.lsid, "data_structure_type": self.dst, "txid": self.txid}
+        if self.dst == DST_ISS:
+            entry.update({
+                "temp": round(self.temp, 1),
+                "hum": round(self.hum, 1),
+                "dew_point": round(self.temp - (100 - self.hum) / 5 * 1.8, 1),
+                "wet_bulb": round(self.temp - (100 - self.hum) / 10, 1),
+                "heat_index": round(self.temp, 1),
+                "wind_chill": round(self.temp, 1),
+                "thw_index": round(self.temp, 1),
+                "thsw_index": round(self.temp, 1),
+                "wind_speed_avg_last_1_min": round(self.wind_speed, 2),
+                "wind_dir_scalar_avg_last_1_min": int(self.wind_dir),
+                "rain_rate_hi": int(self.rain_rate),
+                "rainfall_last_15_min": 0,
+                "rainfall_last_60_min": 0,
+                "rainfall_last_24_hr": int(self.rain_daily),
+                "solar_rad": int(self.solar_rad),
+                "uv_index": round(self.uv_index, 1),
+                "rx_state": 0,
+                "trans_battery_flag": 0,
+            })
+            entry.update(self._wind_and_rain())
+        elif self.dst == DST_LEAF_SOIL:
+            for i, value in enumerate(self.soil_temps):
+                entry["temp_%d" % (i + 1)] = round(value, 1)
+            for i, value in enumerate(self.soil_moists):
+                entry["moist_soil_%d" % (i + 1)] = round(value, 1)
+            for i, value in enumerate(self.leaf_wets):
+                entry["wet_leaf_%d" % (i + 1)] = round(value, 1)
+            entry["rx_state"] = 0
+            entry["trans_battery_flag"] = 0
+        return entry
+
+    def broadcast_conditions(self) -> Optional[dict]:
+        """Entry of a UDP broadcast; only ISS transmitters are broadcast"""
+
+        if self.dst != DST_ISS:
+            return None
+
+        entry = {"lsid": self.lsid, "data_structure_type": self.dst, "txid": self.txid}
+        entry.update(self._wind_and_rain())
+        entry.update({
+            "rain_15_min": 0,
+            "rain_60_min": 0,
+            "rain_24_hr": int(self.rain_daily),
+            "rain_storm": int(self.rain_daily),
+            "rain_storm_start_at": None,
+            "rainfall_monthly": int(self.rain_daily),
+            "rainfall_year": int(self.rain_daily),
+        })
+        return entry
+
+
+class SimulatedStation(object):
+    """Data of a WeatherLink Live: its transmitters and its own indoor and barometer sensors"""
+
+    def __init__(self, device_id: str, transmitters: List[Tuple[int, int]], rng: random.Random):
+        self.device_id = device_id
+        self.rng = rng
+        self.transmitters = [SimulatedTransmitter(dst, txid, rng) for dst, txid in transmitters]
+
+        self.temp_in = rng.uniform(65, 75)
+        self.hum_in = rng.uniform(30, 50)
+        self.bar_sea_level = rng.uniform(29.5, 30.5)
+
+    def step(self, dt: float):
+        """Advance the simulated weather by `dt` seconds"""
+
+        for transmitter in self.transmitters:
+            transmitter.step(dt)
+        self.temp_in = _walk(self.rng, self.temp_in, 0.01 * dt, 60, 85)
+        self.hum_in = _walk(self.rng, self.hum_in, 0.02 * dt, 20, 70)
+        self.bar_sea_level = _walk(self.rng, self.bar_sea_level, 0.0005 * dt, 28.5, 31.0)
+
+    def current_conditions(self) -> dict:
+        """Response of the `current_conditions` HTTP API"""
+
+        conditions = [transmitter.current_conditions() for transmitter in self.transmitters]
+        conditions.append({
+            "lsid": 1,
+            "data_structure_type": DST_WLL_TH,
+            "temp_in": round(self.temp_in, 1),
+            "hum_in": round(self.hum_in, 1),
+            "dew_point_in": round(self.temp_in - (100 - self.hum_in) / 5 * 1.8, 1),
+            "heat_index_in": round(self.temp_in, 1),
+        })
+        conditions.append({
+            "lsid": 2,
+            "data_structure_type": DST_WLL_BARO,
+            "bar_sea_level": round(self.bar_sea_level, 3),
+            "bar_trend": 0.0,
+            "bar_absolute": round(self.bar_sea_level - 0.1, 3),
+        })
+        return {"data": {"did": self.device_id, "ts": int(time.time()), "conditions": conditions}, "error": None}
+
+    def broadcast(self) -> dict:
+        """UDP broadcast packet"""
+
+        conditions = [entry for entry in (transmitter.broadcast_conditions() for transmitter in self.transmitters)
+                      if entry is not None]
+        return {"did": self.device_id, "ts": int(time.time()), "conditions": conditions}
+
+
+class SimulatedDevice(object):
+    """WeatherLink Live with its HTTP server and broadcast thread"""
+
+    def __init__(self, index: int, args: argparse.Namespace, transmitters: List[Tuple[int, int]]):
+        self.args = args
+        self.device_id = "001D0A7%05X" % index
+        self.rng = random.Random(None if args.seed is None else args.seed + index)
+        self.station = SimulatedStation(self.device_id, transmitters, self.rng)
+
+        self.http_port = args.http_port + index
+        self.broadcast_port = args.broadcast_port + index
+        self.broadcast_until = 0.0
+        self.last_step = time.monotonic()
+
+        self.lock = threading.Lock()
+        self.stats = {"http": 0, "http_errors": 0, "broadcasts": 0, "lost": 0, "malformed": 0}
+
+        self.server = ThreadingHTTPServer((args.bind, self.http_port), _DeviceRequestHandler)
+        self.server.daemon_threads = True
+        self.server.device = self
+
+        self.stop_signal = threading.Event()
+        self.threads = [
+            threading.Thread(name="HTTP-%s" % self.device_id, target=self.server.serve_forever, daemon=True),
+            threading.Thread(name="UDP-%s" % self.device_id, target=self._broadcast, daemon=True),
+        ]
+
+    def start(self):
+        for thread in self.threads:
+            thread.start()
+        log.info("Device %s: HTTP on %s:%d, broadcasts to %s:%d", self.device_id, self.args.bind, self.http_port,
+                 self.args.broadcast_address, self.broadcast_port)
+
+    def stop(self):
+        self.stop_signal.set()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _step(self):
+        with self.lock:
+            now = time.monotonic()
+            self.station.step((now - self.last_step) * self.args.acceleration)
+            self.last_step = now
+
+    def current_conditions(self) -> dict:
+        self._step()
+        return self.station.current_conditions()
+
+    def start_broadcast(self, duration: int) -> dict:
+        self.broadcast_until = time.monotonic() + duration
+        return {"data": {"broadcast_port": self.broadcast_port, "duration": duration}, "error": None}
+
+    def _broadcast(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        interval = BROADCAST_INTERVAL / self.args.acceleration
+
+        while not self.stop_signal.wait(interval):
+            if time.monotonic() > self.broadcast_until:
+                continue
+
+            self._step()
+            data = json.dumps(self.station.broadcast(), separators=(',', ':')).encode("utf-8")
+
+            if self.rng.random() < self.args.loss:
+                self.stats["lost"] += 1
+                continue
+            if self.rng.random() < self.args.malformed_rate:
+                self.stats["malformed"] += 1
+                data = data[:self.rng.randrange(len(data))]
+
+            try:
+                sock.sendto(data, (self.args.broadcast_address, self.broadcast_port))
+                self.stats["broadcasts"] += 1
+            except OSError as e:
+                log.error("Device %s: could not send broadcast: %s", self.device_id, e)
+        sock.close()
+
+
+class _DeviceRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        device: SimulatedDevice = self.server.device
+        args = device.args
+        device.stats["http"] += 1
+
+        if args.latency > 0:
+            time.sleep(args.latency * device.rng.uniform(0.5, 1.5))
+
+        url = urlparse(self.path)
+        if url.path == "/v1/current_conditions":
+            response = device.current_conditions()
+        elif url.path == "/v1/real_time":
+            duration = parse_qs(url.query).get("duration", [DEFAULT_BROADCAST_DURATION])[0]
+            try:
+                response = device.start_broadcast(int(duration))
+            except ValueError:
+                self._send(400, {"data": None, "error": {"code": 400, "message": "Invalid duration"}})
+                return
+        else:
+            self._send(404, {"data": None, "error": {"code": 404, "message": "Not found"}})
+            return
+
+        if device.rng.random() < args.http_failure_rate:
+            device.stats["http_errors"] += 1
+            self._send_raw(500, b"Internal Server Error")
+        elif device.rng.random() < args.http_error_rate:
+            device.stats["http_errors"] += 1
+            self._send(200, {"data": None, "error": {"code": 409, "message": "Simulated error"}})
+        else:
+            self._send(200, response)
+
+    def _send(self, status: int, response: dict):
+        self._send_raw(status, json.dumps(response).encode("utf-8"), "application/json")
+
+    def _send_raw(self, status: int, body: bytes, content_type: str = "text/plain"):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        log.debug("%s: " + format, self.address_string(), *args)
+
+
+def parse_transmitters(value: str) -> List[Tuple[int, int]]:
+    """Parse transmitter list like `iss:1,leaf_soil:2`"""
+
+    transmitters = []
+    for item in value.split(","):
+        try:
+            type_name, txid = item.strip().split(":")
+            transmitters.append((TRANSMITTER_TYPES[type_name.strip().lower()], int(txid)))
+        except (KeyError, ValueError):
+            raise argparse.ArgumentTypeError(
+                "Invalid transmitter %s. Expected <type>:<txid> with type one of: %s" % (
+                    repr(item), ", ".join(TRANSMITTER_TYPES.keys())))
+    return transmitters
+
+
+def _probability(value: str) -> float:
+    probability = float(value)
+    if not 0 <= probability <= 1:
+        raise argparse.ArgumentTypeError("Has to be between 0 and 1")
+    return probability
+
+
+def create_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Simulate WeatherLink Live devices (HTTP API and UDP broadcasts)")
+    parser.add_argument("--devices", type=int, default=1,
+                        help="Count of simulated devices. Ports are incremented for each further device. "
+                             "Default: 1")
+    parser.add_argument("--transmitters", type=parse_transmitters, default=parse_transmitters("iss:1"),
+                        help="Transmitters of each device as comma-separated <type>:<txid>. Types: %s. "
+                             "Default: iss:1" % ", ".join(TRANSMITTER_TYPES.keys()))
+    parser.add_argument("--bind", default="127.0.0.1", help="Address of the HTTP servers. Default: 127.0.0.1")
+    parser.add_argument("--http-port", type=int, default=8080, help="HTTP port of the first device. Default: 8080")
+    parser.add_argument("--broadcast-address", default="127.0.0.1",
+                        help="Destination of UDP broadcasts, e.g. 255.255.255.255. Default: 127.0.0.1")
+    parser.add_argument("--broadcast-port", type=int, default=22222,
+                        help="UDP broadcast port of the first device. Default: 22222")
+    parser.add_argument("--acceleration", type=float, default=1.0,
+                        help="Factor for speeding up broadcasts and weather changes. Default: 1")
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="Mean latency of HTTP responses in seconds. Default: 0")
+    parser.add_argument("--http-error-rate", type=_probability, default=0.0,
+                        help="Probability of HTTP responses reporting an error. Default: 0")
+    parser.add_argument("--http-failure-rate", type=_probability, default=0.0,
+                        help="Probability of HTTP responses failing with status 500. Default: 0")
+    parser.add_argument("--loss", type=_probability, default=0.0,
+                        help="Probability of dropping a UDP broadcast. Default: 0")
+    parser.add_argument("--malformed-rate", type=_probability, default=0.0,
+                        help="Probability of sending a truncated UDP broadcast. Default: 0")
+    parser.add_argument("--broadcast", action="store_true",
+                        help="Broadcast right from the start instead of waiting for a real_time request")
+    parser.add_argument("--seed", type=int, default=None, help="Seed for reproducible simulations")
+    parser.add_argument("--verbose", action="store_true", help="Log every request")
+    return parser
+
+
+def main():
+    args = create_parser().parse_args()
+    if args.acceleration <= 0:
+        raise SystemExit("Acceleration has to be positive")
+
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO,
+                        format="%(asctime)s %(levelname)s %(message)s")
+
+    devices = [SimulatedDevice(index, args, args.transmitters) for index in range(args.devices)]
+    for device in devices:
+        if args.broadcast:
+            device.start_broadcast(DEFAULT_BROADCAST_DURATION * 1000)
+        device.start()
+
+    stop = threading.Event()
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    stop.wait()
+
+    for device in devices:
+        device.stop()
+        log.info("Device %s: %s", device.device_id, device.stats)
+
+
+if __name__ == '__main__':
+    main()